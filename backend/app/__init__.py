@@ -9,6 +9,8 @@ from app.routes.chat import chat_bp
 from app.routes.chat_rooms import chat_rooms_bp
 from app.routes.anomaly import anomaly_bp
 from app.routes.visualization import visualization_bp
+from app.routes.cube import cube_bp
+from app.routes.jobs import jobs_bp
 from app.config import Config
 
 def create_app():
@@ -31,6 +33,8 @@ def create_app():
     app.register_blueprint(chat_rooms_bp)
     app.register_blueprint(anomaly_bp)
     app.register_blueprint(visualization_bp)
+    app.register_blueprint(cube_bp)
+    app.register_blueprint(jobs_bp)
 
     # Error handlers for database issues
     @app.errorhandler(ServerSelectionTimeoutError)
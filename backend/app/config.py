@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -8,6 +9,71 @@ class Config:
     MONGO_URI = os.getenv("MONGO_URI")
     JWT_SECRET = os.getenv("JWT_SECRET", "fallback_jwt_secret")
     OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
+
+    # Seconds a loaded ledger snapshot is trusted before re-probing the data version
+    LEDGER_VERSION_TTL = float(os.getenv("LEDGER_VERSION_TTL", "30"))
+
+    # Seconds between full row checksums of the snapshot against finance_expense before appending
+    # new rows; the trigger-maintained data version already catches rewrites (0 checks every refresh)
+    LEDGER_CHECKSUM_INTERVAL = float(os.getenv("LEDGER_CHECKSUM_INTERVAL", "3600"))
+
+    # Local directory for the memory-mapped ledger file shared by gunicorn workers (empty disables it)
+    LEDGER_SNAPSHOT_DIR = os.getenv("LEDGER_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "finance_ledger"))
+
+    # Shortest gap in seconds between background refreshes of stale rollup materialized views
+    ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", "300"))
+
+    # "sql" pushes the /eda aggregations into PostgreSQL, "snapshot" computes them in pandas,
+    # "stream" aggregates chunk by chunk through a server-side cursor for ledgers larger than RAM
+    EDA_BACKEND = os.getenv("EDA_BACKEND", "sql")
+    LEDGER_CHUNK_SIZE = int(os.getenv("LEDGER_CHUNK_SIZE", "50000"))
+
+    # Directory for fitted anomaly models, persisted per data version (empty disables it)
+    MODEL_STORE_DIR = os.getenv("MODEL_STORE_DIR", os.path.join(tempfile.gettempdir(), "finance_models"))
+
+    # Isolation forest parallelism: n_jobs of the ledger-wide forest (-1 uses every core), threads
+    # fitting per-shard forests (0 = one per core) and the smallest shard given its own forest
+    ANOMALY_ML_N_JOBS = int(os.getenv("ANOMALY_ML_N_JOBS", "-1"))
+    ANOMALY_SHARD_WORKERS = int(os.getenv("ANOMALY_SHARD_WORKERS", "0"))
+    ANOMALY_SHARD_MIN_ROWS = int(os.getenv("ANOMALY_SHARD_MIN_ROWS", "50"))
+
+    # RCA random forest parallelism: n_jobs for fitting and for the per-tree predictions (-1 uses every core)
+    RCA_N_JOBS = int(os.getenv("RCA_N_JOBS", "-1"))
+
+    # RCA forests of filtered requests kept per worker (least recently used dropped first);
+    # only the unfiltered forest is persisted to MODEL_STORE_DIR
+    RCA_FILTERED_MODELS = int(os.getenv("RCA_FILTERED_MODELS", "8"))
+
+    # Groups with fewer postings are scored against the ledger-wide median/MAD in grouped z-score mode
+    ANOMALY_MIN_GROUP_SIZE = int(os.getenv("ANOMALY_MIN_GROUP_SIZE", "10"))
+
+    # Column the streaming scorer keeps running per-group statistics for, and seconds an id skipped
+    # below its watermark is re-read on polls in case its transaction commits late
+    ANOMALY_STREAM_GROUP_BY = os.getenv("ANOMALY_STREAM_GROUP_BY", "cost_center_id")
+    ANOMALY_STREAM_GAP_TTL = float(os.getenv("ANOMALY_STREAM_GAP_TTL", "600"))
+
+    # How comprehensive analysis runs its three detectors: "thread" or "serial"
+    ANOMALY_DETECTOR_EXECUTOR = os.getenv("ANOMALY_DETECTOR_EXECUTOR", "thread")
+
+    # Analysis results cached per (endpoint, parameters, ledger data version): "memory" keeps an
+    # LRU per worker, "mongo" also shares results between workers, "off" disables the cache
+    RESULT_CACHE_BACKEND = os.getenv("RESULT_CACHE_BACKEND", "memory")
+    RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "256"))
+    RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", "86400"))
+
+    # Background analysis jobs: concurrent jobs per worker, seconds a finished job is kept,
+    # and the longest a status request may block waiting for a job to finish
+    JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+    JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", "86400"))
+    JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "25"))
+    # Seconds between heartbeats of the worker running a job, and without one after which
+    # the job is marked failed because its worker died
+    JOB_HEARTBEAT_INTERVAL = float(os.getenv("JOB_HEARTBEAT_INTERVAL", "10"))
+    JOB_STALE_AFTER = float(os.getenv("JOB_STALE_AFTER", "60"))
+
+    # Flagged rows serialized per chunk by the streamed /anomaly/export response
+    ANOMALY_EXPORT_CHUNK_SIZE = int(os.getenv("ANOMALY_EXPORT_CHUNK_SIZE", "5000"))
     
     # CORS origins configuration
     CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:3000,http://localhost:4173,http://127.0.0.1:3000,http://127.0.0.1:4173,https://insignia-question-1.pages.dev").split(",")
\ No newline at end of file
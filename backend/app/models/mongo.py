@@ -1,5 +1,5 @@
 from pymongo import MongoClient
-from pymongo.errors import ServerSelectionTimeoutError, ConnectionFailure
+from pymongo.errors import ServerSelectionTimeoutError, ConnectionFailure, DuplicateKeyError
 from bson.objectid import ObjectId
 from datetime import datetime
 from app.config import Config
@@ -23,6 +23,9 @@ except Exception as e:
 user_collection = db['users']
 chat_rooms_collection = db['chat_rooms']
 chat_messages_collection = db['chat_messages']
+analysis_cache_collection = db['analysis_cache']
+analysis_jobs_collection = db['analysis_jobs']
+stream_scorer_collection = db['stream_scorer_state']
 
 # Chat Room Model
 class ChatRoom:
@@ -201,4 +204,126 @@ class ChatMessage:
             {"_id": ObjectId(room_id)},
             {"$set": {"message_count": 0, "updated_at": datetime.utcnow()}}
         )
-        return result.deleted_count
\ No newline at end of file
+        return result.deleted_count
+
+# Analysis Job Model
+class AnalysisJob:
+    @staticmethod
+    def ensure_indexes():
+        """Jobs are deleted by MongoDB once their expires_at has passed"""
+        analysis_jobs_collection.create_index("expires_at", expireAfterSeconds=0)
+        analysis_jobs_collection.create_index([("username", 1), ("created_at", -1)])
+
+    @staticmethod
+    def create_job(username, kind, params, expires_at, owner):
+        """Record a queued job of the worker `owner` and return its id"""
+        now = datetime.utcnow()
+        job_data = {
+            "username": username,
+            "kind": kind,
+            "params": params,
+            "status": "queued",
+            "progress": 0.0,
+            "message": None,
+            "result": None,
+            "error": None,
+            "owner": owner,
+            "heartbeat_at": now,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "expires_at": expires_at
+        }
+        result = analysis_jobs_collection.insert_one(job_data)
+        return str(result.inserted_id)
+
+    @staticmethod
+    def update_job(job_id, **fields):
+        """Set fields of a job; False if the write failed (e.g. a result over the document size limit)"""
+        try:
+            analysis_jobs_collection.update_one({"_id": ObjectId(job_id)}, {"$set": fields})
+            return True
+        except:
+            return False
+
+    @staticmethod
+    def touch_jobs(job_ids, statuses):
+        """Renew the heartbeat of those jobs that are still in one of `statuses`"""
+        analysis_jobs_collection.update_many(
+            {"_id": {"$in": [ObjectId(job_id) for job_id in job_ids]}, "status": {"$in": list(statuses)}},
+            {"$set": {"heartbeat_at": datetime.utcnow()}}
+        )
+
+    @staticmethod
+    def fail_stale_jobs(username, statuses, cutoff, error):
+        """Mark jobs of the user in one of `statuses` whose last heartbeat is older than
+        cutoff (or that never had one) failed; returns how many were"""
+        result = analysis_jobs_collection.update_many(
+            {
+                "username": username,
+                "status": {"$in": list(statuses)},
+                "$or": [{"heartbeat_at": {"$lt": cutoff}}, {"heartbeat_at": None}]
+            },
+            {"$set": {"status": "failed", "error": error, "finished_at": datetime.utcnow()}}
+        )
+        return result.modified_count
+
+    @staticmethod
+    def get_job(job_id, username):
+        """Get a job if it belongs to the user"""
+        try:
+            job = analysis_jobs_collection.find_one({
+                "_id": ObjectId(job_id),
+                "username": username
+            })
+        except:
+            return None
+        if not job:
+            return None
+        job["id"] = str(job.pop("_id"))
+        return job
+
+    @staticmethod
+    def get_user_jobs(username, limit=20):
+        """Most recent jobs of a user, without their results"""
+        jobs = analysis_jobs_collection.find(
+            {"username": username}, {"result": 0}
+        ).sort("created_at", -1).limit(limit)
+
+        jobs_list = []
+        for job in jobs:
+            job["id"] = str(job.pop("_id"))
+            jobs_list.append(job)
+        return jobs_list
+
+# Streaming Anomaly Scorer State Model
+class StreamScorerState:
+    @staticmethod
+    def get_revision(key):
+        """Revision of the stored scorer state, or 0 if there is none"""
+        document = stream_scorer_collection.find_one({"_id": key}, {"revision": 1})
+        return document["revision"] if document else 0
+
+    @staticmethod
+    def get_state(key):
+        """(revision, plain-data scorer state) of the stored state, or (0, None)"""
+        document = stream_scorer_collection.find_one({"_id": key}, {"revision": 1, "state": 1})
+        if not document:
+            return 0, None
+        return document["revision"], document["state"]
+
+    @staticmethod
+    def save_state(key, revision, state, **fields):
+        """Store the state if the stored revision is still `revision` (0: none stored yet).
+
+        Returns False when another worker stored a newer state first.
+        """
+        fields.update({"state": state, "revision": revision + 1, "updated_at": datetime.utcnow()})
+        if revision == 0:
+            try:
+                stream_scorer_collection.insert_one({"_id": key, **fields})
+                return True
+            except DuplicateKeyError:
+                return False
+        result = stream_scorer_collection.update_one({"_id": key, "revision": revision}, {"$set": fields})
+        return result.matched_count == 1
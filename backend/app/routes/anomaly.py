@@ -1,6 +1,12 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required
-from app.services.anomaly_service import get_anomaly_analysis
+from app.services.anomaly_service import (
+    get_anomaly_analysis, get_anomaly_export, iter_anomaly_export, score_postings, refresh_shard_models,
+    detector_params, EXPORT_FORMATS
+)
+from app.services.anomaly_stream_service import score_posting_batch, score_new_postings, get_stream_status
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError, number_arg
+from app.services.result_cache import get_cached_result, analysis_params
 
 anomaly_bp = Blueprint('anomaly', __name__)
 
@@ -11,13 +17,23 @@ def detect_anomalies():
     method = request.args.get('method', 'comprehensive')
 
     try:
-        result = get_anomaly_analysis(method=method)
+        params = detector_params(method, request.args)
+        filters = LedgerFilter.from_args(request.args)
+        result = get_cached_result(
+            'anomaly/detect', analysis_params(filters, {"method": method, **params}),
+            lambda: get_anomaly_analysis(method=method, filters=filters, params=params)
+        )
         return jsonify({
             "status": "success",
             "method": method,
             "parameters": request.args.to_dict(),
             "data": result
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -28,16 +44,27 @@ def detect_anomalies():
 @jwt_required()
 def statistical_anomalies():
     try:
-        threshold = float(request.args.get('threshold', 2.5))
-        result = get_anomaly_analysis(method='statistical')
+        params = detector_params('statistical', request.args)
+        filters = LedgerFilter.from_args(request.args)
+        result = get_cached_result(
+            'anomaly/statistical', analysis_params(filters, params),
+            lambda: get_anomaly_analysis(method='statistical', filters=filters, params=params)
+        )
         return jsonify({
             "status": "success",
             "method": "statistical",
             "parameters": {
-                "threshold": threshold
+                "threshold": params["threshold"],
+                "group_by": params.get("group_by"),
+                "filters": filters.to_dict()
             },
             "data": result
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -48,16 +75,27 @@ def statistical_anomalies():
 @jwt_required()
 def ml_anomalies():
     try:
-        contamination = float(request.args.get('contamination', 0.05))
-        result = get_anomaly_analysis(method='ml')
+        params = detector_params('ml', request.args)
+        filters = LedgerFilter.from_args(request.args)
+        result = get_cached_result(
+            'anomaly/ml', analysis_params(filters, params),
+            lambda: get_anomaly_analysis(method='ml', filters=filters, params=params)
+        )
         return jsonify({
             "status": "success",
             "method": "ml",
             "parameters": {
-                "contamination": contamination
+                "contamination": params["contamination"],
+                "shard_by": params.get("shard_by"),
+                "filters": filters.to_dict()
             },
             "data": result
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -68,18 +106,199 @@ def ml_anomalies():
 @jwt_required()
 def trend_anomalies():
     try:
-        threshold_pct = float(request.args.get('threshold_pct', 30.0))
-        result = get_anomaly_analysis(method='trend')
+        params = detector_params('trend', request.args)
+        filters = LedgerFilter.from_args(request.args)
+        result = get_cached_result(
+            'anomaly/trends', analysis_params(filters, params),
+            lambda: get_anomaly_analysis(method='trend', filters=filters, params=params)
+        )
         return jsonify({
             "status": "success",
             "method": "trend",
             "parameters": {
-                "threshold_pct": threshold_pct
+                "threshold_pct": params["threshold_pct"],
+                "trend_by": params.get("trend_by"),
+                "filters": filters.to_dict()
             },
             "data": result
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@anomaly_bp.route('/anomaly/ml/score', methods=['GET'])
+@jwt_required()
+def score_ml_anomalies():
+    """Score new postings or a filtered slice against the stored isolation forest"""
+    try:
+        contamination = detector_params('ml', request.args)["contamination"]
+        since_id = number_arg(request.args, 'since_id', None, int)
+        limit = number_arg(request.args, 'limit', 100, int)
+        filters = LedgerFilter.from_args(request.args)
+        result = score_postings(since_id=since_id, contamination=contamination, filters=filters, limit=limit)
+        return jsonify({
+            "status": "success",
+            "method": "ml_score",
+            "parameters": {
+                "contamination": contamination,
+                "since_id": since_id,
+                "limit": limit,
+                "filters": filters.to_dict()
+            },
+            "data": result
+        })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@anomaly_bp.route('/anomaly/ml/shards/refresh', methods=['POST'])
+@jwt_required()
+def refresh_ml_shards():
+    """Refit the per-shard isolation forests of the named shards"""
+    try:
+        data = request.get_json(silent=True) or {}
+        params = detector_params('ml', {'shard_by': 'directorate', **data})
+        if not params.get('shard_by'):
+            raise InvalidParameterError("shard_by is required")
+        shards = data.get('shards') or []
+        if not isinstance(shards, list):
+            shards = [shards]
+        result = refresh_shard_models(
+            shard_by=params['shard_by'],
+            shards=shards,
+            contamination=params['contamination']
+        )
+        return jsonify({
+            "status": "success",
+            "data": result
+        })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@anomaly_bp.route('/anomaly/stream', methods=['POST'])
+@jwt_required()
+def stream_anomalies():
+    """Score a batch of new postings against the running statistics; polls absorb them once stored"""
+    try:
+        data = request.get_json(silent=True) or {}
+        postings = data.get('postings')
+        if not isinstance(postings, list):
+            raise InvalidParameterError("postings must be a list of ledger rows")
+        threshold = number_arg(data, 'threshold', 2.5)
+        result = score_posting_batch(postings, threshold=threshold, limit=number_arg(data, 'limit', 100, int))
+        return jsonify({
+            "status": "success",
+            "method": "stream",
+            "data": result
+        })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@anomaly_bp.route('/anomaly/stream/poll', methods=['POST'])
+@jwt_required()
+def poll_stream_anomalies():
+    """Score the postings loaded into the database since the last streamed batch"""
+    try:
+        data = request.get_json(silent=True) or {}
+        threshold = number_arg(data, 'threshold', 2.5)
+        result = score_new_postings(threshold=threshold, limit=number_arg(data, 'limit', 100, int))
+        return jsonify({
+            "status": "success",
+            "method": "stream",
+            "data": result
+        })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
             "message": str(e)
         }), 500
+
+@anomaly_bp.route('/anomaly/stream/status', methods=['GET'])
+@jwt_required()
+def stream_status():
+    try:
+        return jsonify({
+            "status": "success",
+            "data": get_stream_status()
+        })
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@anomaly_bp.route('/anomaly/export', methods=['GET'])
+@jwt_required()
+def export_anomalies():
+    """Stream every flagged row of the statistical or ML detector as NDJSON or CSV"""
+    method = request.args.get('method', 'statistical')
+    fmt = request.args.get('format', 'ndjson')
+
+    try:
+        if fmt not in EXPORT_FORMATS:
+            raise InvalidParameterError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORT_FORMATS)}")
+        if method not in ('statistical', 'ml'):
+            raise InvalidParameterError(f"Unknown export method '{method}', expected 'statistical' or 'ml'")
+        params = detector_params(method, request.args)
+        limit = number_arg(request.args, 'limit', None, int)
+        anomalies, total = get_anomaly_export(
+            method=method,
+            filters=LedgerFilter.from_args(request.args),
+            offset=max(number_arg(request.args, 'offset', 0, int), 0),
+            limit=max(limit, 0) if limit is not None else None,
+            **params
+        )
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+    return Response(
+        stream_with_context(iter_anomaly_export(anomalies, fmt)),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={
+            "Content-Disposition": f"attachment; filename=anomalies_{method}.{fmt}",
+            "X-Total-Count": str(total)
+        }
+    )
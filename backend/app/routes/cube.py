@@ -0,0 +1,95 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required
+from app.services.cube_service import query_cube, get_cube_metadata
+from app.services.rca_service import perform_drill_down_rca
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError, number_arg, month_arg
+from app.services.result_cache import get_cached_result, analysis_params
+
+cube_bp = Blueprint('cube', __name__)
+
+@cube_bp.route('/cube/query', methods=['POST'])
+@jwt_required()
+def cube_query():
+    """Slice, dice, roll up or drill down the aggregate ledger cube"""
+    data = request.get_json(silent=True) or {}
+    try:
+        result = query_cube(
+            measures=data.get('measures'),
+            group_by=data.get('group_by'),
+            filters=data.get('filters'),
+            time_range=data.get('time_range'),
+            order_by=data.get('order_by'),
+            limit=number_arg(data, 'limit', None, int)
+        )
+        return jsonify({
+            "status": "success",
+            "data": result
+        })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@cube_bp.route('/cube/drilldown', methods=['POST'])
+@jwt_required()
+def cube_drilldown():
+    """Search the directorate > cost center > GL account > supplier hierarchy for the
+    combinations that explain the change in spend between two months"""
+    data = request.get_json(silent=True) or {}
+    from_month = data.get('from_month')
+    to_month = data.get('to_month')
+
+    if not all([from_month, to_month]):
+        return jsonify({
+            "status": "error",
+            "message": "Missing required parameters: from_month, to_month"
+        }), 400
+
+    try:
+        # Filters (directorate, cost_center, ...) may come in the body or the query string
+        filters = LedgerFilter.from_args({**request.args.to_dict(flat=False), **data})
+        from_month, to_month = month_arg(data, 'from_month'), month_arg(data, 'to_month')
+        threshold = number_arg(data, 'threshold', 0.05)
+        max_depth = number_arg(data, 'max_depth', None, int)
+        limit = number_arg(data, 'limit', 20, int)
+        result = get_cached_result(
+            'cube/drilldown', analysis_params(filters, {
+                'from_month': from_month, 'to_month': to_month,
+                'threshold': threshold, 'max_depth': max_depth, 'limit': limit,
+            }),
+            lambda: perform_drill_down_rca(from_month, to_month, filters, threshold, max_depth, limit)
+        )
+        return jsonify({
+            "status": "success",
+            "data": result
+        })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@cube_bp.route('/cube/metadata', methods=['GET'])
+@jwt_required()
+def cube_metadata():
+    try:
+        return jsonify({
+            "status": "success",
+            "data": get_cube_metadata()
+        })
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
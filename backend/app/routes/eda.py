@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required
-from app.services.eda_service import get_eda_summary, get_detailed_breakdown, get_time_series_analysis
+from app.services.eda_service import get_eda_summary, get_detailed_breakdown, get_time_series_analysis, time_series_key
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError, number_arg
+from app.services.result_cache import get_cached_result, analysis_params
 
 eda_bp = Blueprint('eda', __name__)
 
@@ -8,28 +10,41 @@ eda_bp = Blueprint('eda', __name__)
 @jwt_required()
 def eda():
     try:
-        summary = get_eda_summary()
+        filters = LedgerFilter.from_args(request.args)
+        summary = get_cached_result('eda', analysis_params(filters), lambda: get_eda_summary(filters))
         return jsonify(summary)
+    except InvalidParameterError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @eda_bp.route('/eda/breakdown/<dimension>', methods=['GET'])
 @jwt_required()
 def detailed_breakdown(dimension):
-    top_n = request.args.get('top_n', 10, type=int)
-    
     try:
-        breakdown = get_detailed_breakdown(dimension, top_n)
+        top_n = number_arg(request.args, 'top_n', 10, int)
+        filters = LedgerFilter.from_args(request.args)
+        breakdown = get_cached_result(
+            f'eda/breakdown/{dimension}', analysis_params(filters, {'top_n': top_n}),
+            lambda: get_detailed_breakdown(dimension, top_n, filters)
+        )
         return jsonify(breakdown)
+    except InvalidParameterError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @eda_bp.route('/eda/timeseries', methods=['GET'])
 @jwt_required()
 def time_series():
-    group_by = request.args.get('group_by', 'month_year')
+    group_by = time_series_key(request.args.get('group_by', 'month_year'))
     try:
-        analysis = get_time_series_analysis(group_by)
+        filters = LedgerFilter.from_args(request.args)
+        analysis = get_cached_result(
+            'eda/timeseries', analysis_params(filters, {'group_by': group_by}), lambda: get_time_series_analysis(group_by, filters)
+        )
         return jsonify(analysis)
+    except InvalidParameterError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
\ No newline at end of file
@@ -0,0 +1,64 @@
+from flask import Blueprint, request, jsonify
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from app.services.job_service import submit_job, get_job_status, list_jobs
+from app.services.ledger_filters import InvalidParameterError
+
+jobs_bp = Blueprint('jobs', __name__)
+
+@jobs_bp.route('/jobs', methods=['POST'])
+@jwt_required()
+def create_job():
+    username = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind')
+
+    if not kind:
+        return jsonify({
+            "status": "error",
+            "message": "Missing required parameter: kind"
+        }), 400
+
+    try:
+        job_id = submit_job(username, kind, data.get('params'))
+        return jsonify({
+            "status": "success",
+            "job_id": job_id,
+            "job_status": "queued",
+            "status_url": f"/jobs/{job_id}"
+        }), 202
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+
+@jobs_bp.route('/jobs', methods=['GET'])
+@jwt_required()
+def get_jobs():
+    username = get_jwt_identity()
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({
+        "status": "success",
+        "jobs": list_jobs(username, limit)
+    })
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    """Job status, progress and, once it has succeeded, its result. `wait` long-polls."""
+    username = get_jwt_identity()
+    wait = request.args.get('wait', 0, type=float)
+    job = get_job_status(job_id, username, wait)
+
+    if not job:
+        return jsonify({"status": "error", "message": "Job not found"}), 404
+
+    return jsonify({
+        "status": "success",
+        "job": job
+    })
@@ -1,12 +1,17 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from app.services.visualization_service import get_visualization_data
-from app.services.anomaly_service import get_anomaly_analysis
-from app.services.rca_service import perform_comprehensive_rca
+from app.services.anomaly_service import get_anomaly_analysis, detector_params
+from app.services.rca_service import perform_contribution_rca
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError, FILTER_PARAMETERS, month_arg
+from app.services.result_cache import get_cached_result, analysis_params
 from app.models.mongo import ChatMessage
 
 visualization_bp = Blueprint('visualization', __name__)
 
+# Ledger filter query parameters accepted by every chart endpoint
+CHART_FILTER_PARAMETERS = [f"{name} (optional)" for name in ["period_from", "period_to", *FILTER_PARAMETERS]]
+
 def save_chart_to_chat(room_id, chart_data, chart_type, summary_data=None):
     if not room_id:
         return
@@ -34,7 +39,10 @@ def trend_chart():
     room_id = request.args.get('room_id')  # Optional room_id for chat integration
     
     try:
-        chart_data = get_visualization_data('trend')
+        filters = LedgerFilter.from_args(request.args)
+        chart_data = get_cached_result(
+            'charts/trend', analysis_params(filters), lambda: get_visualization_data('trend', filters=filters)
+        )
         
         # Save to chat if room_id provided
         if room_id:
@@ -45,6 +53,11 @@ def trend_chart():
             "data": chart_data,
             "saved_to_chat": bool(room_id)
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -57,7 +70,10 @@ def category_breakdown_chart():
     room_id = request.args.get('room_id')  # Optional room_id for chat integration
     
     try:
-        chart_data = get_visualization_data('category_breakdown')
+        filters = LedgerFilter.from_args(request.args)
+        chart_data = get_cached_result(
+            'charts/category-breakdown', analysis_params(filters), lambda: get_visualization_data('category_breakdown', filters=filters)
+        )
         
         # Save to chat if room_id provided
         if room_id:
@@ -68,6 +84,11 @@ def category_breakdown_chart():
             "data": chart_data,
             "saved_to_chat": bool(room_id)
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -80,7 +101,10 @@ def heatmap_chart():
     room_id = request.args.get('room_id')
     
     try:
-        chart_data = get_visualization_data('heatmap')
+        filters = LedgerFilter.from_args(request.args)
+        chart_data = get_cached_result(
+            'charts/heatmap', analysis_params(filters), lambda: get_visualization_data('heatmap', filters=filters)
+        )
         if room_id:
             save_chart_to_chat(room_id, chart_data, 'heatmap', chart_data.get('summary'))
         
@@ -89,6 +113,11 @@ def heatmap_chart():
             "data": chart_data,
             "saved_to_chat": bool(room_id)
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -102,13 +131,20 @@ def anomaly_scatter_chart():
     method = request.args.get('method', 'ml')
     
     try:
-        anomaly_response = get_anomaly_analysis(method=method)
-        if method == 'comprehensive':
-            anomaly_data = anomaly_response.get('ml_anomalies', {})
-        else:
-            anomaly_data = anomaly_response
-        
-        chart_data = get_visualization_data('anomaly_scatter', anomaly_data=anomaly_data)
+        params = detector_params(method, request.args)
+        filters = LedgerFilter.from_args(request.args)
+
+        def scatter():
+            anomaly_response = get_anomaly_analysis(method=method, filters=filters, params=params)
+            if method == 'comprehensive':
+                anomaly_data = anomaly_response.get('ml_anomalies', {})
+            else:
+                anomaly_data = anomaly_response
+            return get_visualization_data('anomaly_scatter', filters=filters, anomaly_data=anomaly_data)
+
+        chart_data = get_cached_result(
+            'charts/anomaly-scatter', analysis_params(filters, {'method': method, **params}), scatter
+        )
         
         if room_id:
             save_chart_to_chat(room_id, chart_data, 'anomaly_scatter', chart_data.get('summary'))
@@ -118,6 +154,11 @@ def anomaly_scatter_chart():
             "data": chart_data,
             "saved_to_chat": bool(room_id)
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -128,20 +169,25 @@ def anomaly_scatter_chart():
 @jwt_required()
 def rca_waterfall_chart():
     room_id = request.args.get('room_id')
-    data = request.json
-    category = data.get('category')
+    data = request.get_json(silent=True) or {}
     from_month = data.get('from_month')
     to_month = data.get('to_month')
     
-    if not all([category, from_month, to_month]):
+    if not all([from_month, to_month]):
         return jsonify({
             "status": "error",
-            "message": "Missing required parameters: category, from_month, to_month"
+            "message": "Missing required parameters: from_month, to_month"
         }), 400
     
     try:
-        rca_data = perform_comprehensive_rca(category, from_month, to_month)
-        chart_data = get_visualization_data('rca_waterfall', rca_data=rca_data.get('basic_rca', {}))
+        # Filters (category, directorate, ...) may come in the body or the query string
+        filters = LedgerFilter.from_args({**request.args.to_dict(flat=False), **data})
+        from_month, to_month = month_arg(data, 'from_month'), month_arg(data, 'to_month')
+        rca_data = get_cached_result(
+            'charts/rca-waterfall', analysis_params(filters, {'from_month': from_month, 'to_month': to_month}),
+            lambda: perform_contribution_rca(from_month, to_month, filters)
+        )
+        chart_data = get_visualization_data('rca_waterfall', rca_data=rca_data)
         if room_id:
             save_chart_to_chat(room_id, chart_data, 'rca_waterfall', rca_data.get('summary'))
         
@@ -151,6 +197,11 @@ def rca_waterfall_chart():
             "rca_analysis": rca_data,
             "saved_to_chat": bool(room_id)
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -161,14 +212,20 @@ def rca_waterfall_chart():
 @jwt_required()
 def dashboard_data():
     """Get comprehensive dashboard data"""
-    category = request.args.get('category')
-    
     try:
-        dashboard_data = get_visualization_data('dashboard', category=category)
+        filters = LedgerFilter.from_args(request.args)
+        dashboard_data = get_cached_result(
+            'dashboard', analysis_params(filters), lambda: get_visualization_data('dashboard', filters=filters)
+        )
         return jsonify({
             "status": "success",
             "data": dashboard_data
         })
+    except InvalidParameterError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
     except Exception as e:
         return jsonify({
             "status": "error",
@@ -184,35 +241,35 @@ def available_charts():
             "name": "Monthly Trend Chart",
             "description": "Line chart showing expense trends over time",
             "endpoint": "/charts/trend",
-            "parameters": ["category (optional)"]
+            "parameters": CHART_FILTER_PARAMETERS
         },
         {
             "type": "category_breakdown",
             "name": "Category Breakdown",
             "description": "Pie chart showing expense distribution by category",
             "endpoint": "/charts/category-breakdown",
-            "parameters": []
+            "parameters": CHART_FILTER_PARAMETERS
         },
         {
             "type": "heatmap",
             "name": "Cost Center Heatmap",
             "description": "Heatmap showing cost center spending patterns",
             "endpoint": "/charts/heatmap",
-            "parameters": ["category (optional)"]
+            "parameters": CHART_FILTER_PARAMETERS
         },
         {
             "type": "anomaly_scatter",
             "name": "Anomaly Scatter Plot",
             "description": "Scatter plot highlighting anomalous expenses",
             "endpoint": "/charts/anomaly-scatter",
-            "parameters": ["category (optional)", "method (optional)"]
+            "parameters": CHART_FILTER_PARAMETERS + ["method (optional)"]
         },
         {
             "type": "rca_waterfall",
             "name": "RCA Waterfall Chart",
             "description": "Waterfall chart showing root cause analysis",
             "endpoint": "/charts/rca-waterfall",
-            "parameters": ["category", "from_month", "to_month"]
+            "parameters": ["from_month", "to_month"] + CHART_FILTER_PARAMETERS
         }
     ]
     
@@ -1,64 +1,83 @@
-from flask import request
-from app.models.postgres import SessionLocal, FinanceExpense
+from app.models.postgres import SessionLocal
+from app.services.ledger_service import (
+    get_ledger_frame, get_ledger_snapshot, load_ledger_columns, current_data_version, version_watermark
+)
+from app.services import model_store
+from app.services.rollup_service import get_rollup
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError, number_arg
+from app.config import Config
+from app.services.normalization import normalize_ledger_frame, signed_rollup_amounts, fill_blanks
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
+from sklearn.preprocessing import MaxAbsScaler
+from sklearn.pipeline import Pipeline
 from sklearn.feature_extraction import FeatureHasher
 from scipy import stats
+import scipy.sparse as sp
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List
+import threading
+import hashlib
+import os
+import time
 import logging
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+ANALYSIS_COLUMNS = [
+    "id", "cost_center_id", "cost_center_name", "functional_area", "functional_area_name",
+    "company_code_currency_value", "debit_credit_ind", "month_year", "general_ledger_account",
+    "directorate", "level_1", "company_code",
+]
+
+# Categorical columns hashed into ML_HASH_FEATURES buckets each, after the amount column
+ML_HASHED_COLUMNS = ["cost_center_id", "functional_area", "directorate"]
+ML_HASH_FEATURES = 10
+
+# Columns the statistical detector can compute per-group medians and MADs over
+STATISTICAL_GROUP_COLUMNS = ["cost_center_id", "general_ledger_account", "directorate"]
+
+# Columns the ML detector can shard by, fitting one forest per value
+ML_SHARD_COLUMNS = ["directorate", "company_code"]
+
+# Rollup dimensions behind the trend detector's monthly totals and top contributors
+TREND_DIMENSIONS = ["cost_center_id", "cost_center_name", "directorate", "functional_area_name"]
+
+# Columns the trend detector can follow month over month separately, besides the ledger total
+TREND_GROUP_COLUMNS = ["directorate", "cost_center_id"]
+TREND_TOP_CONTRIBUTORS = 3
+
+# Posting columns reported for every flagged row, in output order
+ANOMALY_COLUMNS = [
+    "id", "cost_center_id", "cost_center_name", "amount", "month_year",
+    "directorate", "functional_area_name",
+]
+
+# Detectors of the comprehensive analysis, and the ways they can be run side by side
+COMPREHENSIVE_DETECTORS = ["statistical", "ml", "trend"]
+DETECTOR_EXECUTORS = ["thread", "serial"]
+
+# Export format -> response mimetype
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
 
 class AnomalyDetector:
-    def __init__(self):
+    def __init__(self, filters=None):
         self.session = SessionLocal()
-        self.scaler = StandardScaler()
-        self.hasher = FeatureHasher(n_features=10, input_type="string")
+        self.filters = LedgerFilter.coerce(filters)
+        self.hasher = FeatureHasher(n_features=ML_HASH_FEATURES, input_type="string")
 
     def __del__(self):
         self.session.close()
 
     def get_data_for_analysis(self) -> pd.DataFrame:
         try:
-            query = self.session.query(
-                FinanceExpense.id,
-                FinanceExpense.cost_center_id,
-                FinanceExpense.cost_center_name,
-                FinanceExpense.functional_area,
-                FinanceExpense.functional_area_name,
-                FinanceExpense.company_code_currency_value,
-                FinanceExpense.debit_credit_ind,
-                FinanceExpense.general_ledger_fiscal_year,
-                FinanceExpense.posting_period,
-                FinanceExpense.general_ledger_account,
-                FinanceExpense.directorate,
-                FinanceExpense.level_1,
-            )
-
-            df = pd.read_sql(query.statement, query.session.bind)
-            logger.info(f"Fetched {len(df)} records from the database.")
-
-            df["amount"] = df["company_code_currency_value"] * np.where(
-                df["debit_credit_ind"] == "H", -1, 1
-            )
-            df["month_year"] = np.where(
-                df["general_ledger_fiscal_year"].notna() & df["posting_period"].notna(),
-                df["general_ledger_fiscal_year"].astype(str)
-                + "-"
-                + df["posting_period"].astype(str).str.zfill(2),
-                "",
-            )
-            df.fillna({"directorate": "", "level_1": ""}, inplace=True)
-
-            df.drop(
-                columns=["company_code_currency_value", "debit_credit_ind"],
-                inplace=True,
-            )
+            df = get_ledger_frame(ANALYSIS_COLUMNS, session=self.session, filters=self.filters)
+            logger.info(f"Fetched {len(df)} records from the ledger snapshot.")
+            df = _prepare_analysis_frame(df)
             logger.info(f"Data prepared for analysis with {len(df)} rows.")
             return df
 
@@ -66,6 +85,19 @@ class AnomalyDetector:
             logger.error(f"Error fetching data: {str(e)}")
             return pd.DataFrame()
 
+    def get_new_postings(self, since_id: int) -> pd.DataFrame:
+        """Postings with an id above since_id (and matching the filters), straight from the database"""
+        df = load_ledger_columns(ANALYSIS_COLUMNS, filters=self.filters, session=self.session,
+                                 id_range=(since_id, None))
+        logger.info(f"Fetched {len(df)} postings with id above {since_id}.")
+        return _prepare_analysis_frame(df)
+
+    def get_trend_rollup(self) -> pd.DataFrame:
+        """Monthly signed amounts per cost center from the month x dimension rollups"""
+        rollup = get_rollup(TREND_DIMENSIONS, session=self.session, filters=self.filters)
+        rollup["amount"] = signed_rollup_amounts(rollup)
+        return fill_blanks(rollup, ["month_year", "directorate"])
+
     def _calculate_stats(self, df: pd.DataFrame) -> Dict:
         return {
             "mean": df["amount"].mean(),
@@ -76,104 +108,96 @@ class AnomalyDetector:
         }
 
     def detect_statistical_anomalies(
-        self, df: pd.DataFrame, threshold: float = 2.5
+        self, df: pd.DataFrame, threshold: float = 2.5, group_by: str = None
     ) -> Dict:
         if df.empty:
             logger.warning("Statistical analysis: No data available.")
             return {"anomalies": [], "summary": "No data available"}
 
-        median = df["amount"].median()
-        mad = stats.median_abs_deviation(df["amount"], scale="normal")
-        if mad == 0:
-            mad = df["amount"].mad() or df["amount"].std() or 1
-
-        logger.info(f"Statistical analysis: median={median}, mad={mad}")
-
-        df["z_score"] = np.abs(0.6745 * (df["amount"] - median) / mad)
-        anomalies = df[df["z_score"] > threshold].copy()
-
-        logger.info(f"Found {len(anomalies)} statistical anomalies with threshold {threshold}.")
-
-        records = []
-        for _, row in anomalies.iterrows():
-            records.append(
-                {
-                    "id": row["id"],
-                    "cost_center_id": row["cost_center_id"],
-                    "cost_center_name": row["cost_center_name"],
-                    "amount": row["amount"],
-                    "z_score": round(row["z_score"], 2),
-                    "month_year": row["month_year"],
-                    "directorate": row["directorate"],
-                    "functional_area_name": row["functional_area_name"],
-                    "deviation_type": "statistical_outlier",
-                    "reason": f"Z-score of {row['z_score']:.2f} exceeds threshold {threshold}",
-                }
-            )
-
+        anomalies = self.flag_statistical_anomalies(df, threshold, group_by)
         return {
             "method": "z_score",
             "threshold": threshold,
+            "group_by": group_by,
             "anomaly_count": len(anomalies),
-            "anomalies": records[:10],
+            "anomalies": anomaly_records(anomalies.head(10)),
             "overall_stats": self._calculate_stats(df),
         }
 
-    def _prepare_ml_features(self, df: pd.DataFrame) -> pd.DataFrame:
-        features = df[["amount"]].copy()
-        for col in ["cost_center_id", "functional_area", "directorate"]:
-            hashed = self.hasher.transform([[val] for val in df[col].astype(str)])
-            hashed_df = pd.DataFrame(
-                hashed.toarray(), columns=[f"{col}_hash_{i}" for i in range(10)]
-            )
-            features = pd.concat(
-                [features.reset_index(drop=True), hashed_df.reset_index(drop=True)],
-                axis=1,
-            )
-        return features
+    def flag_statistical_anomalies(self, df: pd.DataFrame, threshold: float = 2.5,
+                                   group_by: str = None) -> pd.DataFrame:
+        """Every posting whose robust z-score exceeds threshold, as ANOMALY_COLUMNS plus
+        z_score, deviation_type and reason; df is left unchanged.
+
+        With group_by (one of STATISTICAL_GROUP_COLUMNS) each posting is measured against the
+        median and MAD of its own group, and `group` and `baseline` ("group" or "global" for
+        groups too small to have their own) columns are added.
+        """
+        amount = df["amount"]
+        median, mad = _robust_center(amount)
+        logger.info(f"Statistical analysis: median={median}, mad={mad}")
+        if group_by:
+            median, mad, own_baseline = _group_robust_centers(amount, df[group_by], median, mad)
+
+        z_score = np.abs(0.6745 * (amount - median) / mad)
+        flagged = (z_score > threshold).to_numpy()
+        anomalies = df.loc[flagged, ANOMALY_COLUMNS].reset_index(drop=True)
+        z_score = z_score[flagged].to_numpy()
+        anomalies["z_score"] = z_score.round(2)
+        anomalies["deviation_type"] = "statistical_outlier"
+        anomalies["reason"] = [f"Z-score of {z:.2f} exceeds threshold {threshold}" for z in z_score]
+        if group_by:
+            anomalies["group"] = df[group_by].to_numpy()[flagged]
+            anomalies["baseline"] = np.where(own_baseline[flagged], "group", "global")
+
+        logger.info(f"Found {len(anomalies)} statistical anomalies with threshold {threshold}.")
+        return anomalies
+
+    def _prepare_ml_features(self, df: pd.DataFrame) -> sp.csr_matrix:
+        """Sparse N x (1 + 3 * ML_HASH_FEATURES) matrix: amount, then one hashed block per
+        ML_HASHED_COLUMNS column.
+
+        Only the distinct values of the columns are hashed, in a single FeatureHasher call;
+        each row's bucket and sign are then gathered by its factorized code. The result is
+        the same as hashing every row's value, without a Python object per row or a dense copy.
+        """
+        n = len(df)
+        codes, tokens = [], []
+        for col in ML_HASHED_COLUMNS:
+            col_codes, uniques = pd.factorize(df[col])
+            # Missing values hash as "nan", like str(NaN)
+            col_codes = np.where(col_codes < 0, len(uniques), col_codes)
+            codes.append(col_codes + len(tokens))
+            tokens += [str(value) for value in uniques] + ["nan"]
+
+        hashed = self.hasher.transform([[token] for token in tokens]).tocoo()
+        bucket = np.zeros(len(tokens), dtype=np.int64)
+        sign = np.zeros(len(tokens))
+        bucket[hashed.row], sign[hashed.row] = hashed.col, hashed.data
+
+        rows = np.arange(n)
+        blocks = [sp.csr_matrix(df["amount"].to_numpy(dtype=float).reshape(-1, 1))]
+        for col_codes in codes:
+            blocks.append(sp.csr_matrix(
+                (sign[col_codes], (rows, bucket[col_codes])), shape=(n, ML_HASH_FEATURES)
+            ))
+        return sp.hstack(blocks, format="csr")
 
     def detect_ml_anomalies(
-        self, df: pd.DataFrame, contamination: float = 0.05
+        self, df: pd.DataFrame, contamination: float = 0.05, shard_by: str = None
     ) -> Dict:
         if df.empty or len(df) < 20:
             logger.warning(f"ML analysis: Insufficient data for ML (rows: {len(df)}).")
             return {"anomalies": [], "summary": "Insufficient data for ML"}
 
         try:
-            X = self._prepare_ml_features(df)
-            logger.info(f"ML analysis: Feature matrix shape: {X.shape}")
-            model = IsolationForest(contamination=contamination, random_state=42)
-            df["is_anomaly"] = model.fit_predict(X) == -1
-            anomalies = df[df["is_anomaly"]].copy()
-
-            logger.info(f"Found {len(anomalies)} ML anomalies with contamination {contamination}.")
-
-            records = []
-            for _, row in anomalies.iterrows():
-                reason = "Unusual pattern"
-                if row["amount"] > 50000:
-                    reason += " - high expense"
-                elif row["amount"] < -10000:
-                    reason += " - large refund"
-                records.append(
-                    {
-                        "id": row["id"],
-                        "cost_center_id": row["cost_center_id"],
-                        "cost_center_name": row["cost_center_name"],
-                        "amount": row["amount"],
-                        "month_year": row["month_year"],
-                        "directorate": row["directorate"],
-                        "functional_area_name": row["functional_area_name"],
-                        "deviation_type": "ml_isolation_forest",
-                        "reason": reason,
-                    }
-                )
-
+            anomalies = self.flag_ml_anomalies(df, contamination, shard_by=shard_by)
             return {
                 "method": "isolation_forest",
                 "contamination": contamination,
+                "shard_by": shard_by,
                 "anomaly_count": len(anomalies),
-                "anomalies": records[:10],
+                "anomalies": anomaly_records(anomalies.head(10)),
                 "overall_stats": self._calculate_stats(df),
             }
 
@@ -181,59 +205,197 @@ class AnomalyDetector:
             logger.error(f"ML anomaly detection failed: {str(e)}")
             return {"anomalies": [], "summary": f"ML error: {str(e)}"}
 
+    def get_ml_model(self, contamination: float = 0.05):
+        """(IsolationForest fitted on the whole ledger, data version it was fitted at).
+
+        Fitted once per data version and persisted by model_store, so requests in between
+        (filtered or not, from any worker) only score against it.
+        """
+        def train():
+            snapshot = get_ledger_snapshot(self.session)
+            df = _prepare_analysis_frame(snapshot.project(ANALYSIS_COLUMNS))
+            X = self._prepare_ml_features(df)
+            logger.info(f"ML analysis: Fitting isolation forest on feature matrix {X.shape}")
+            return _fit_forest(X, contamination, Config.ANOMALY_ML_N_JOBS), snapshot.version
+
+        return model_store.get_model(_ml_model_name(contamination), current_data_version(self.session), train)
+
+    def get_shard_models(self, contamination: float = 0.05, shard_by: str = "directorate",
+                         refresh=()) -> Dict:
+        """{shard value: forest fitted on that shard's postings only} for shards of at least
+        ANOMALY_SHARD_MIN_ROWS rows.
+
+        Each shard model is stored under a fingerprint of its own rows, so a new data version
+        only refits the shards whose postings changed, plus the values in `refresh` (every
+        shard if it is True). Missing shards are fitted together in a thread pool.
+        """
+        if shard_by not in ML_SHARD_COLUMNS:
+            raise InvalidParameterError(f"Cannot shard by '{shard_by}', expected one of {', '.join(ML_SHARD_COLUMNS)}")
+
+        snapshot = get_ledger_snapshot(self.session)
+        key = (_ml_model_name(contamination), shard_by)
+        with _shard_lock:
+            resolved = _shard_models.get(key)
+        if resolved is not None and resolved[0] == snapshot.version and not refresh:
+            return resolved[1]
+
+        ledger = _prepare_analysis_frame(snapshot.project(ANALYSIS_COLUMNS))
+        models, pending = {}, {}
+        for value, index in ledger.groupby(shard_by, observed=True, sort=False).indices.items():
+            if len(index) < Config.ANOMALY_SHARD_MIN_ROWS:
+                continue
+            shard = ledger.iloc[index]
+            name, version = _shard_model_name(contamination, shard_by, value), _shard_fingerprint(shard)
+            stale = refresh is True or value in refresh
+            stored = model_store.load_model(name, version) if not stale else None
+            if stored is not None:
+                models[value] = stored[0]
+            else:
+                pending[value] = (name, version, self._prepare_ml_features(shard))
+
+        if pending:
+            logger.info(f"ML analysis: Fitting {len(pending)} {shard_by} shard forests.")
+            with model_store.training_lock(f"{_ml_model_name(contamination)}-{shard_by}"):
+                fitted = _fit_shards({value: X for value, (_, _, X) in pending.items()}, contamination)
+            for value, model in fitted.items():
+                name, version, _ = pending[value]
+                models[value] = model_store.save_model(name, model, version)[0]
+
+        with _shard_lock:
+            _shard_models[key] = (snapshot.version, models)
+        return models
+
+    def flag_ml_anomalies(self, df: pd.DataFrame, contamination: float = 0.05, model=None,
+                          shard_by: str = None) -> pd.DataFrame:
+        """Every posting of df the isolation forest marks as an outlier, as ANOMALY_COLUMNS plus
+        anomaly_score, deviation_type and reason; df is left unchanged.
+
+        Scores against `model`, or the ledger-wide model of the current data version. With
+        shard_by, each shard's postings are scored against that shard's own forest (falling
+        back to the ledger-wide one for small shards) and a `shard` column is added.
+        """
+        if shard_by:
+            return self._flag_sharded(df, contamination, shard_by)
+        if model is None:
+            model, _ = self.get_ml_model(contamination)
+        anomalies = self._score(df, model)
+        logger.info(f"Found {len(anomalies)} ML anomalies with contamination {contamination}.")
+        return anomalies
+
+    def _flag_sharded(self, df: pd.DataFrame, contamination: float, shard_by: str) -> pd.DataFrame:
+        models = self.get_shard_models(contamination, shard_by)
+        fallback = None
+        parts = []
+        for value, index in df.groupby(shard_by, observed=True, sort=False, dropna=False).indices.items():
+            model = models.get(value)
+            if model is None:
+                if fallback is None:
+                    fallback = self.get_ml_model(contamination)[0]
+                model = fallback
+            part = self._score(df.iloc[index], model)
+            part["shard"] = value
+            parts.append(part)
+        if not parts:
+            return pd.DataFrame(columns=ANOMALY_COLUMNS + ["anomaly_score", "deviation_type", "reason", "shard"])
+        anomalies = pd.concat(parts, ignore_index=True).sort_values("id", ignore_index=True)
+        logger.info(f"Found {len(anomalies)} ML anomalies across {len(parts)} {shard_by} shards.")
+        return anomalies
+
+    def _score(self, df: pd.DataFrame, model) -> pd.DataFrame:
+        X = self._prepare_ml_features(df)
+        logger.info(f"ML analysis: Scoring feature matrix of shape {X.shape}")
+        # score_samples is higher for normal points; flip it so larger means more anomalous.
+        # The flags come from the same scores, as predict() would compute them, so the forest runs once
+        score = -model.score_samples(X)
+        flagged = -score < model.named_steps["forest"].offset_
+        anomalies = df.loc[flagged, ANOMALY_COLUMNS].reset_index(drop=True)
+        anomalies["anomaly_score"] = score[flagged].round(4)
+
+        amount = anomalies["amount"].to_numpy()
+        anomalies["deviation_type"] = "ml_isolation_forest"
+        anomalies["reason"] = np.select(
+            [amount > 50000, amount < -10000],
+            ["Unusual pattern - high expense", "Unusual pattern - large refund"],
+            default="Unusual pattern",
+        )
+        return anomalies
+
     def detect_trend_anomalies(
-        self, df: pd.DataFrame, threshold_pct: float = 30.0
+        self, df: pd.DataFrame, threshold_pct: float = 30.0, trend_by: str = None, limit: int = 100
     ) -> Dict:
+        """Months whose total moved more than threshold_pct against the previous month.
+
+        With trend_by (one of TREND_GROUP_COLUMNS) each directorate or cost center is followed
+        separately and the `limit` largest moves (by amount) are returned. Top contributors
+        and affected cost centers of every flagged month come from one month x cost center
+        aggregate of the rollup rather than a scan per month.
+        """
         if df.empty:
             logger.warning("Trend analysis: No data available.")
             return {"anomalies": [], "summary": "No data"}
 
         valid = df[df["month_year"].str.match(r"\d{4}-\d{2}")]
+        rollup = self.get_trend_rollup()
+        rollup = rollup[rollup["month_year"].str.match(r"\d{4}-\d{2}")]
         monthly = (
-            valid.groupby("month_year")["amount"]
+            rollup.groupby("month_year")["amount"]
             .sum()
             .reset_index()
             .sort_values("month_year")
         )
         logger.info(f"Trend analysis: Analyzing {len(monthly)} months of data.")
         monthly["pct_change"] = monthly["amount"].pct_change() * 100
-        anomalies = monthly[monthly["pct_change"].abs() > threshold_pct]
 
-        logger.info(f"Found {len(anomalies)} trend anomalies with threshold {threshold_pct}%.");
-
-        records = []
-        for _, row in anomalies.iterrows():
-            month_data = valid[valid["month_year"] == row["month_year"]]
-            top_contributors = (
-                month_data.groupby(
-                    ["cost_center_id", "cost_center_name", "directorate"]
-                )
-                .agg({"amount": "sum", "functional_area_name": "first"})
-                .nlargest(3, "amount")
-                .reset_index()
+        if trend_by:
+            anomalies = _group_trend_changes(rollup, trend_by)
+            anomalies = anomalies[anomalies["pct_change"].abs() > threshold_pct]
+            anomalies = anomalies.reindex(
+                (anomalies["amount"] - anomalies["previous_amount"]).abs().sort_values(ascending=False).index
             )
-            records.append(
-                {
-                    "month_year": row["month_year"],
-                    "total_amount": row["amount"],
-                    "mom_change_percent": round(row["pct_change"], 2),
-                    "deviation_type": "trend_anomaly",
-                    "reason": f"MoM change of {row['pct_change']:.2f}%",
-                    "top_contributors": top_contributors.to_dict("records"),
-                    "affected_cost_centers": month_data["cost_center_id"].nunique(),
-                }
-            )
-
-        return {
+        else:
+            anomalies = monthly[monthly["pct_change"].abs() > threshold_pct]
+        logger.info(f"Found {len(anomalies)} trend anomalies with threshold {threshold_pct}%.")
+
+        keys = ["month_year"] + ([trend_by] if trend_by else [])
+        shown = anomalies.head(limit) if trend_by else anomalies
+        records = shown.rename(columns={"amount": "total_amount"}).reset_index(drop=True)
+        records["mom_change_percent"] = records["pct_change"].round(2)
+        records["deviation_type"] = "trend_anomaly"
+        records["reason"] = [f"MoM change of {pct:.2f}%" for pct in records["pct_change"]]
+        records = records.drop(columns="pct_change")
+
+        month_rollup = rollup[rollup["month_year"].isin(shown["month_year"])]
+        affected = month_rollup.groupby(keys)["cost_center_id"].nunique().rename("affected_cost_centers")
+        records = records.merge(affected, how="left", left_on=keys, right_index=True)
+        records["affected_cost_centers"] = records["affected_cost_centers"].fillna(0).astype(int)
+        if trend_by != "cost_center_id":
+            contributors = _top_contributors(month_rollup, keys, TREND_TOP_CONTRIBUTORS)
+            records["top_contributors"] = [
+                contributors.get(key, []) for key in records[keys].itertuples(index=False, name=None)
+            ]
+
+        result = {
             "method": "trend_analysis",
             "threshold_percent": threshold_pct,
             "anomaly_months": len(anomalies),
-            "anomalies": records,
+            "anomalies": anomaly_records(records),
             "monthly_summary": monthly.to_dict("records"),
             "overall_stats": self._calculate_stats(valid),
         }
-
-    def comprehensive_analysis(self) -> Dict:
+        if trend_by:
+            result["trend_by"] = trend_by
+            result["anomaly_groups"] = int(anomalies[trend_by].nunique())
+        return result
+
+    def comprehensive_analysis(self, executor: str = None) -> Dict:
+        """Statistical, ML and trend anomalies of the filtered ledger.
+
+        The detectors only read the prepared frame, so they run side by side on the same
+        one (see _run_detectors) and the latency is that of the slowest detector.
+        """
+        executor = executor or Config.ANOMALY_DETECTOR_EXECUTOR
+        if executor not in DETECTOR_EXECUTORS:
+            raise InvalidParameterError(f"Unknown executor '{executor}', expected one of {', '.join(DETECTOR_EXECUTORS)}")
         try:
             df = self.get_data_for_analysis()
             if df.empty:
@@ -245,9 +407,8 @@ class AnomalyDetector:
                     "summary": {"recommendations": ["No data available"]},
                 }
 
-            stat = self.detect_statistical_anomalies(df)
-            ml = self.detect_ml_anomalies(df)
-            trend = self.detect_trend_anomalies(df)
+            results, seconds = _run_detectors(self.filters, df, executor)
+            stat, ml, trend = results["statistical"], results["ml"], results["trend"]
 
             logger.info(f"Comprehensive analysis results: "
                         f"Statistical={stat['anomaly_count']}, "
@@ -272,6 +433,8 @@ class AnomalyDetector:
                     "total_records": len(df),
                     "total_amount": df["amount"].sum(),
                     "recommendations": summary or ["No significant anomalies detected"],
+                    "executor": executor,
+                    "detector_seconds": seconds,
                 },
             }
 
@@ -280,41 +443,318 @@ class AnomalyDetector:
             return {"error": str(e), "summary": "An error occurred during analysis"}
 
 
-def get_anomaly_analysis(method: str = "comprehensive") -> Dict:
+def _robust_center(amount: pd.Series):
+    """(median, normal-scaled MAD) of amount, with the MAD falling back to the mean absolute
+    deviation, then the standard deviation, then 1 when it is 0"""
+    median = amount.median()
+    mad = stats.median_abs_deviation(amount, scale="normal")
+    if not mad > 0:
+        mad = (amount - amount.mean()).abs().mean() or amount.std() or 1
+    return median, mad
+
+
+def _group_robust_centers(amount: pd.Series, keys: pd.Series, global_median: float, global_mad: float):
+    """Per-row (median, MAD, uses own group) of each row's group, computed with groupby
+    transforms over integer group codes, so the cost does not depend on the group count.
+
+    Groups follow the same MAD fallbacks as _robust_center; groups smaller than
+    ANOMALY_MIN_GROUP_SIZE, or whose spread is still 0, get the global median and MAD.
+    """
+    codes, _ = pd.factorize(keys, use_na_sentinel=False)
+    grouped = amount.groupby(codes, sort=False)
+    median = grouped.transform("median")
+    mad = (amount - median).abs().groupby(codes, sort=False).transform("median") / stats.norm.ppf(0.75)
+    mean_deviation = (amount - grouped.transform("mean")).abs().groupby(codes, sort=False).transform("mean")
+    mad = mad.where(mad > 0, mean_deviation)
+    mad = mad.where(mad > 0, grouped.transform("std"))
+
+    own = ((grouped.transform("size") >= Config.ANOMALY_MIN_GROUP_SIZE) & (mad > 0)).to_numpy()
+    logger.info(f"Statistical analysis: {codes.max() + 1 if len(codes) else 0} groups, {int((~own).sum())} rows on the global baseline")
+    return median.where(own, global_median), mad.where(own, global_mad), own
+
+
+def _group_trend_changes(rollup: pd.DataFrame, trend_by: str) -> pd.DataFrame:
+    """Monthly amount per trend_by value with the previous month it had postings in and the
+    percent change since then; moves from a zero month have no percentage"""
+    totals = (
+        rollup.groupby([trend_by, "month_year"])["amount"]
+        .sum()
+        .reset_index()
+    )
+    totals["previous_month"] = totals.groupby(trend_by)["month_year"].shift()
+    totals["previous_amount"] = totals.groupby(trend_by)["amount"].shift()
+    totals["pct_change"] = (
+        (totals["amount"] / totals["previous_amount"] - 1).replace([np.inf, -np.inf], np.nan) * 100
+    )
+    return totals.dropna(subset=["pct_change"])
+
+
+def _top_contributors(rollup: pd.DataFrame, keys: List[str], k: int) -> Dict:
+    """{key tuple: k largest cost center totals as records} from one grouped aggregate.
+
+    Cost centers are aggregated once per (month, cost center); a stable sort by amount
+    within each key then keeps the first k, breaking ties in cost center order as nlargest.
+    """
+    centers = ["cost_center_id", "cost_center_name", "directorate"]
+    totals = (
+        rollup.groupby(["month_year"] + centers)
+        .agg({"amount": "sum", "functional_area_name": "first"})
+        .reset_index()
+    )
+    totals = totals.sort_values(keys + ["amount"], ascending=[True] * len(keys) + [False], kind="mergesort")
+    top = totals.groupby(keys, sort=False).head(k)
+    records = top[centers + ["amount", "functional_area_name"]].to_dict("records")
+    contributors = {}
+    for key, record in zip(top[keys].itertuples(index=False, name=None), records):
+        contributors.setdefault(key, []).append(record)
+    return contributors
+
+
+def _ml_model_name(contamination: float) -> str:
+    return f"isolation_forest_c{contamination}"
+
+
+def _shard_model_name(contamination: float, shard_by: str, value) -> str:
+    # Shard values are free text; a digest keeps the stored file name safe
+    digest = hashlib.sha1(str(value).encode()).hexdigest()[:12]
+    return f"{_ml_model_name(contamination)}-{shard_by}-{digest}"
+
+
+def _shard_fingerprint(shard: pd.DataFrame) -> str:
+    """Content stamp of a shard's rows: row count and the sum of the row hashes"""
+    hashes = pd.util.hash_pandas_object(shard, index=False).to_numpy()
+    return f"{len(shard)}:{int(hashes.sum(dtype=np.uint64))}"
+
+
+def _fit_forest(X, contamination: float, n_jobs=None) -> Pipeline:
+    """Fit the scaler + isolation forest pipeline.
+
+    MaxAbsScaler scales the amount column of the sparse matrix (the hashed columns are
+    already +-1) and is stored with the forest for scoring later rows.
+    """
+    model = Pipeline([
+        ("scale", MaxAbsScaler()),
+        ("forest", IsolationForest(contamination=contamination, random_state=42, n_jobs=n_jobs)),
+    ])
+    return model.fit(X)
+
+
+def _fit_shards(features: Dict, contamination: float) -> Dict:
+    """{shard value: fitted pipeline} for {shard value: feature matrix}, fitted side by side in a thread pool.
+
+    Tree building releases the GIL, so the shards fit in parallel without forking the
+    multithreaded server; a single shard is fitted with n_jobs instead.
+    """
+    if len(features) == 1:
+        return {value: _fit_forest(X, contamination, Config.ANOMALY_ML_N_JOBS) for value, X in features.items()}
+
+    workers = Config.ANOMALY_SHARD_WORKERS or os.cpu_count()
+    with ThreadPoolExecutor(max_workers=min(workers, len(features)), thread_name_prefix="anomaly-shard") as pool:
+        futures = {value: pool.submit(_fit_forest, X, contamination, 1) for value, X in features.items()}
+        return {value: future.result() for value, future in futures.items()}
+
+
+# (model name, shard column) -> (ledger data version, {shard value: model}) resolved for it
+_shard_models = {}
+_shard_lock = threading.Lock()
+
+
+def _run_detector(method: str, filters, df: pd.DataFrame):
+    """(result, seconds) of one comprehensive detector, on its own AnomalyDetector and session"""
+    started = time.perf_counter()
+    detector = AnomalyDetector(filters)
+    if method == "statistical":
+        result = detector.detect_statistical_anomalies(df)
+    elif method == "ml":
+        result = detector.detect_ml_anomalies(df)
+    else:
+        result = detector.detect_trend_anomalies(df)
+    return result, round(time.perf_counter() - started, 3)
+
+
+def _run_detectors(filters, df: pd.DataFrame, executor: str = "thread"):
+    """({detector: result}, {detector: seconds}) of COMPREHENSIVE_DETECTORS over the same frame.
+
+    "thread" shares df between pool threads; pandas, NumPy and the forest release the GIL
+    for most of the work. "serial" runs them one after another.
+    """
+    if executor == "serial":
+        timed = {method: _run_detector(method, filters, df) for method in COMPREHENSIVE_DETECTORS}
+    else:
+        with ThreadPoolExecutor(max_workers=len(COMPREHENSIVE_DETECTORS), thread_name_prefix="anomaly") as pool:
+            futures = {method: pool.submit(_run_detector, method, filters, df) for method in COMPREHENSIVE_DETECTORS}
+            timed = {method: future.result() for method, future in futures.items()}
+    return ({method: result for method, (result, _) in timed.items()},
+            {method: seconds for method, (_, seconds) in timed.items()})
+
+
+def _prepare_analysis_frame(df: pd.DataFrame) -> pd.DataFrame:
+    return normalize_ledger_frame(
+        df, blank_columns=["month_year", "directorate", "level_1"]
+    ).drop(columns="debit_credit_ind")
+
+
+def anomaly_records(anomalies: pd.DataFrame) -> List[Dict]:
+    """JSON-ready records of flagged rows; categoricals and numpy scalars become plain values"""
+    return anomalies.astype(object).where(anomalies.notna(), None).to_dict("records")
+
+
+def _choice_arg(args, name, choices, message):
+    value = args.get(name) or None
+    if value is not None and value not in choices:
+        raise InvalidParameterError(f"{message} '{value}', expected one of {', '.join(choices)}")
+    return value
+
+
+def detector_params(method: str, args=None) -> Dict:
+    """Validated options of one detector from request arguments or job parameters, defaults
+    filled in and unset choices left out.
+
+    The endpoints and analysis jobs key the result cache on these and hand the same dict
+    to get_anomaly_analysis, so the key always holds what the computation reads. Malformed
+    options raise InvalidParameterError.
+    """
+    args = args or {}
+    if method == "comprehensive":
+        params = {"executor": _choice_arg(args, "executor", DETECTOR_EXECUTORS, "Unknown executor")}
+    elif method == "statistical":
+        params = {
+            "threshold": number_arg(args, "threshold", 2.5),
+            "group_by": _choice_arg(args, "group_by", STATISTICAL_GROUP_COLUMNS, "Cannot group by"),
+        }
+    elif method == "ml":
+        params = {
+            "contamination": number_arg(args, "contamination", 0.05),
+            "shard_by": _choice_arg(args, "shard_by", ML_SHARD_COLUMNS, "Cannot shard by"),
+        }
+        if not 0 < params["contamination"] <= 0.5:
+            raise InvalidParameterError(f"Invalid contamination {params['contamination']}, expected (0, 0.5]")
+    elif method == "trend":
+        params = {
+            "threshold_pct": number_arg(args, "threshold_pct", 30.0),
+            "trend_by": _choice_arg(args, "trend_by", TREND_GROUP_COLUMNS, "Cannot follow trends by"),
+            "limit": number_arg(args, "limit", 100, int),
+        }
+    else:
+        raise InvalidParameterError(
+            f"Unknown anomaly detection method '{method}', expected one of comprehensive, {', '.join(COMPREHENSIVE_DETECTORS)}"
+        )
+    return {name: value for name, value in params.items() if value is not None}
+
+
+def get_anomaly_analysis(method: str = "comprehensive", filters=None, params=None) -> Dict:
+    """Run one detector (or all of them) with the options of detector_params(method, ...);
+    options left out of `params` take their defaults."""
     try:
         logger.info(f"Starting anomaly analysis with method: {method}")
-        detector = AnomalyDetector()
+        options = detector_params(method, params)
+        detector = AnomalyDetector(filters)
 
         if method == "comprehensive":
-            return detector.comprehensive_analysis()
+            return detector.comprehensive_analysis(options.get("executor"))
 
         df = detector.get_data_for_analysis()
 
         if method == "statistical":
-            threshold = (
-                float(request.args.get("threshold", 2.5))
-                if "request" in globals()
-                else 2.5
-            )
-            return detector.detect_statistical_anomalies(df, threshold)
+            return detector.detect_statistical_anomalies(df, options["threshold"], options.get("group_by"))
         elif method == "ml":
-            contamination = (
-                float(request.args.get("contamination", 0.05))
-                if "request" in globals()
-                else 0.05
-            )
-            return detector.detect_ml_anomalies(df, contamination)
-        elif method == "trend":
-            threshold_pct = (
-                float(request.args.get("threshold_pct", 30.0))
-                if "request" in globals()
-                else 30.0
-            )
-            return detector.detect_trend_anomalies(df, threshold_pct)
+            return detector.detect_ml_anomalies(df, options["contamination"], options.get("shard_by"))
         else:
-            logger.error(f"Unknown anomaly detection method: {method}")
-            return {"error": f"Unknown method {method}", "summary": "Invalid method specified"}
+            return detector.detect_trend_anomalies(
+                df, options["threshold_pct"], options.get("trend_by"), options["limit"]
+            )
 
+    except InvalidParameterError:
+        raise
     except Exception as e:
         logger.error(f"Anomaly detection failed for method {method}: {str(e)}")
         return {"error": str(e), "summary": f"Error in {method} analysis"}
+
+
+def score_postings(since_id: int = None, contamination: float = 0.05, filters=None, limit: int = 100) -> Dict:
+    """Score postings against the stored isolation forest without refitting it.
+
+    Scores the postings with an id above since_id, or the filtered slice when only filters
+    are given, or otherwise the postings ingested after the stored model's data version.
+    """
+    try:
+        detector = AnomalyDetector(filters)
+        stored = model_store.get_latest_model(_ml_model_name(contamination))
+        model, model_version = stored or detector.get_ml_model(contamination)
+
+        if since_id is None and detector.filters:
+            scope = "filtered_slice"
+            df = detector.get_data_for_analysis()
+        else:
+            scope = "new_postings"
+            since_id = version_watermark(model_version) if since_id is None else since_id
+            df = detector.get_new_postings(since_id)
+
+        anomalies = detector.flag_ml_anomalies(df, contamination, model=model) if not df.empty else None
+        return {
+            "method": "isolation_forest",
+            "scope": scope,
+            "since_id": since_id,
+            "model_version": model_version,
+            "contamination": contamination,
+            "scored_rows": len(df),
+            "anomaly_count": len(anomalies) if anomalies is not None else 0,
+            "anomalies": anomaly_records(anomalies.head(limit)) if anomalies is not None else [],
+        }
+
+    except Exception as e:
+        logger.error(f"Anomaly scoring failed: {str(e)}")
+        return {"error": str(e), "summary": "Error in anomaly scoring"}
+
+
+def refresh_shard_models(shard_by: str = "directorate", shards=None, contamination: float = 0.05) -> Dict:
+    """Refit the forests of the named shards (all shards when none are named) on current data"""
+    detector = AnomalyDetector()
+    models = detector.get_shard_models(contamination, shard_by, refresh=set(shards) if shards else True)
+    shards = shards or list(models)
+    return {
+        "shard_by": shard_by,
+        "contamination": contamination,
+        "refreshed": [s for s in shards if s in models],
+        # Unknown values and shards below ANOMALY_SHARD_MIN_ROWS have no model of their own
+        "skipped": [s for s in shards if s not in models],
+        "data_version": current_data_version(detector.session),
+    }
+
+
+def get_anomaly_export(method: str = "statistical", filters=None, threshold: float = 2.5,
+                       contamination: float = 0.05, offset: int = 0, limit: int = None,
+                       shard_by: str = None, group_by: str = None):
+    """(page of the rows flagged by the statistical or ML detector, total flagged) for the export endpoint"""
+    if method not in ("statistical", "ml"):
+        raise InvalidParameterError(f"Unknown export method '{method}', expected 'statistical' or 'ml'")
+
+    detector = AnomalyDetector(filters)
+    df = detector.get_data_for_analysis()
+    if method == "statistical":
+        anomalies = detector.flag_statistical_anomalies(df, threshold, group_by) if not df.empty else None
+    else:
+        anomalies = detector.flag_ml_anomalies(df, contamination, shard_by=shard_by) if len(df) >= 20 else None
+    if anomalies is None:
+        anomalies = pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+    end = offset + limit if limit is not None else None
+    return anomalies.iloc[offset:end], len(anomalies)
+
+
+def iter_anomaly_export(anomalies: pd.DataFrame, fmt: str = "ndjson", chunk_size: int = None):
+    """Serialize flagged rows as NDJSON lines or CSV, ANOMALY_EXPORT_CHUNK_SIZE rows per yielded string"""
+    if fmt not in EXPORT_FORMATS:
+        raise InvalidParameterError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORT_FORMATS)}")
+    chunk_size = chunk_size or Config.ANOMALY_EXPORT_CHUNK_SIZE
+
+    if fmt == "csv":
+        # The header goes out even when nothing was flagged
+        yield anomalies.iloc[:0].to_csv(index=False)
+    for start in range(0, len(anomalies), chunk_size):
+        chunk = anomalies.iloc[start:start + chunk_size]
+        if fmt == "csv":
+            yield chunk.to_csv(index=False, header=False)
+        else:
+            lines = chunk.to_json(orient="records", lines=True)
+            yield lines if lines.endswith("\n") else lines + "\n"
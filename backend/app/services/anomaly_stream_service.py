@@ -0,0 +1,319 @@
+from app.services.ledger_service import get_ledger_snapshot, load_ledger_columns
+from app.services.normalization import normalize_ledger_frame, month_year_key
+from app.services.anomaly_service import ANOMALY_COLUMNS, STATISTICAL_GROUP_COLUMNS, anomaly_records
+from app.utils.sketches import QuantileSketch, RunningMoments
+from app.models.mongo import StreamScorerState
+from app.config import Config
+from typing import Dict, List
+import pandas as pd
+import numpy as np
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ledger columns read for every streamed posting
+STREAM_COLUMNS = [
+    "id", "cost_center_id", "cost_center_name", "company_code_currency_value", "debit_credit_ind",
+    "month_year", "directorate", "functional_area_name", "general_ledger_account",
+]
+
+# Most ids skipped below the watermark that are remembered and re-read on later polls
+MAX_PENDING_IDS = 10000
+
+# Attempts at absorbing a batch into the shared state before giving up to another worker
+STATE_RETRIES = 5
+
+
+class StreamingAnomalyScorer:
+    """Incremental robust z-score state for postings as they arrive.
+
+    The ledger-wide median and MAD come from quantile sketches (the MAD sketch holds each
+    posting's distance from the median estimate when it was absorbed), and per-group count,
+    mean and spread from running moments. A batch is scored against the state before it is
+    absorbed, so scoring never re-reads history. `watermark` is the highest posting id
+    absorbed and `pending` holds the ids skipped below it ({id: first seen missing}), whose
+    transactions may still commit; postings at or below the watermark are scored but only
+    counted if they are pending.
+    """
+
+    def __init__(self, group_by: str = "cost_center_id", accuracy: float = 0.01):
+        if group_by not in STATISTICAL_GROUP_COLUMNS:
+            raise ValueError(f"Cannot group by '{group_by}', expected one of {', '.join(STATISTICAL_GROUP_COLUMNS)}")
+        self.group_by = group_by
+        self.amounts = QuantileSketch(accuracy)
+        self.deviations = QuantileSketch(accuracy)
+        self.groups = RunningMoments()
+        self.watermark = 0
+        self.pending = {}
+        self.seeded_version = None
+        self.batches = 0
+        self.updated_at = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_snapshot(cls, snapshot, group_by: str = "cost_center_id", accuracy: float = 0.01):
+        """Scorer seeded once from every posting of a ledger snapshot"""
+        scorer = cls(group_by, accuracy)
+        frame = _prepare_stream_frame(snapshot.project(STREAM_COLUMNS))
+        amount = frame["amount"].to_numpy()
+        scorer.amounts.add(amount)
+        median = scorer.amounts.quantile(0.5) or 0.0
+        scorer.deviations.add(np.abs(amount - median))
+        scorer.groups.update(_group_keys(frame[group_by]), amount)
+        scorer._track_ids(frame["id"].dropna().to_numpy(dtype=np.int64))
+        scorer.watermark = max(scorer.watermark, snapshot.watermark)
+        scorer.seeded_version = snapshot.version
+        logger.info(f"Streaming scorer seeded with {len(frame)} postings at version {snapshot.version}.")
+        return scorer
+
+    def to_state(self) -> Dict:
+        """Plain data (sketch buckets, counts, group moments, watermark, pending ids) that
+        from_state rebuilds the scorer from; this is what is shared through MongoDB"""
+        return {
+            "group_by": self.group_by,
+            "amounts": self.amounts.to_dict(),
+            "deviations": self.deviations.to_dict(),
+            "groups": self.groups.to_dict(),
+            "watermark": int(self.watermark),
+            "pending": [[int(posting_id), float(seen)] for posting_id, seen in self.pending.items()],
+            "seeded_version": self.seeded_version,
+            "batches": int(self.batches),
+            "updated_at": self.updated_at,
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict):
+        scorer = cls(state["group_by"], float(state["amounts"]["relative_accuracy"]))
+        scorer.amounts = QuantileSketch.from_dict(state["amounts"])
+        scorer.deviations = QuantileSketch.from_dict(state["deviations"])
+        scorer.groups = RunningMoments.from_dict(state["groups"])
+        scorer.watermark = int(state["watermark"])
+        scorer.pending = {int(posting_id): float(seen) for posting_id, seen in state["pending"]}
+        scorer.seeded_version = state.get("seeded_version")
+        scorer.batches = int(state.get("batches", 0))
+        scorer.updated_at = state.get("updated_at")
+        return scorer
+
+    def baseline(self):
+        """(median, normal-scaled MAD) of every absorbed posting, from the sketches"""
+        median = self.amounts.quantile(0.5) or 0.0
+        mad = (self.deviations.quantile(0.5) or 0.0) / 0.6744897501960817
+        return median, mad if mad > 0 else 1.0
+
+    def score(self, frame: pd.DataFrame, threshold: float = 2.5, absorb: bool = True) -> pd.DataFrame:
+        """Score a prepared batch, then (with absorb) fold its new postings in; returns the flagged rows.
+
+        Only batches read from finance_expense may be absorbed: their ids move the watermark.
+        """
+        with self._lock:
+            median, mad = self.baseline()
+            amount = frame["amount"].to_numpy()
+            keys = _group_keys(frame[self.group_by])
+            z_score = np.abs(0.6745 * (amount - median) / mad)
+
+            count, mean, std = self.groups.lookup(keys)
+            known = (count >= Config.ANOMALY_MIN_GROUP_SIZE) & (std > 0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                group_z = np.where(known, np.abs(amount - mean) / std, np.nan)
+
+            if absorb:
+                self._absorb(frame, amount, keys, median)
+
+        global_flag = z_score > threshold
+        group_flag = np.nan_to_num(group_z) > threshold
+        flagged = global_flag | group_flag
+        anomalies = frame.loc[flagged, [c for c in ANOMALY_COLUMNS if c in frame.columns]].reset_index(drop=True)
+        anomalies["z_score"] = z_score[flagged].round(2)
+        anomalies["group_z_score"] = np.round(group_z[flagged], 2)
+        anomalies["deviation_type"] = "streaming_outlier"
+        anomalies["reason"] = [
+            "; ".join(
+                ([f"Z-score of {z:.2f} exceeds threshold {threshold}"] if g else [])
+                + ([f"{gz:.2f} standard deviations from its {self.group_by} mean"] if p else [])
+            )
+            for z, gz, g, p in zip(z_score[flagged], group_z[flagged], global_flag[flagged], group_flag[flagged])
+        ]
+        return anomalies
+
+    def _absorb(self, frame, amount, keys, median):
+        ids = frame["id"]
+        new = (ids.isna() | (ids > self.watermark) | ids.isin(list(self.pending))).to_numpy()
+        if new.any():
+            self.amounts.add(amount[new])
+            self.deviations.add(np.abs(amount[new] - median))
+            self.groups.update(keys[new], amount[new])
+        self._track_ids(ids.dropna().to_numpy(dtype=np.int64))
+        self.batches += 1
+        self.updated_at = time.time()
+
+    def _track_ids(self, ids):
+        """Advance the watermark past ids, remembering the ids skipped on the way as pending.
+
+        A skipped id belongs to a transaction that has not committed (or rolled back); it is
+        read again on later polls until it shows up or ANOMALY_STREAM_GAP_TTL seconds pass.
+        """
+        now = time.time()
+        if self.pending:
+            for posting_id in ids[np.isin(ids, list(self.pending))].tolist():
+                del self.pending[posting_id]
+        if ids.size and ids.max() > self.watermark:
+            top = int(ids.max())
+            skipped = np.arange(max(self.watermark, top - MAX_PENDING_IDS) + 1, top + 1)
+            self.pending.update(dict.fromkeys(np.setdiff1d(skipped, ids).tolist(), now))
+            self.watermark = top
+        self.pending = {
+            posting_id: seen for posting_id, seen in self.pending.items()
+            if now - seen < Config.ANOMALY_STREAM_GAP_TTL and posting_id > self.watermark - MAX_PENDING_IDS
+        }
+
+    def status(self) -> Dict:
+        median, mad = self.baseline()
+        return {
+            "group_by": self.group_by,
+            "postings": self.amounts.count,
+            "groups": len(self.groups),
+            "watermark": self.watermark,
+            "pending_ids": len(self.pending),
+            "seeded_version": self.seeded_version,
+            "batches": self.batches,
+            "median": median,
+            "mad": mad,
+            "updated_at": self.updated_at,
+        }
+
+
+def _group_keys(values: pd.Series) -> np.ndarray:
+    return values.astype(object).where(values.notna(), "").to_numpy()
+
+
+def _prepare_stream_frame(df: pd.DataFrame) -> pd.DataFrame:
+    return normalize_ledger_frame(df, blank_columns=["month_year", "directorate"]).drop(columns="debit_credit_ind")
+
+
+def _postings_frame(postings: List[Dict]) -> pd.DataFrame:
+    """Prepared frame of posted ledger rows (finance_expense fields, as the loader sends them)"""
+    df = pd.DataFrame.from_records(postings)
+    if "month_year" not in df.columns and {"general_ledger_fiscal_year", "posting_period"} <= set(df.columns):
+        df["month_year"] = month_year_key(df["general_ledger_fiscal_year"], df["posting_period"])
+    df = df.reindex(columns=STREAM_COLUMNS)
+    df["id"] = pd.to_numeric(df["id"], errors="coerce")
+    return _prepare_stream_frame(df)
+
+
+_cached_state = (0, None)
+_state_lock = threading.Lock()
+
+
+def _scorer_from_state(state):
+    try:
+        return StreamingAnomalyScorer.from_state(state)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Stored streaming scorer state is unreadable, reseeding it: {str(e)}")
+        return None
+
+
+def _load_scorer(session=None):
+    """(revision, private copy of the scorer state shared through MongoDB).
+
+    The stored state is only fetched when its revision moved. With no readable stored
+    state, one is seeded from the ledger snapshot and stored; if another worker stored one
+    first, that one is used.
+    """
+    global _cached_state
+    key = Config.ANOMALY_STREAM_GROUP_BY
+    for _ in range(STATE_RETRIES):
+        revision = StreamScorerState.get_revision(key)
+        if revision and revision != _cached_state[0]:
+            _cached_state = StreamScorerState.get_state(key)
+        if revision and revision == _cached_state[0]:
+            scorer = _scorer_from_state(_cached_state[1])
+            if scorer is not None:
+                return revision, scorer
+        elif revision:
+            continue
+        scorer = StreamingAnomalyScorer.from_snapshot(get_ledger_snapshot(session), key)
+        state = scorer.to_state()
+        if StreamScorerState.save_state(key, revision, state, watermark=scorer.watermark):
+            _cached_state = (revision + 1, state)
+            return revision + 1, scorer
+    raise RuntimeError("The shared streaming scorer state kept changing while it was read")
+
+
+def _with_shared_scorer(work, session=None):
+    """Run work(scorer) on the shared state and store the updated state.
+
+    The store is a compare-and-set on the state's revision, so when another worker absorbed
+    a batch first, work runs again on its newer state; every gunicorn worker therefore
+    scores against and advances the same watermark and statistics.
+    """
+    global _cached_state
+    key = Config.ANOMALY_STREAM_GROUP_BY
+    with _state_lock:
+        for _ in range(STATE_RETRIES):
+            revision, scorer = _load_scorer(session)
+            result = work(scorer)
+            state = scorer.to_state()
+            if StreamScorerState.save_state(key, revision, state, watermark=scorer.watermark):
+                _cached_state = (revision + 1, state)
+                return result
+            logger.info("Streaming scorer state was updated by another worker; scoring the batch again.")
+    raise RuntimeError("The shared streaming scorer state kept changing; batch not absorbed")
+
+
+def _batch_result(scorer, anomalies, scored, threshold, started, limit):
+    if len(anomalies):
+        logger.warning(f"Streaming scorer flagged {len(anomalies)} of {scored} postings.")
+    return {
+        "method": "streaming_z_score",
+        "threshold": threshold,
+        "scored_rows": scored,
+        "anomaly_count": len(anomalies),
+        "anomalies": anomaly_records(anomalies.head(limit)),
+        "watermark": scorer.watermark,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _score_frame(scorer, frame, threshold, absorb=True):
+    return scorer.score(frame, threshold, absorb) if len(frame) else pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+
+def score_posting_batch(postings: List[Dict], threshold: float = 2.5, limit: int = 100) -> Dict:
+    """Score a batch of postings pushed by the loader against the shared running state.
+
+    Pushed rows are scored only. The state, watermark included, advances from the rows
+    score_new_postings reads back from finance_expense, so a request can neither hide real
+    postings behind a made-up id nor skew the statistics with rows that were never stored.
+    """
+    started = time.perf_counter()
+    frame = _postings_frame(postings)
+    with _state_lock:
+        _, scorer = _load_scorer()
+    anomalies = _score_frame(scorer, frame, threshold, absorb=False)
+    return _batch_result(scorer, anomalies, len(frame), threshold, started, limit)
+
+
+def score_new_postings(threshold: float = 2.5, limit: int = 100, session=None) -> Dict:
+    """Score the postings written to finance_expense since the shared watermark, plus the
+    pending ids below it that have committed since"""
+    started = time.perf_counter()
+
+    def work(scorer):
+        frame = load_ledger_columns(STREAM_COLUMNS, session=session, id_range=(scorer.watermark, None))
+        if scorer.pending:
+            late = load_ledger_columns(STREAM_COLUMNS, filters={"id": sorted(scorer.pending)}, session=session)
+            frame = pd.concat([late, frame], ignore_index=True) if len(late) else frame
+        frame = _prepare_stream_frame(frame)
+        anomalies = _score_frame(scorer, frame, threshold)
+        return _batch_result(scorer, anomalies, len(frame), threshold, started, limit)
+
+    return _with_shared_scorer(work, session)
+
+
+def get_stream_status() -> Dict:
+    with _state_lock:
+        revision, scorer = _load_scorer()
+    return {**scorer.status(), "revision": revision}
@@ -0,0 +1,226 @@
+from app.services.ledger_service import get_ledger_snapshot
+from app.services.dimension_dictionary import DIMENSION_COLUMNS, get_dimension_dictionary
+from app.services.normalization import signed_rollup_amounts, DEBIT, CREDIT
+from app.services.ledger_filters import InvalidParameterError, PERIOD_PATTERN
+import pandas as pd
+import numpy as np
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CUBE_DIMENSIONS = [
+    "month_year", "directorate", "cost_center_id", "functional_area",
+    "general_ledger_account", "supplier"
+]
+
+# Additive measures stored per cell; "mean" is derived from amount and count
+STORED_MEASURES = ["amount", "count", "debit_amount", "credit_amount"]
+CUBE_MEASURES = STORED_MEASURES + ["mean"]
+
+
+class LedgerCube:
+    """Sparse aggregate cube over CUBE_DIMENSIONS.
+
+    Only non-empty cells are stored, one row each, with every dimension held as an
+    int32 code (-1 for missing) and the additive measures alongside. Queries filter and
+    regroup the cells instead of the postings, so roll-up and drill-down cost is bounded
+    by the number of cells.
+    """
+
+    def __init__(self, codes, categories, measures, version):
+        self.codes = codes
+        self.categories = categories
+        self.measures = measures
+        self.version = version
+        self.built_at = time.time()
+        self._labels = {
+            dimension: np.asarray(values, dtype=object) for dimension, values in categories.items()
+        }
+        self._lookup = {
+            dimension: {value: code for code, value in enumerate(values)}
+            for dimension, values in categories.items()
+        }
+
+    def __len__(self):
+        return len(self.measures)
+
+    @classmethod
+    def from_rollup(cls, rollup, version):
+        """Build the cube from a ledger rollup over CUBE_DIMENSIONS (see ledger_service.get_ledger_rollup)"""
+        indicator = rollup["debit_credit_ind"]
+        cells = pd.DataFrame({
+            **{dimension: rollup[dimension] for dimension in CUBE_DIMENSIONS},
+            "amount": signed_rollup_amounts(rollup),
+            "count": rollup["row_count"],
+            "debit_amount": np.where(indicator == DEBIT, rollup["abs_sum"], 0.0),
+            "credit_amount": np.where(indicator == CREDIT, rollup["abs_sum"], 0.0),
+        })
+        cells = cells.groupby(CUBE_DIMENSIONS, dropna=False, sort=False)[STORED_MEASURES].sum().reset_index()
+
+        dictionary = get_dimension_dictionary()
+        codes, categories = {}, {}
+        for dimension in CUBE_DIMENSIONS:
+            if dimension in DIMENSION_COLUMNS:
+                categorical = dictionary.categorical(dimension, cells[dimension])
+            else:
+                categorical = pd.Categorical(cells[dimension], categories=sorted(cells[dimension].dropna().unique()))
+            codes[dimension] = categorical.codes.astype(np.int32)
+            categories[dimension] = list(categorical.categories)
+
+        measures = cells[STORED_MEASURES].astype({"count": np.int64})
+        logger.info(f"Ledger cube built with {len(measures)} cells at version {version}.")
+        return cls(codes, categories, measures, version)
+
+    def _codes_for(self, dimension, values):
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        lookup = self._lookup[dimension]
+        return np.array([lookup[v] for v in values if v in lookup], dtype=np.int32)
+
+    def _mask(self, filters, time_range):
+        mask = np.ones(len(self), dtype=bool)
+        for dimension, values in (filters or {}).items():
+            mask &= np.isin(self.codes[dimension], self._codes_for(dimension, values))
+        if time_range:
+            months = self._labels["month_year"]
+            allowed = np.ones(len(months), dtype=bool)
+            if time_range.get("from"):
+                allowed &= months >= time_range["from"]
+            if time_range.get("to"):
+                allowed &= months <= time_range["to"]
+            month_codes = self.codes["month_year"]
+            mask &= (month_codes >= 0) & allowed[np.maximum(month_codes, 0)]
+        return mask
+
+    def query(self, measures=None, group_by=None, filters=None, time_range=None, order_by=None, limit=None):
+        """Aggregate the cube.
+
+        group_by lists the dimensions to keep (fewer rolls up, more drills down), filters
+        maps dimensions to a value or list of values, and time_range bounds month_year
+        with inclusive "from"/"to" keys in YYYY-MM form.
+        """
+        measures = _names(measures, "measures") or ["amount", "count"]
+        group_by = _names(group_by, "group_by")
+        _validate(measures, group_by, filters, order_by, time_range)
+
+        mask = self._mask(filters, time_range)
+        selected = self.measures[mask].reset_index(drop=True)
+        result = self._regroup(selected, mask, group_by) if group_by else selected.sum().to_frame().T
+
+        result["count"] = result["count"].astype(np.int64)
+        result["mean"] = result["amount"] / result["count"].where(result["count"] > 0)
+        if order_by:
+            result = result.sort_values(order_by, ascending=False)
+        elif "month_year" in group_by:
+            result = result.sort_values(group_by)
+        else:
+            result = result.sort_values("amount", ascending=False)
+        groups = len(result)
+        if limit:
+            result = result.head(int(limit))
+
+        totals = selected.sum()
+        return {
+            "measures": measures,
+            "group_by": group_by,
+            "filters": filters or {},
+            "time_range": time_range or {},
+            "rows": _records(result[group_by + measures]),
+            "groups": groups,
+            "totals": {
+                "amount": float(totals["amount"]),
+                "count": int(totals["count"]),
+                "debit_amount": float(totals["debit_amount"]),
+                "credit_amount": float(totals["credit_amount"]),
+            },
+            "cells_scanned": int(mask.sum()),
+            "data_version": self.version,
+        }
+
+    def _regroup(self, selected, mask, group_by):
+        keys = pd.DataFrame({dimension: self.codes[dimension][mask] for dimension in group_by})
+        result = selected.groupby([keys[d] for d in group_by], sort=False).sum().reset_index()
+        for dimension in group_by:
+            result[dimension] = np.where(
+                result[dimension] >= 0, self._labels[dimension][np.maximum(result[dimension], 0)], None
+            )
+        return result
+
+    def cells(self, group_by, filters=None, time_range=None):
+        """Stored measures of the matching cells regrouped by group_by, as a frame of labels and measures"""
+        _validate([], group_by, filters, None, time_range)
+        mask = self._mask(filters, time_range)
+        return self._regroup(self.measures[mask].reset_index(drop=True), mask, list(group_by))
+
+    def metadata(self):
+        return {
+            "dimensions": {
+                dimension: {"cardinality": int(np.unique(self.codes[dimension][self.codes[dimension] >= 0]).size)}
+                for dimension in CUBE_DIMENSIONS
+            },
+            "months": [m for m in self.categories["month_year"] if m],
+            "measures": CUBE_MEASURES,
+            "cells": len(self),
+            "data_version": self.version,
+        }
+
+
+def _names(value, parameter):
+    """A list of measure or dimension names from a request body; None and [] give []"""
+    if value is None:
+        return []
+    if not isinstance(value, (list, tuple)):
+        raise InvalidParameterError(f"{parameter} must be a list of names")
+    return list(value)
+
+
+def _validate(measures, group_by, filters, order_by, time_range=None):
+    if filters is not None and not isinstance(filters, dict):
+        raise InvalidParameterError("filters must map dimensions to a value or a list of values")
+    if time_range is not None and not isinstance(time_range, dict):
+        raise InvalidParameterError('time_range must be an object with "from" and/or "to" months')
+    for bound in ("from", "to"):
+        value = (time_range or {}).get(bound)
+        if value and not (isinstance(value, str) and PERIOD_PATTERN.match(value)):
+            raise InvalidParameterError(f"Invalid time_range {bound} '{value}', expected YYYY-MM")
+    unknown = [str(m) for m in measures if m not in CUBE_MEASURES]
+    if order_by and order_by not in CUBE_MEASURES:
+        unknown.append(str(order_by))
+    if unknown:
+        raise InvalidParameterError(f"Unknown measures: {', '.join(unknown)}. Available: {', '.join(CUBE_MEASURES)}")
+    unknown = [str(d) for d in list(group_by) + list(filters or {}) if d not in CUBE_DIMENSIONS]
+    if unknown:
+        raise InvalidParameterError(f"Unknown dimensions: {', '.join(unknown)}. Available: {', '.join(CUBE_DIMENSIONS)}")
+
+
+def _records(df):
+    """JSON-safe records: numpy scalars unwrapped and NaN mapped to None"""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+
+_cube = None
+_lock = threading.Lock()
+
+
+def get_ledger_cube(session=None):
+    """Cube for the current ledger snapshot, rebuilt from its (incrementally maintained) rollup on version change"""
+    global _cube
+    snapshot = get_ledger_snapshot(session)
+    if _cube is not None and _cube.version == snapshot.version:
+        return _cube
+    with _lock:
+        if _cube is None or _cube.version != snapshot.version:
+            _cube = LedgerCube.from_rollup(snapshot.rollup(CUBE_DIMENSIONS[1:]), snapshot.version)
+        return _cube
+
+
+def query_cube(measures=None, group_by=None, filters=None, time_range=None, order_by=None, limit=None):
+    """Main entry point for the cube query endpoint"""
+    return get_ledger_cube().query(measures, group_by, filters, time_range, order_by, limit)
+
+
+def get_cube_metadata():
+    return get_ledger_cube().metadata()
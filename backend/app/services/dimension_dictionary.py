@@ -0,0 +1,131 @@
+from app.config import Config
+import pandas as pd
+import numpy as np
+import threading
+import json
+import os
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Ledger columns held as dictionary-coded categoricals in the snapshot
+DIMENSION_COLUMNS = [
+    "cost_center_id", "cost_center_name", "directorate", "functional_area",
+    "functional_area_name", "general_ledger_account", "general_ledger_account_name",
+    "profit_center_id", "account_type", "supplier", "level_1", "level_7", "entity"
+]
+
+DICTIONARY_FILE = "dimensions.json"
+
+
+class DimensionDictionary:
+    """Append-only value -> integer code mapping per ledger dimension.
+
+    Codes never change once assigned, so frames built at different data versions, the
+    shared Arrow file and cached ML encodings all agree on them. Code 0 is reserved for
+    the empty string in every dimension so callers can keep filling blanks with "".
+    """
+
+    def __init__(self, values=None):
+        self._values = {}
+        self._index = {}
+        self._lock = threading.Lock()
+        for dimension, categories in (values or {}).items():
+            self._values[dimension] = list(categories)
+            self._index[dimension] = {value: code for code, value in enumerate(categories)}
+
+    def categories(self, dimension):
+        return list(self._values.get(dimension, [""]))
+
+    def _register(self, dimension, values):
+        categories = self._values.setdefault(dimension, [""])
+        index = self._index.setdefault(dimension, {"": 0})
+        for value in pd.unique(values.dropna()):
+            if value not in index:
+                index[value] = len(categories)
+                categories.append(value)
+
+    def categorical(self, dimension, values):
+        """Categorical of values on this dictionary's stable categories, extending it with unseen values"""
+        values = pd.Series(values, copy=False)
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            # Frames built on this dictionary already carry its codes; reuse them without rehashing
+            current = values.cat.categories
+            with self._lock:
+                categories = list(self._values.get(dimension, []))
+            if len(current) <= len(categories) and current.equals(pd.Index(categories[:len(current)])):
+                return pd.Categorical.from_codes(values.cat.codes, categories=categories)
+            values = values.astype(object)
+        values = values.where(values.isna(), values.astype(str))
+        with self._lock:
+            self._register(dimension, values)
+            categories = list(self._values[dimension])
+        return pd.Categorical(values, categories=categories)
+
+    def codes(self, dimension, values):
+        """int32 codes of values, -1 for missing"""
+        return self.categorical(dimension, values).codes.astype(np.int32)
+
+    def to_dict(self):
+        with self._lock:
+            return {dimension: list(categories) for dimension, categories in self._values.items()}
+
+    def save(self, path=None):
+        path = path or dictionary_path()
+        if not path:
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"dimensions": self.to_dict()}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=None):
+        path = path or dictionary_path()
+        if not path or not os.path.exists(path):
+            return cls()
+        try:
+            with open(path, encoding="utf-8") as f:
+                return cls(json.load(f).get("dimensions", {}))
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable dimension dictionary {path}: {str(e)}")
+            return cls()
+
+
+def dictionary_path():
+    if not Config.LEDGER_SNAPSHOT_DIR:
+        return None
+    return os.path.join(Config.LEDGER_SNAPSHOT_DIR, DICTIONARY_FILE)
+
+
+_dictionary = None
+_dictionary_lock = threading.Lock()
+
+
+def get_dimension_dictionary():
+    """Process-wide dictionary, seeded from the persisted copy on first use"""
+    global _dictionary
+    if _dictionary is None:
+        with _dictionary_lock:
+            if _dictionary is None:
+                _dictionary = DimensionDictionary.load()
+    return _dictionary
+
+
+def reload_dimension_dictionary():
+    """Re-read the persisted dictionary, e.g. after another worker exported the ledger"""
+    global _dictionary
+    with _dictionary_lock:
+        _dictionary = DimensionDictionary.load()
+    return _dictionary
+
+
+def encode_dimensions(df, dictionary=None):
+    """Convert the dimension columns present in df to dictionary-coded categoricals in place"""
+    dictionary = dictionary or get_dimension_dictionary()
+    for dimension in DIMENSION_COLUMNS:
+        if dimension in df.columns:
+            df[dimension] = dictionary.categorical(dimension, df[dimension])
+    return df
@@ -1,63 +1,54 @@
-from app.models.postgres import SessionLocal, FinanceExpense
+from app.models.postgres import SessionLocal
+from app.services.ledger_service import (
+    get_ledger_frame, load_ledger_columns, iter_ledger_chunks, LEDGER_COLUMNS, WIDE_TEXT_COLUMNS
+)
+from app.services.eda_sql_service import get_sql_eda_summary
+from app.services.eda_stream_service import summarize_chunks, time_series_chunks
+from app.services.rollup_service import get_rollup
+from app.services.normalization import normalize_ledger_frame, signed_rollup_amounts, fill_blanks
+from app.config import Config
 import pandas as pd
 
-def _normalize_amount(value, debit_credit_ind):
-    try:
-        amount = float(value or 0)
-        if debit_credit_ind == 'H' and amount > 0:
-            return -amount
-        elif debit_credit_ind == 'S' and amount < 0:
-            return -amount
-        return amount
-    except Exception:
-        return 0
-
-def get_eda_summary():
+OPTIONAL_TEXT_COLUMNS = [
+    "supplier", "reference", "transaction", "level_1", "level_7",
+    "directorate", "entity", "remapping_directorate", "status"
+]
+
+TIME_SERIES_COLUMNS = [
+    "company_code_currency_value", "debit_credit_ind", "month_year",
+    "general_ledger_fiscal_year", "posting_period", "directorate"
+]
+
+def _prepare_summary_frame(df):
+    df = df.rename(columns={"company_code_currency_key": "currency"})
+    df = normalize_ledger_frame(df, keep_raw=True)
+    text_columns = [c for c in OPTIONAL_TEXT_COLUMNS + WIDE_TEXT_COLUMNS if c in df.columns]
+    df[text_columns] = df[text_columns].where(df[text_columns] != "")
+    return df.drop(columns=["processed_database_rows"])
+
+def _prepare_time_series_frame(df):
+    df = normalize_ledger_frame(df, blank_columns=["month_year", "directorate"]).drop(columns="debit_credit_ind")
+    return df.rename(columns={"general_ledger_fiscal_year": "fiscal_year"})
+
+def get_eda_summary(filters=None):
     session = SessionLocal()
     try:
-        result = session.query(FinanceExpense).all()
-
-        df = pd.DataFrame([{
-            "id": r.id,
-            "posting_period": r.posting_period,
-            "ledger": r.ledger,
-            "company_code": r.company_code,
-            "region": r.region,
-            "profit_center_id": r.profit_center_id,
-            "profit_center_name": r.profit_center_name,
-            "funds_center": r.funds_center,
-            "cost_center_id": r.cost_center_id,
-            "cost_center_name": r.cost_center_name,
-            "general_ledger_account": r.general_ledger_account,
-            "general_ledger_account_name": r.general_ledger_account_name,
-            "fund": r.fund,
-            "functional_area": r.functional_area,
-            "functional_area_name": r.functional_area_name,
-            "general_ledger_fiscal_year": r.general_ledger_fiscal_year,
-            "account_type": r.account_type,
-            "currency": r.company_code_currency_key,
-            "debit_credit_ind": r.debit_credit_ind,
-            "raw_amount": float(r.company_code_currency_value or 0),
-            "amount": _normalize_amount(r.company_code_currency_value, r.debit_credit_ind),
-            "supplier": r.supplier if r.supplier else None,
-            "reference": r.reference if r.reference else None,
-            "document_header_text": r.document_header_text if r.document_header_text else None,
-            "po_description": r.po_description if r.po_description else None,
-            "transaction": r.transaction if r.transaction else None,
-            "level_1": r.level_1 if r.level_1 else None,
-            "level_7": r.level_7 if r.level_7 else None,
-            "directorate": r.directorate if r.directorate else None,
-            "entity": r.entity if r.entity else None,
-            "remapping_directorate": r.remapping_directorate if r.remapping_directorate else None,
-            "status": r.status if r.status else None,
-            "month_year": f"{r.general_ledger_fiscal_year}-{r.posting_period:02d}" if r.general_ledger_fiscal_year and r.posting_period else None
-        } for r in result])
+        if Config.EDA_BACKEND == "sql":
+            return get_sql_eda_summary(session, filters)
+        if Config.EDA_BACKEND == "stream":
+            chunks = iter_ledger_chunks(LEDGER_COLUMNS + ["month_year"], filters=filters, session=session)
+            return summarize_chunks(_prepare_summary_frame(chunk) for chunk in chunks)
+
+        df = _prepare_summary_frame(get_ledger_frame(session=session, filters=filters))
+
+        # The snapshot leaves out the free-text columns; profile them from a narrow query
+        text_df = load_ledger_columns(WIDE_TEXT_COLUMNS, filters=filters, session=session).replace({"": None})
 
         summary = {
             "total_rows": len(df),
             "data_quality": {
-                "missing_values": df.isnull().sum().to_dict(),
-                "unique_counts": df.nunique().to_dict(),
+                "missing_values": {**df.isnull().sum().to_dict(), **text_df.isnull().sum().to_dict()},
+                "unique_counts": {**df.nunique().to_dict(), **text_df.nunique().to_dict()},
                 "data_completeness": {
                     "valid_debit_records": len(df[(df['amount'] > 0) & (df['debit_credit_ind'] == 'S')]),
                     "valid_credit_records": len(df[(df['amount'] < 0) & (df['debit_credit_ind'] == 'H')]),
@@ -77,14 +68,14 @@ def get_eda_summary():
                 "currency_breakdown": df['currency'].value_counts().to_dict()
             },
             "organizational_breakdown": {
-                "top_directorates": df[df['directorate'].notna()].groupby("directorate")["amount"].sum().nlargest(5).to_dict(),
-                "top_profit_centers": df[df['profit_center_id'].notna()].groupby("profit_center_id")["amount"].sum().nlargest(5).to_dict(),
-                "top_cost_centers": df[df['cost_center_id'].notna()].groupby("cost_center_id")["amount"].sum().nlargest(5).to_dict(),
-                "top_functional_areas": df[df['functional_area'].notna()].groupby("functional_area")["amount"].sum().nlargest(5).to_dict()
+                "top_directorates": df[df['directorate'].notna()].groupby("directorate", observed=True)["amount"].sum().nlargest(5).to_dict(),
+                "top_profit_centers": df[df['profit_center_id'].notna()].groupby("profit_center_id", observed=True)["amount"].sum().nlargest(5).to_dict(),
+                "top_cost_centers": df[df['cost_center_id'].notna()].groupby("cost_center_id", observed=True)["amount"].sum().nlargest(5).to_dict(),
+                "top_functional_areas": df[df['functional_area'].notna()].groupby("functional_area", observed=True)["amount"].sum().nlargest(5).to_dict()
             },
             "general_ledger_account_analysis": {
-                "top_general_ledger_accounts": df[df['general_ledger_account_name'].notna()].groupby("general_ledger_account_name")["amount"].sum().nlargest(10).to_dict(),
-                "general_ledger_account_types": df[df['account_type'].notna()].groupby("account_type")["amount"].sum().to_dict()
+                "top_general_ledger_accounts": df[df['general_ledger_account_name'].notna()].groupby("general_ledger_account_name", observed=True)["amount"].sum().nlargest(10).to_dict(),
+                "general_ledger_account_types": df[df['account_type'].notna()].groupby("account_type", observed=True)["amount"].sum().to_dict()
             },
             "temporal_analysis": {
                 "by_fiscal_year": df.groupby("general_ledger_fiscal_year")["amount"].sum().to_dict(),
@@ -92,16 +83,16 @@ def get_eda_summary():
             },
             "transaction_analysis": {
                 "top_transaction_types": df[df['transaction'].notna()].groupby("transaction")["amount"].sum().nlargest(5).to_dict(),
-                "top_level_1": df[df['level_1'].notna()].groupby("level_1")["amount"].sum().nlargest(5).to_dict(),
+                "top_level_1": df[df['level_1'].notna()].groupby("level_1", observed=True)["amount"].sum().nlargest(5).to_dict(),
                 "debit_credit_split": df[df['debit_credit_ind'].notna()].groupby("debit_credit_ind")["amount"].sum().to_dict()
             },
             "supplier_analysis": {
-                "top_suppliers": df[df['supplier'].notna() & (df['supplier'] != '')].groupby("supplier")["amount"].sum().nlargest(10).to_dict(),
+                "top_suppliers": df[df['supplier'].notna() & (df['supplier'] != '')].groupby("supplier", observed=True)["amount"].sum().nlargest(10).to_dict(),
                 "supplier_count": len(df[df['supplier'].notna() & (df['supplier'] != '')]['supplier'].unique())
             },
             "geographic_analysis": {
                 "top_regions": df[df['region'].notna()].groupby("region")["amount"].sum().nlargest(5).to_dict(),
-                "top_entities": df[df['entity'].notna()].groupby("entity")["amount"].sum().nlargest(5).to_dict()
+                "top_entities": df[df['entity'].notna()].groupby("entity", observed=True)["amount"].sum().nlargest(5).to_dict()
             }
         }
 
@@ -110,20 +101,17 @@ def get_eda_summary():
     finally:
         session.close()
 
-def get_detailed_breakdown(dimension, top_n=10):
+def get_detailed_breakdown(dimension, top_n=10, filters=None):
     session = SessionLocal()
     try:
-        result = session.query(FinanceExpense).all()
-
-        df = pd.DataFrame([{
-            "amount": _normalize_amount(r.company_code_currency_value, r.debit_credit_ind),
-            "dimension_value": getattr(r, dimension, 'Unknown'),
-            "cost_center_id": r.cost_center_id,
-            "directorate": r.directorate or "",
-            "month_year": f"{r.general_ledger_fiscal_year}-{r.posting_period:02d}" if r.general_ledger_fiscal_year and r.posting_period else ""
-        } for r in result])
-
-        breakdown = df.groupby("dimension_value").agg({
+        columns = ["company_code_currency_value", "debit_credit_ind", "cost_center_id", "directorate", "month_year"]
+        if dimension in LEDGER_COLUMNS or dimension == "month_year":
+            columns.append(dimension)
+        df = get_ledger_frame(list(dict.fromkeys(columns)), session=session, filters=filters)
+        df["dimension_value"] = df[dimension] if dimension in df.columns else 'Unknown'
+        df = normalize_ledger_frame(df, blank_columns=["directorate", "month_year"])
+
+        breakdown = df.groupby("dimension_value", observed=True).agg({
             "amount": ["sum", "count", "mean", "std"],
             "cost_center_id": "nunique",
             "directorate": "nunique"
@@ -142,43 +130,45 @@ def get_detailed_breakdown(dimension, top_n=10):
     finally:
         session.close()
 
-def get_time_series_analysis(group_by="month_year"):
+def time_series_key(group_by):
+    """Column a time series requested with group_by is aggregated over"""
+    return group_by if group_by in ("month_year", "fiscal_year") else "posting_period"
+
+def get_time_series_analysis(group_by="month_year", filters=None):
     session = SessionLocal()
     try:
-        result = session.query(FinanceExpense).all()
-
-        df = pd.DataFrame([{
-            "amount": _normalize_amount(r.company_code_currency_value, r.debit_credit_ind),
-            "month_year": f"{r.general_ledger_fiscal_year}-{r.posting_period:02d}" if r.general_ledger_fiscal_year and r.posting_period else "",
-            "fiscal_year": r.general_ledger_fiscal_year,
-            "posting_period": r.posting_period,
-            "directorate": r.directorate or ""
-        } for r in result])
-
-        if group_by == "month_year":
-            df['sort_key'] = pd.to_datetime(df['month_year'], format='%Y-%m', errors='coerce')
-            df = df.sort_values('sort_key')
-            time_series = df.groupby("month_year")["amount"].agg(["sum", "count", "mean"]).reset_index()
-        elif group_by == "fiscal_year":
-            time_series = df.groupby("fiscal_year")["amount"].agg(["sum", "count", "mean"]).reset_index()
-            time_series = time_series.sort_values('fiscal_year')
-        else:
-            time_series = df.groupby("posting_period")["amount"].agg(["sum", "count", "mean"]).reset_index()
-            time_series = time_series.sort_values('posting_period')
-
-        previous_amounts = time_series['sum'].shift(1)
-        current_amounts = time_series['sum']
-        time_series['growth_rate'] = ((current_amounts - previous_amounts) / previous_amounts.abs()) * 100
-
-        return {
-            "time_series": time_series.to_dict('records'),
-            "summary": {
-                "total_periods": len(time_series),
-                "avg_growth_rate": time_series['growth_rate'].mean(),
-                "max_amount_period": time_series.loc[time_series['sum'].idxmax()].to_dict(),
-                "min_amount_period": time_series.loc[time_series['sum'].idxmin()].to_dict()
-            }
-        }
+        if Config.EDA_BACKEND == "stream":
+            key = time_series_key(group_by)
+            chunks = iter_ledger_chunks(TIME_SERIES_COLUMNS, filters=filters, session=session)
+            time_series = time_series_chunks((_prepare_time_series_frame(chunk) for chunk in chunks), key)
+            return _time_series_result(time_series)
+
+        # Period totals come from the month x dimension rollups rather than individual postings
+        rollup = get_rollup(session=session, filters=filters)
+        rollup["amount"] = signed_rollup_amounts(rollup)
+        rollup = fill_blanks(rollup, ["month_year"]).rename(columns={"general_ledger_fiscal_year": "fiscal_year"})
+        key = time_series_key(group_by)
+
+        time_series = rollup.groupby(key)[["amount", "row_count"]].sum()
+        time_series = time_series.rename(columns={"amount": "sum", "row_count": "count"}).sort_index()
+        time_series["count"] = time_series["count"].astype(int)
+        time_series["mean"] = time_series["sum"] / time_series["count"]
+        return _time_series_result(time_series.rename_axis(key).reset_index())
 
     finally:
         session.close()
+
+def _time_series_result(time_series):
+    previous_amounts = time_series['sum'].shift(1)
+    current_amounts = time_series['sum']
+    time_series['growth_rate'] = ((current_amounts - previous_amounts) / previous_amounts.abs()) * 100
+
+    return {
+        "time_series": time_series.to_dict('records'),
+        "summary": {
+            "total_periods": len(time_series),
+            "avg_growth_rate": time_series['growth_rate'].mean(),
+            "max_amount_period": time_series.loc[time_series['sum'].idxmax()].to_dict(),
+            "min_amount_period": time_series.loc[time_series['sum'].idxmin()].to_dict()
+        }
+    }
@@ -0,0 +1,225 @@
+from app.services.ledger_filters import LedgerFilter
+from sqlalchemy import text
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Signed amount, same semantics as normalization.signed_amounts
+AMOUNT_SQL = """
+    CASE debit_credit_ind
+        WHEN 'H' THEN -ABS(COALESCE(company_code_currency_value, 0))
+        WHEN 'S' THEN ABS(COALESCE(company_code_currency_value, 0))
+        ELSE COALESCE(company_code_currency_value, 0)
+    END
+"""
+
+MONTH_YEAR_SQL = """
+    CASE WHEN NULLIF(general_ledger_fiscal_year, '') IS NOT NULL AND posting_period <> 0
+         THEN general_ledger_fiscal_year || '-' || LPAD(posting_period::text, 2, '0')
+    END
+"""
+
+# Output column -> SQL expression over finance_expense. Mirrors the frame that the
+# pandas summary profiles, including the empty-string-to-NULL cleanup of text columns.
+PROFILE_COLUMNS = {
+    "id": "id",
+    "posting_period": "posting_period",
+    "ledger": "ledger",
+    "company_code": "company_code",
+    "region": "region",
+    "profit_center_id": "profit_center_id",
+    "profit_center_name": "profit_center_name",
+    "funds_center": "funds_center",
+    "cost_center_id": "cost_center_id",
+    "cost_center_name": "cost_center_name",
+    "general_ledger_account": "general_ledger_account",
+    "general_ledger_account_name": "general_ledger_account_name",
+    "fund": "fund",
+    "functional_area": "functional_area",
+    "functional_area_name": "functional_area_name",
+    "general_ledger_fiscal_year": "general_ledger_fiscal_year",
+    "account_type": "account_type",
+    "currency": "company_code_currency_key",
+    "debit_credit_ind": "debit_credit_ind",
+    "raw_amount": "COALESCE(company_code_currency_value, 0)",
+    "amount": AMOUNT_SQL,
+    "supplier": "NULLIF(supplier, '')",
+    "reference": "NULLIF(reference, '')",
+    "document_header_text": "NULLIF(document_header_text, '')",
+    "po_description": "NULLIF(po_description, '')",
+    "transaction": "NULLIF(\"transaction\", '')",
+    "level_1": "NULLIF(level_1, '')",
+    "level_7": "NULLIF(level_7, '')",
+    "directorate": "NULLIF(directorate, '')",
+    "entity": "NULLIF(entity, '')",
+    "remapping_directorate": "NULLIF(remapping_directorate, '')",
+    "status": "NULLIF(status, '')",
+    "month_year": MONTH_YEAR_SQL,
+}
+
+# Grouped breakdowns: dimension -> (measure to rank by, top N or None for all groups)
+BREAKDOWNS = {
+    "directorate": ("total", 5),
+    "profit_center_id": ("total", 5),
+    "cost_center_id": ("total", 5),
+    "functional_area": ("total", 5),
+    "general_ledger_account_name": ("total", 10),
+    "account_type": ("total", None),
+    "general_ledger_fiscal_year": ("total", None),
+    "month_year": ("total", 6),
+    "transaction": ("total", 5),
+    "level_1": ("total", 5),
+    "debit_credit_ind": ("total", None),
+    "supplier": ("total", 10),
+    "region": ("total", 5),
+    "entity": ("total", 5),
+    "currency": ("row_count", None),
+}
+
+
+def _quote(name):
+    return f'"{name}"'
+
+
+def _profile_sql(where="TRUE"):
+    aggregates = ["COUNT(*) AS total_rows"]
+    for name in PROFILE_COLUMNS:
+        aggregates.append(f"COUNT(*) - COUNT({_quote(name)}) AS {_quote('missing__' + name)}")
+        aggregates.append(f"COUNT(DISTINCT {_quote(name)}) AS {_quote('unique__' + name)}")
+    aggregates += [
+        "COUNT(*) FILTER (WHERE amount > 0 AND debit_credit_ind = 'S') AS valid_debit_records",
+        "COUNT(*) FILTER (WHERE amount < 0 AND debit_credit_ind = 'H') AS valid_credit_records",
+        "COUNT(*) FILTER (WHERE amount = 0) AS zero_amount_records",
+        "COUNT(*) FILTER (WHERE (debit_credit_ind = 'S' AND amount < 0)"
+        " OR (debit_credit_ind = 'H' AND amount > 0)) AS inconsistent_records",
+        "COUNT(*) FILTER (WHERE debit_credit_ind IS NULL"
+        " OR debit_credit_ind NOT IN ('S', 'H')) AS unknown_debit_credit_code",
+        "SUM(amount) AS total_amount",
+        "AVG(amount) AS average_amount",
+        "PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY amount) AS median_amount",
+    ]
+    return f"{_base_cte(where)} SELECT {', '.join(aggregates)} FROM base"
+
+
+def _base_cte(where="TRUE"):
+    columns = ", ".join(f"{expr} AS {_quote(name)}" for name, expr in PROFILE_COLUMNS.items())
+    return f"WITH base AS (SELECT {columns} FROM finance_expense WHERE {where})"
+
+
+def _breakdown_sql(where="TRUE"):
+    dimensions = list(BREAKDOWNS)
+    dimension_name = " ".join(
+        f"WHEN GROUPING({_quote(d)}) = 0 THEN '{d}'" for d in dimensions
+    )
+    # Only the grouped column is non-NULL in each grouping set, so COALESCE yields its value
+    dimension_value = ", ".join(f"{_quote(d)}::text" for d in dimensions)
+    grouping_sets = ", ".join(f"({_quote(d)})" for d in dimensions)
+    rank_order = " ".join(
+        f"WHEN '{d}' THEN {order}" for d, (order, _) in BREAKDOWNS.items() if order != "total"
+    )
+    top_n = " ".join(
+        f"WHEN '{d}' THEN {limit}" for d, (_, limit) in BREAKDOWNS.items() if limit is not None
+    )
+    return f"""
+        {_base_cte(where)},
+        grouped AS (
+            SELECT CASE {dimension_name} END AS dimension,
+                   COALESCE({dimension_value}) AS value,
+                   SUM(amount) AS total,
+                   COUNT(*) AS row_count
+            FROM base
+            GROUP BY GROUPING SETS ({grouping_sets})
+        ),
+        ranked AS (
+            SELECT dimension, value, total, row_count,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY dimension
+                       ORDER BY CASE dimension {rank_order} ELSE total END DESC, value
+                   ) AS group_rank,
+                   CASE dimension {top_n} END AS top_n
+            FROM grouped
+            WHERE value IS NOT NULL
+        )
+        SELECT dimension, value, total, row_count, group_rank
+        FROM ranked
+        WHERE top_n IS NULL OR group_rank <= top_n
+        ORDER BY dimension, group_rank
+    """
+
+
+def _collect_breakdowns(rows):
+    breakdowns = {dimension: [] for dimension in BREAKDOWNS}
+    for row in rows:
+        breakdowns[row["dimension"]].append(row)
+
+    result = {}
+    for dimension, (order, limit) in BREAKDOWNS.items():
+        dimension_rows = breakdowns[dimension]
+        if limit is None and order == "total":
+            # Unranked breakdowns keep pandas' groupby key order
+            dimension_rows = sorted(dimension_rows, key=lambda r: r["value"])
+        result[dimension] = {r["value"]: r[order] for r in dimension_rows}
+    return result
+
+
+def get_sql_eda_summary(session, filters=None):
+    """EDA summary computed inside PostgreSQL, same shape as eda_service.get_eda_summary.
+
+    A LedgerFilter restricts the rows in the base CTE's WHERE clause.
+    """
+    where, params = LedgerFilter.coerce(filters).where_sql()
+    profile = session.execute(text(_profile_sql(where)), params).mappings().one()
+    groups = _collect_breakdowns(session.execute(text(_breakdown_sql(where)), params).mappings().all())
+    logger.info(f"SQL EDA summary computed over {profile['total_rows']} rows.")
+
+    return {
+        "total_rows": profile["total_rows"],
+        "data_quality": {
+            "missing_values": {name: profile[f"missing__{name}"] for name in PROFILE_COLUMNS},
+            "unique_counts": {name: profile[f"unique__{name}"] for name in PROFILE_COLUMNS},
+            "data_completeness": {
+                "valid_debit_records": profile["valid_debit_records"],
+                "valid_credit_records": profile["valid_credit_records"],
+                "zero_amount_records": profile["zero_amount_records"],
+                "inconsistent_records": profile["inconsistent_records"]
+            },
+            "warnings": {
+                "non_numeric_amounts": 0,
+                "unknown_debit_credit_code": profile["unknown_debit_credit_code"]
+            }
+        },
+        "financial_summary": {
+            "total_amount": profile["total_amount"] or 0,
+            "average_amount": profile["average_amount"],
+            "median_amount": profile["median_amount"],
+            "currency_breakdown": groups["currency"]
+        },
+        "organizational_breakdown": {
+            "top_directorates": groups["directorate"],
+            "top_profit_centers": groups["profit_center_id"],
+            "top_cost_centers": groups["cost_center_id"],
+            "top_functional_areas": groups["functional_area"]
+        },
+        "general_ledger_account_analysis": {
+            "top_general_ledger_accounts": groups["general_ledger_account_name"],
+            "general_ledger_account_types": groups["account_type"]
+        },
+        "temporal_analysis": {
+            "by_fiscal_year": groups["general_ledger_fiscal_year"],
+            "recent_months": groups["month_year"]
+        },
+        "transaction_analysis": {
+            "top_transaction_types": groups["transaction"],
+            "top_level_1": groups["level_1"],
+            "debit_credit_split": groups["debit_credit_ind"]
+        },
+        "supplier_analysis": {
+            "top_suppliers": groups["supplier"],
+            "supplier_count": profile["unique__supplier"]
+        },
+        "geographic_analysis": {
+            "top_regions": groups["region"],
+            "top_entities": groups["entity"]
+        }
+    }
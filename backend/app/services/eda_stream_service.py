@@ -0,0 +1,161 @@
+from app.utils.sketches import HyperLogLog, QuantileSketch
+import pandas as pd
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Grouped breakdowns merged across chunks: dimension -> top N (None keeps every group)
+SUMMED_DIMENSIONS = {
+    "directorate": 5,
+    "profit_center_id": 5,
+    "cost_center_id": 5,
+    "functional_area": 5,
+    "general_ledger_account_name": 10,
+    "account_type": None,
+    "general_ledger_fiscal_year": None,
+    "month_year": 6,
+    "transaction": 5,
+    "level_1": 5,
+    "debit_credit_ind": None,
+    "supplier": 10,
+    "region": 5,
+    "entity": 5,
+}
+
+
+def _add_groups(accumulated, part):
+    """Merge a chunk's per-group partials into the running totals"""
+    part.index = part.index.astype(object)
+    if accumulated is None:
+        return part
+    return accumulated.add(part, fill_value=0)
+
+
+class StreamingSummary:
+    """Mergeable partial aggregates for the EDA summary.
+
+    Sums, counts and per-group totals are exact; per-group state is bounded by dimension
+    cardinality. Distinct counts (HyperLogLog) and the median (quantile sketch) are
+    approximate so their memory does not grow with the table.
+    """
+
+    def __init__(self):
+        self.total_rows = 0
+        self.missing = None
+        self.distinct = {}
+        self.completeness = {
+            "valid_debit_records": 0,
+            "valid_credit_records": 0,
+            "zero_amount_records": 0,
+            "inconsistent_records": 0
+        }
+        self.unknown_debit_credit = 0
+        self.amount_sum = 0.0
+        self.amount_quantiles = QuantileSketch()
+        self.currency_counts = None
+        self.group_sums = {dimension: None for dimension in SUMMED_DIMENSIONS}
+
+    def add(self, df):
+        self.total_rows += len(df)
+        self.missing = _add_groups(self.missing, df.isnull().sum())
+        for column in df.columns:
+            self.distinct.setdefault(column, HyperLogLog()).add(df[column])
+
+        debit = df['debit_credit_ind'] == 'S'
+        credit = df['debit_credit_ind'] == 'H'
+        self.completeness["valid_debit_records"] += int(((df['amount'] > 0) & debit).sum())
+        self.completeness["valid_credit_records"] += int(((df['amount'] < 0) & credit).sum())
+        self.completeness["zero_amount_records"] += int((df['amount'] == 0).sum())
+        self.completeness["inconsistent_records"] += int(
+            ((debit & (df['amount'] < 0)) | (credit & (df['amount'] > 0))).sum()
+        )
+        self.unknown_debit_credit += int((~df['debit_credit_ind'].isin(['S', 'H'])).sum())
+
+        self.amount_sum += float(df['amount'].sum())
+        self.amount_quantiles.add(df['amount'])
+        self.currency_counts = _add_groups(self.currency_counts, df['currency'].value_counts())
+        for dimension in SUMMED_DIMENSIONS:
+            part = df.groupby(dimension, observed=True)["amount"].sum()
+            self.group_sums[dimension] = _add_groups(self.group_sums[dimension], part)
+
+    def _groups(self, dimension):
+        totals = self.group_sums[dimension]
+        if totals is None:
+            return {}
+        top_n = SUMMED_DIMENSIONS[dimension]
+        if top_n is None:
+            return totals.sort_index().to_dict()
+        return totals.nlargest(top_n).to_dict()
+
+    def result(self):
+        average = self.amount_sum / self.total_rows if self.total_rows else None
+        currency = self.currency_counts.sort_values(ascending=False) if self.currency_counts is not None else {}
+        return {
+            "total_rows": self.total_rows,
+            "data_quality": {
+                "missing_values": {k: int(v) for k, v in (self.missing if self.missing is not None else {}).items()},
+                "unique_counts": {column: hll.count() for column, hll in self.distinct.items()},
+                "data_completeness": dict(self.completeness),
+                "warnings": {
+                    "non_numeric_amounts": 0,
+                    "unknown_debit_credit_code": self.unknown_debit_credit
+                }
+            },
+            "financial_summary": {
+                "total_amount": self.amount_sum,
+                "average_amount": average,
+                "median_amount": self.amount_quantiles.quantile(0.5),
+                "currency_breakdown": {k: int(v) for k, v in dict(currency).items()}
+            },
+            "organizational_breakdown": {
+                "top_directorates": self._groups("directorate"),
+                "top_profit_centers": self._groups("profit_center_id"),
+                "top_cost_centers": self._groups("cost_center_id"),
+                "top_functional_areas": self._groups("functional_area")
+            },
+            "general_ledger_account_analysis": {
+                "top_general_ledger_accounts": self._groups("general_ledger_account_name"),
+                "general_ledger_account_types": self._groups("account_type")
+            },
+            "temporal_analysis": {
+                "by_fiscal_year": self._groups("general_ledger_fiscal_year"),
+                "recent_months": self._groups("month_year")
+            },
+            "transaction_analysis": {
+                "top_transaction_types": self._groups("transaction"),
+                "top_level_1": self._groups("level_1"),
+                "debit_credit_split": self._groups("debit_credit_ind")
+            },
+            "supplier_analysis": {
+                "top_suppliers": self._groups("supplier"),
+                "supplier_count": self.distinct["supplier"].count() if "supplier" in self.distinct else 0
+            },
+            "geographic_analysis": {
+                "top_regions": self._groups("region"),
+                "top_entities": self._groups("entity")
+            }
+        }
+
+
+def summarize_chunks(chunks):
+    """EDA summary over an iterable of prepared frames, holding one chunk in memory at a time"""
+    summary = StreamingSummary()
+    for chunk in chunks:
+        summary.add(chunk)
+    logger.info(f"Streaming EDA summary aggregated {summary.total_rows} rows.")
+    return summary.result()
+
+
+def time_series_chunks(chunks, group_by):
+    """Per-period sum/count/mean merged across chunks, sorted by period"""
+    totals = None
+    for chunk in chunks:
+        part = chunk.groupby(group_by)["amount"].agg(["sum", "count"])
+        totals = _add_groups(totals, part)
+    if totals is None:
+        return pd.DataFrame(columns=[group_by, "sum", "count", "mean"])
+    totals = totals.sort_index()
+    totals["count"] = totals["count"].astype(int)
+    totals["mean"] = totals["sum"] / totals["count"]
+    return totals.rename_axis(group_by).reset_index()
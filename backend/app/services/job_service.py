@@ -0,0 +1,245 @@
+from app.services.anomaly_service import get_anomaly_analysis, detector_params
+from app.services.rca_service import perform_comprehensive_rca, perform_dynamic_rca
+from app.services.eda_service import get_eda_summary, get_detailed_breakdown, get_time_series_analysis, time_series_key
+from app.services.visualization_service import get_visualization_data
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError, number_arg, month_arg
+from app.services.result_cache import get_cached_result, analysis_params, serialize_result
+from app.models.mongo import AnalysisJob
+from app.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import json
+import os
+import socket
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = ("succeeded", "failed")
+UNFINISHED_STATUSES = ("queued", "running")
+EDA_VIEWS = ["summary", "breakdown", "timeseries"]
+
+# Seconds between status reads while long-polling a job another worker runs
+POLL_INTERVAL = 0.5
+
+
+def _run_anomaly(params, filters, progress):
+    method = params.get("method", "comprehensive")
+    options = detector_params(method, params)
+    # Same cache entries as /anomaly/detect
+    return get_cached_result(
+        "anomaly/detect", analysis_params(filters, {"method": method, **options}),
+        lambda: get_anomaly_analysis(method, filters, options)
+    )
+
+
+def _run_rca(params, filters, progress):
+    from_month, to_month = month_arg(params, "from_month"), month_arg(params, "to_month")
+    if from_month and to_month:
+        return get_cached_result(
+            "rca/comprehensive", analysis_params(filters, {"from_month": from_month, "to_month": to_month}),
+            lambda: perform_comprehensive_rca(from_month, to_month, filters)
+        )
+    return get_cached_result(
+        "rca/dynamic", analysis_params(filters), lambda: perform_dynamic_rca(filters, progress)
+    )
+
+
+def _run_eda(params, filters, progress):
+    view = params.get("view", "summary")
+    # Same cache entries as the /eda endpoints
+    if view == "breakdown":
+        dimension = params["dimension"]
+        top_n = number_arg(params, "top_n", 10, int)
+        return get_cached_result(
+            f"eda/breakdown/{dimension}", analysis_params(filters, {"top_n": top_n}),
+            lambda: get_detailed_breakdown(dimension, top_n, filters)
+        )
+    if view == "timeseries":
+        group_by = time_series_key(params.get("group_by", "month_year"))
+        return get_cached_result(
+            "eda/timeseries", analysis_params(filters, {"group_by": group_by}),
+            lambda: get_time_series_analysis(group_by, filters)
+        )
+    return get_cached_result("eda", analysis_params(filters), lambda: get_eda_summary(filters))
+
+
+def _run_dashboard(params, filters, progress):
+    return get_cached_result(
+        "dashboard", analysis_params(filters), lambda: get_visualization_data("dashboard", filters=filters)
+    )
+
+
+# Analyses a job can run: kind -> runner(params, filters, progress)
+JOB_KINDS = {
+    "anomaly": _run_anomaly,
+    "rca": _run_rca,
+    "eda": _run_eda,
+    "dashboard": _run_dashboard,
+}
+
+
+def _validate(kind, params):
+    if kind not in JOB_KINDS:
+        raise InvalidParameterError(f"Unknown job kind '{kind}', expected one of {', '.join(JOB_KINDS)}")
+    if kind == "eda":
+        view = params.get("view", "summary")
+        if view not in EDA_VIEWS:
+            raise InvalidParameterError(f"Unknown EDA view '{view}', expected one of {', '.join(EDA_VIEWS)}")
+        if view == "breakdown" and not params.get("dimension"):
+            raise InvalidParameterError("An EDA breakdown job needs a dimension")
+        number_arg(params, "top_n", 10, int)
+    if kind == "anomaly":
+        detector_params(params.get("method", "comprehensive"), params)
+    if kind == "rca" and bool(month_arg(params, "from_month")) != bool(month_arg(params, "to_month")):
+        raise InvalidParameterError("An RCA job needs both from_month and to_month, or neither")
+    return LedgerFilter.from_args(params)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+_indexes_ready = False
+# Completion events of the jobs this worker runs, so long-polls on them wake immediately
+_done_events = {}
+
+
+def _owner():
+    """Identifies this worker process on the jobs it runs"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def _heartbeat():
+    """Renew the heartbeat of this worker's unfinished jobs for as long as it is alive"""
+    while True:
+        time.sleep(Config.JOB_HEARTBEAT_INTERVAL)
+        job_ids = list(_done_events)
+        if not job_ids:
+            continue
+        try:
+            AnalysisJob.touch_jobs(job_ids, UNFINISHED_STATUSES)
+        except Exception as e:
+            logger.warning(f"Could not renew analysis job heartbeats: {str(e)}")
+
+
+def _fail_stale_jobs(username):
+    """Fail the user's unfinished jobs whose worker stopped sending heartbeats.
+
+    A worker that dies (crash, OOM kill, redeploy) leaves its jobs queued or running;
+    without this they would stay so until they expire.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=Config.JOB_STALE_AFTER)
+    failed = AnalysisJob.fail_stale_jobs(
+        username, UNFINISHED_STATUSES, cutoff, "The worker running this job stopped before it finished"
+    )
+    if failed:
+        logger.warning(f"Marked {failed} abandoned analysis job(s) of {username} failed.")
+
+
+def _read_job(job_id, username):
+    """A job of the user, failed first if it is unfinished and its heartbeat went stale"""
+    job = AnalysisJob.get_job(job_id, username)
+    if job is None or job["status"] in FINISHED_STATUSES:
+        return job
+    heartbeat_at = job.get("heartbeat_at")
+    if heartbeat_at is None or heartbeat_at < datetime.utcnow() - timedelta(seconds=Config.JOB_STALE_AFTER):
+        _fail_stale_jobs(username)
+        job = AnalysisJob.get_job(job_id, username)
+    return job
+
+
+def _job_executor():
+    global _executor, _indexes_ready
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=Config.JOB_WORKERS, thread_name_prefix="analysis-job")
+            threading.Thread(target=_heartbeat, name="analysis-job-heartbeat", daemon=True).start()
+        if not _indexes_ready:
+            try:
+                AnalysisJob.ensure_indexes()
+                _indexes_ready = True
+            except Exception as e:
+                logger.warning(f"Could not create analysis job indexes: {str(e)}")
+    return _executor
+
+
+def _run_job(job_id, kind, params, filters, done):
+    started = time.perf_counter()
+    now = datetime.utcnow()
+    AnalysisJob.update_job(job_id, status="running", started_at=now, heartbeat_at=now)
+
+    def progress(fraction, message=None):
+        AnalysisJob.update_job(job_id, progress=round(float(fraction), 3), message=message)
+
+    try:
+        result = JOB_KINDS[kind](params, filters, progress)
+        if isinstance(result, dict) and "error" in result:
+            AnalysisJob.update_job(job_id, status="failed", error=str(result["error"]), finished_at=datetime.utcnow())
+        elif not AnalysisJob.update_job(
+            job_id, status="succeeded", progress=1.0, result=serialize_result(result), finished_at=datetime.utcnow()
+        ):
+            AnalysisJob.update_job(
+                job_id, status="failed", error="Result could not be stored", finished_at=datetime.utcnow()
+            )
+        logger.info(f"Analysis job {job_id} ({kind}) finished in {time.perf_counter() - started:.1f}s.")
+    except Exception as e:
+        logger.error(f"Analysis job {job_id} ({kind}) failed: {str(e)}")
+        AnalysisJob.update_job(job_id, status="failed", error=str(e), finished_at=datetime.utcnow())
+    finally:
+        done.set()
+        _done_events.pop(job_id, None)
+
+
+def submit_job(username: str, kind: str, params: Optional[Dict] = None) -> str:
+    """Queue an analysis for the user and return its job id without waiting for it.
+
+    Parameters are those of the matching endpoint (ledger filters, method, threshold,
+    from_month/to_month, view, ...). Invalid ones raise InvalidParameterError before anything is queued.
+    """
+    params = dict(params or {})
+    filters = _validate(kind, params)
+    executor = _job_executor()
+    expires_at = datetime.utcnow() + timedelta(seconds=Config.JOB_RESULT_TTL)
+    job_id = AnalysisJob.create_job(username, kind, params, expires_at, _owner())
+    done = threading.Event()
+    _done_events[job_id] = done
+    executor.submit(_run_job, job_id, kind, params, filters, done)
+    logger.info(f"Queued analysis job {job_id} ({kind}) for {username}.")
+    return job_id
+
+
+def _job_view(job):
+    if job.get("result") is not None:
+        job["result"] = json.loads(job["result"])
+    return job
+
+
+def get_job_status(job_id: str, username: str, wait: float = 0) -> Optional[Dict]:
+    """A job of the user, or None. With `wait`, block up to that many seconds (at most
+    JOB_MAX_WAIT) for an unfinished job to finish before answering.
+
+    Each wait holds the request's worker (a whole sync gunicorn worker) until it returns.
+    """
+    job = _read_job(job_id, username)
+    if job is None or job["status"] in FINISHED_STATUSES or wait <= 0:
+        return _job_view(job) if job else None
+
+    deadline = time.monotonic() + min(wait, Config.JOB_MAX_WAIT)
+    done = _done_events.get(job_id)
+    if done is not None:
+        done.wait(max(deadline - time.monotonic(), 0))
+        job = _read_job(job_id, username)
+    else:
+        # Run by another worker: poll the stored status instead
+        while job is not None and job["status"] not in FINISHED_STATUSES and time.monotonic() < deadline:
+            time.sleep(min(POLL_INTERVAL, max(deadline - time.monotonic(), 0)))
+            job = _read_job(job_id, username)
+    return _job_view(job) if job else None
+
+
+def list_jobs(username: str, limit: int = 20) -> List[Dict]:
+    _fail_stale_jobs(username)
+    return AnalysisJob.get_user_jobs(username, limit)
@@ -0,0 +1,163 @@
+from sqlalchemy import tuple_, literal, Integer, String
+import pandas as pd
+import re
+
+# Request parameter -> finance_expense column it filters
+FILTER_PARAMETERS = {
+    "directorate": "directorate",
+    "cost_center": "cost_center_id",
+    "company_code": "company_code",
+    "functional_area": "functional_area",
+    # Expense categories are functional areas (see the category breakdown chart)
+    "category": "functional_area_name",
+}
+
+PERIOD_PATTERN = re.compile(r"^(\d{4})-(\d{2})$")
+
+
+class InvalidParameterError(ValueError):
+    """A missing or malformed request parameter; the routes answer it with a 400"""
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set)):
+        return list(value)
+    return [value]
+
+
+def _parse_period(value):
+    """(fiscal year, posting period) of a YYYY-MM string, or None"""
+    if isinstance(value, (list, tuple)):
+        value = value[0] if value else None
+    if value in (None, ""):
+        return None
+    match = PERIOD_PATTERN.match(str(value).strip())
+    if not match:
+        raise InvalidParameterError(f"Invalid period '{value}', expected YYYY-MM")
+    return match.group(1), int(match.group(2))
+
+
+def month_arg(args, name):
+    """args[name] as a normalized "YYYY-MM" month, or None when it is absent or blank"""
+    period = _parse_period((args or {}).get(name))
+    return "%s-%02d" % period if period else None
+
+
+def number_arg(args, name, default, kind=float):
+    """args[name] converted with kind, or default when it is absent or blank"""
+    value = (args or {}).get(name)
+    if value is None or str(value).strip() == "":
+        return default
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        expected = "a whole number" if kind is int else "a number"
+        raise InvalidParameterError(f"Invalid {name} '{value}', expected {expected}")
+
+
+class LedgerFilter:
+    """Common row filter for the analytics endpoints.
+
+    An inclusive period range over fiscal year/posting period ("YYYY-MM" bounds) plus
+    accepted values per ledger column. The same spec renders as SQLAlchemy conditions,
+    a raw SQL WHERE fragment and a pandas mask, so it is applied in PostgreSQL when
+    rows are loaded and in memory when a warm snapshot already holds them.
+    """
+
+    def __init__(self, period_from=None, period_to=None, columns=None):
+        self.period_from = _parse_period(period_from)
+        self.period_to = _parse_period(period_to)
+        self.columns = {}
+        for column, values in (columns or {}).items():
+            values = [v for v in _as_list(values) if v not in (None, "")]
+            if values:
+                self.columns[column] = values
+
+    @classmethod
+    def from_args(cls, args):
+        """Build from request arguments; list filters may repeat the parameter or be comma-separated"""
+        args = args or {}
+        columns = {}
+        for parameter, column in FILTER_PARAMETERS.items():
+            raw = args.getlist(parameter) if hasattr(args, "getlist") else _as_list(args.get(parameter))
+            values = [v.strip() for value in raw for v in str(value).split(",") if v.strip()]
+            if values:
+                columns[column] = values
+        return cls(args.get("period_from"), args.get("period_to"), columns)
+
+    @classmethod
+    def coerce(cls, filters):
+        """Accept a LedgerFilter, None, or a plain {column: value or values} dict"""
+        if isinstance(filters, cls):
+            return filters
+        return cls(columns=filters)
+
+    def with_period(self, period_from=None, period_to=None):
+        """Copy with the given YYYY-MM bounds replacing the current ones"""
+        result = LedgerFilter(columns=self.columns)
+        result.period_from = _parse_period(period_from) if period_from else self.period_from
+        result.period_to = _parse_period(period_to) if period_to else self.period_to
+        return result
+
+    def __bool__(self):
+        return bool(self.columns) or self.period_from is not None or self.period_to is not None
+
+    @property
+    def has_period(self):
+        return self.period_from is not None or self.period_to is not None
+
+    def conditions(self, table):
+        """SQLAlchemy conditions over the finance_expense table"""
+        conditions = [table.c[column].in_(values) for column, values in self.columns.items()]
+        if self.has_period:
+            period_key = tuple_(table.c.general_ledger_fiscal_year, table.c.posting_period)
+            # Rows without a usable fiscal period have no month and never match a range
+            conditions += [table.c.general_ledger_fiscal_year != "", table.c.posting_period != literal(0, Integer)]
+            if self.period_from is not None:
+                year, period = self.period_from
+                conditions.append(period_key >= tuple_(literal(year, String), literal(period, Integer)))
+            if self.period_to is not None:
+                year, period = self.period_to
+                conditions.append(period_key <= tuple_(literal(year, String), literal(period, Integer)))
+        return conditions
+
+    def where_sql(self, prefix="filter_"):
+        """(SQL boolean expression, bind parameters) for hand-written queries over finance_expense"""
+        clauses, params = [], {}
+        for column, values in self.columns.items():
+            clauses.append(f'"{column}" = ANY(:{prefix}{column})')
+            params[f"{prefix}{column}"] = [str(v) for v in values]
+        if self.has_period:
+            clauses.append("general_ledger_fiscal_year <> '' AND posting_period <> 0")
+            for bound, operator, name in ((self.period_from, ">=", "from"), (self.period_to, "<=", "to")):
+                if bound is not None:
+                    clauses.append(
+                        f"(general_ledger_fiscal_year, posting_period) {operator} "
+                        f"(:{prefix}year_{name}, :{prefix}period_{name})"
+                    )
+                    params[f"{prefix}year_{name}"], params[f"{prefix}period_{name}"] = bound
+        return (" AND ".join(clauses) or "TRUE"), params
+
+    def mask(self, df):
+        """Boolean mask of the rows of df that match; period bounds are checked on month_year"""
+        mask = pd.Series(True, index=df.index)
+        for column, values in self.columns.items():
+            mask &= df[column].isin(values)
+        if self.has_period:
+            month = df["month_year"].astype(object).fillna("")
+            mask &= month != ""
+            if self.period_from is not None:
+                mask &= month >= "%s-%02d" % self.period_from
+            if self.period_to is not None:
+                mask &= month <= "%s-%02d" % self.period_to
+        return mask.fillna(False).astype(bool)
+
+    def to_dict(self):
+        result = {column: list(values) for column, values in self.columns.items()}
+        if self.period_from is not None:
+            result["period_from"] = "%s-%02d" % self.period_from
+        if self.period_to is not None:
+            result["period_to"] = "%s-%02d" % self.period_to
+        return result
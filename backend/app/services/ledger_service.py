@@ -0,0 +1,505 @@
+from app.models.postgres import SessionLocal, FinanceExpense
+from app.services import ledger_store
+from app.services.normalization import month_year_key
+from app.services.ledger_filters import LedgerFilter
+from app.services.dimension_dictionary import (
+    get_dimension_dictionary, reload_dimension_dictionary, encode_dimensions
+)
+from app.config import Config
+from sqlalchemy import select, text
+from pandas.api.types import union_categoricals
+import pandas as pd
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LEDGER_COLUMNS = [column.name for column in FinanceExpense.__table__.columns]
+
+# Free-text columns no analysis reads row by row; kept out of the snapshot and fetched on demand
+WIDE_TEXT_COLUMNS = ["document_header_text", "po_description"]
+SNAPSHOT_COLUMNS = [c for c in LEDGER_COLUMNS if c not in WIDE_TEXT_COLUMNS] + ["month_year"]
+
+
+def _build_frame(df):
+    """Apply the snapshot column types to the finance_expense columns present in df"""
+    if 'company_code_currency_value' in df.columns:
+        df['company_code_currency_value'] = pd.to_numeric(
+            df['company_code_currency_value'], errors='coerce'
+        ).astype('float64')
+    if 'posting_period' in df.columns:
+        df['posting_period'] = pd.to_numeric(df['posting_period'], errors='coerce').astype('Int64')
+    if 'general_ledger_fiscal_year' in df.columns and 'posting_period' in df.columns:
+        df['month_year'] = month_year_key(df['general_ledger_fiscal_year'], df['posting_period'])
+    encode_dimensions(df, get_dimension_dictionary())
+    return df
+
+
+def _projection_statement(columns, filters=None, id_range=None):
+    """Core SELECT for the given columns (month_year derived) and filters, plus the selected column names"""
+    table = FinanceExpense.__table__
+    filters = LedgerFilter.coerce(filters)
+    unknown = [c for c in list(columns) + list(filters.columns) if c not in LEDGER_COLUMNS and c != 'month_year']
+    if unknown:
+        raise ValueError(f"Unknown ledger columns: {', '.join(unknown)}")
+
+    selected = [c for c in columns if c != 'month_year']
+    if 'month_year' in columns:
+        selected += [c for c in ('general_ledger_fiscal_year', 'posting_period') if c not in selected]
+    stmt = select(*[table.c[c] for c in selected]).order_by(table.c.id)
+    if id_range is not None:
+        after_id, up_to_id = id_range
+        stmt = stmt.where(table.c.id > after_id)
+        if up_to_id is not None:
+            stmt = stmt.where(table.c.id <= up_to_id)
+    conditions = filters.conditions(table)
+    if conditions:
+        stmt = stmt.where(*conditions)
+    return stmt, selected
+
+
+def load_ledger_columns(columns, filters=None, session=None, id_range=None):
+    """Narrow Core SELECT of the given finance_expense columns, returned as a typed frame.
+
+    `month_year` may be requested like a column; it is derived from fiscal year and
+    posting period. `filters` is a LedgerFilter (or a dict mapping column names to a value
+    or a list of accepted values) applied in the WHERE clause, and `id_range` =
+    (after_id, up_to_id) restricts the load to that id interval (open-ended when up_to_id
+    is None). Rows are not hydrated into ORM entities, so no identity map is built.
+    """
+    columns = list(columns)
+    stmt, _ = _projection_statement(columns, filters, id_range)
+
+    owns_session = session is None
+    session = session or SessionLocal()
+    try:
+        df = pd.read_sql(stmt, session.connection())
+    finally:
+        if owns_session:
+            session.close()
+    return _build_frame(df)[columns]
+
+
+def iter_ledger_chunks(columns, chunk_size=None, filters=None, session=None):
+    """Stream finance_expense through a server-side cursor as typed frames of at most chunk_size rows.
+
+    Peak memory is bounded by the chunk size rather than the table size.
+    """
+    columns = list(columns)
+    chunk_size = chunk_size or Config.LEDGER_CHUNK_SIZE
+    stmt, selected = _projection_statement(columns, filters)
+
+    owns_session = session is None
+    session = session or SessionLocal()
+    try:
+        result = session.connection().execute(
+            stmt, execution_options={"stream_results": True, "yield_per": chunk_size}
+        )
+        for rows in result.partitions():
+            yield _build_frame(pd.DataFrame(rows, columns=selected))[columns]
+    finally:
+        if owns_session:
+            session.close()
+
+
+# Single row the finance_expense statement triggers keep current (see install_version_tracking)
+VERSION_TABLE = "finance_expense_version"
+
+VERSION_TRACKING_SQL = [
+    f"""
+    CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        change_seq BIGINT NOT NULL,
+        max_id BIGINT NOT NULL,
+        rewrite_seq BIGINT NOT NULL
+    )
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION finance_expense_track_insert() RETURNS trigger AS $$
+    BEGIN
+        UPDATE {VERSION_TABLE} v
+        SET change_seq = v.change_seq + 1,
+            rewrite_seq = v.rewrite_seq + CASE WHEN inserted.min_id <= v.max_id THEN 1 ELSE 0 END,
+            max_id = GREATEST(v.max_id, inserted.max_id)
+        FROM (SELECT MIN(id) AS min_id, MAX(id) AS max_id FROM inserted_rows) inserted
+        WHERE v.id = 1 AND inserted.min_id IS NOT NULL;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    f"""
+    CREATE OR REPLACE FUNCTION finance_expense_track_rewrite() RETURNS trigger AS $$
+    BEGIN
+        UPDATE {VERSION_TABLE} SET change_seq = change_seq + 1, rewrite_seq = rewrite_seq + 1 WHERE id = 1;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    # Created only when missing: CREATE TRIGGER does not wait for readers of finance_expense, DROP TRIGGER would
+    """
+    DO $$
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgrelid = 'finance_expense'::regclass AND tgname = 'finance_expense_version_insert'
+        ) THEN
+            CREATE TRIGGER finance_expense_version_insert AFTER INSERT ON finance_expense
+            REFERENCING NEW TABLE AS inserted_rows
+            FOR EACH STATEMENT EXECUTE PROCEDURE finance_expense_track_insert();
+        END IF;
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgrelid = 'finance_expense'::regclass AND tgname = 'finance_expense_version_rewrite'
+        ) THEN
+            CREATE TRIGGER finance_expense_version_rewrite AFTER UPDATE OR DELETE OR TRUNCATE ON finance_expense
+            FOR EACH STATEMENT EXECUTE PROCEDURE finance_expense_track_rewrite();
+        END IF;
+    END
+    $$
+    """,
+    # Seeded after the triggers exist, as CREATE TRIGGER holds off writers until this commits.
+    # A reinstall bumps both counters: writes made while the triggers were missing went uncounted
+    f"""
+    INSERT INTO {VERSION_TABLE} (id, change_seq, max_id, rewrite_seq)
+    SELECT 1, 1, COALESCE(MAX(id), 0), 1 FROM finance_expense
+    ON CONFLICT (id) DO UPDATE SET
+        change_seq = {VERSION_TABLE}.change_seq + 1,
+        max_id = EXCLUDED.max_id,
+        rewrite_seq = {VERSION_TABLE}.rewrite_seq + 1
+    """,
+]
+
+
+def install_version_tracking(connection):
+    """Create the data version row of finance_expense and the statement triggers that maintain it.
+
+    Every writing statement bumps change_seq and inserts raise max_id. Updates, deletes,
+    truncates and inserts at or below the recorded max_id (a transaction that took its ids
+    before another one committed) also bump rewrite_seq. The triggers all update the one
+    row, so concurrent writers are ordered by its lock and neither counter goes back.
+    """
+    connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": VERSION_TABLE})
+    for statement in VERSION_TRACKING_SQL:
+        connection.execute(text(statement))
+
+
+_tracking_installed = False
+
+
+def _ensure_version_tracking(session):
+    """Install the version triggers on first use when the migration has not run yet"""
+    global _tracking_installed
+    if _tracking_installed:
+        return
+    installed = session.execute(text("""
+        SELECT to_regclass(:table) IS NOT NULL AND EXISTS (
+            SELECT 1 FROM pg_trigger
+            WHERE tgrelid = 'finance_expense'::regclass AND tgname = 'finance_expense_version_insert'
+        )
+    """), {"table": VERSION_TABLE}).scalar()
+    if not installed:
+        bind = session.get_bind() if hasattr(session, "get_bind") else session.engine
+        with bind.begin() as connection:
+            install_version_tracking(connection)
+        logger.info("Installed finance_expense data version tracking.")
+    _tracking_installed = True
+
+
+def get_data_version(session):
+    """Stamp identifying the current contents of finance_expense: "change_seq:max_id:rewrite_seq".
+
+    A single-row read of the counters the finance_expense triggers maintain, so it never
+    scans the table and catches every committed insert, update and delete.
+    """
+    _ensure_version_tracking(session)
+    change_seq, max_id, rewrite_seq = session.execute(text(
+        f"SELECT change_seq, max_id, rewrite_seq FROM {VERSION_TABLE} WHERE id = 1"
+    )).one()
+    return f"{change_seq}:{max_id}:{rewrite_seq}"
+
+
+def version_watermark(version):
+    """Highest id covered by a data version stamp"""
+    return int(version.split(":")[1])
+
+
+def version_rewrites(version):
+    """Rewrite counter of a data version stamp; equal counters mean no row up to the older watermark changed"""
+    return version.split(":")[2]
+
+
+def _range_checksum(session, after_id, up_to_id):
+    """(row count, sum of row hashes) for ids in (after_id, up_to_id].
+
+    The pair is additive over id ranges, so a snapshot can extend its checksum with
+    just the appended rows. It is the safety net behind the rewrite counter: any update
+    or delete below the watermark changes it.
+    """
+    row_count, hash_sum = session.execute(text("""
+        SELECT COUNT(*), COALESCE(SUM(hashtext(f::text)::bigint), 0)
+        FROM finance_expense f
+        WHERE f.id > :after_id AND f.id <= :up_to_id
+    """), {"after_id": int(after_id), "up_to_id": int(up_to_id)}).one()
+    return f"{row_count}:{hash_sum}"
+
+
+def _add_checksums(first, second):
+    (count_a, sum_a), (count_b, sum_b) = (map(int, c.split(":")) for c in (first, second))
+    return f"{count_a + count_b}:{sum_a + sum_b}"
+
+
+def _concat_frames(base, tail):
+    """Append tail to base, keeping dictionary-coded columns categorical"""
+    columns = {}
+    for column in base.columns:
+        if isinstance(base[column].dtype, pd.CategoricalDtype):
+            columns[column] = union_categoricals([base[column].values, tail[column].values])
+        else:
+            columns[column] = pd.concat([base[column], tail[column]], ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+# Period columns leading every rollup key; month_year is derived from the other two
+ROLLUP_PERIOD_KEYS = ["general_ledger_fiscal_year", "posting_period", "month_year"]
+ROLLUP_MEASURES = ["value_sum", "abs_sum", "row_count"]
+
+
+def build_rollup(df, dimensions):
+    """Fiscal period x dimensions x debit/credit totals of the raw currency value.
+
+    Keeping the indicator in the key lets every caller derive signed amounts with its
+    own debit/credit convention from value_sum and abs_sum.
+    """
+    keys = [*ROLLUP_PERIOD_KEYS, *dimensions, "debit_credit_ind"]
+    value = df["company_code_currency_value"].fillna(0)
+    parts = pd.DataFrame({
+        **{key: df[key].astype(object) for key in keys},
+        "value_sum": value,
+        "abs_sum": value.abs(),
+        "row_count": 1,
+    })
+    return parts.groupby(keys, dropna=False, sort=False).sum()
+
+
+class LedgerSnapshot:
+    """Columnar copy of finance_expense stamped with the data version it was loaded at.
+
+    `watermark` is the highest id the version covers, so a refresh can append newer rows
+    instead of reloading the table. `checksum` covers every row up to it and was last
+    compared with the table at `verified_at`. Month x dimension rollups requested from a
+    snapshot are carried forward and updated with appended rows.
+    """
+
+    def __init__(self, frame, version, checksum=None, base_version=None, verified_at=None):
+        self.frame = frame
+        self.version = version
+        self.checksum = checksum
+        self.base_version = base_version
+        self.watermark = version_watermark(version)
+        self.loaded_at = time.time()
+        self.verified_at = verified_at if verified_at is not None else self.loaded_at
+        self._rollups = {}
+        self._rollup_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.frame)
+
+    def covers(self, columns):
+        return all(c in self.frame.columns for c in columns)
+
+    def project(self, columns=None):
+        """Return a private copy of the requested columns, safe for callers to mutate"""
+        if columns is None:
+            return self.frame.copy()
+        return self.frame[list(columns)].copy()
+
+    def rollup(self, dimensions=()):
+        """Fiscal period x dimensions x debit_credit_ind totals (see ROLLUP_MEASURES) as a flat frame"""
+        key = tuple(dimensions)
+        with self._rollup_lock:
+            if key not in self._rollups:
+                self._rollups[key] = build_rollup(self.frame, key)
+            return self._rollups[key].reset_index()
+
+    def extended(self, tail, version, checksum, verified_at):
+        """New snapshot with tail appended; cached rollups are updated with the tail only"""
+        frame = _concat_frames(self.frame, tail) if len(tail) else self.frame
+        snapshot = LedgerSnapshot(frame, version, checksum, base_version=self.version, verified_at=verified_at)
+        snapshot.inherit_rollups(self, tail)
+        logger.info(f"Ledger snapshot extended by {len(tail)} rows to version {version}.")
+        return snapshot
+
+    def inherit_rollups(self, previous, tail=None):
+        """Carry previous's rollups forward when this snapshot is previous plus appended rows"""
+        if previous is None or self.base_version != previous.version:
+            return
+        if tail is None:
+            tail = self.frame[self.frame['id'] > previous.watermark]
+        with previous._rollup_lock:
+            rollups = dict(previous._rollups)
+        for key, totals in rollups.items():
+            self._rollups[key] = totals.add(build_rollup(tail, key), fill_value=0) if len(tail) else totals
+
+    @classmethod
+    def load(cls, session, version):
+        """Load every row up to the watermark of version, a stamp probed before the load.
+
+        The checksum is taken before the rows are read, so a concurrent write can only
+        make the next refresh more conservative, never leave stale rows in place.
+        """
+        watermark = version_watermark(version)
+        checksum = _range_checksum(session, 0, watermark)
+        df = load_ledger_columns(SNAPSHOT_COLUMNS, session=session, id_range=(0, watermark))
+        logger.info(f"Ledger snapshot loaded {len(df)} rows at version {version}.")
+        return cls(df, version, checksum)
+
+
+_snapshot = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _refresh(session, base, version):
+    """Bring base to version by appending rows past its watermark, or reload it.
+
+    Appending is only valid while the rows base already holds are unchanged, which an
+    unchanged rewrite counter guarantees; updates, deletes and late low-id inserts force a
+    full reload. Every LEDGER_CHECKSUM_INTERVAL seconds the held rows are also checksummed
+    against the table before appending.
+    """
+    watermark = version_watermark(version)
+    if (base is not None and base.checksum is not None and watermark >= base.watermark
+            and version_rewrites(version) == version_rewrites(base.version)):
+        verified_at = base.verified_at
+        if time.time() - verified_at >= Config.LEDGER_CHECKSUM_INTERVAL:
+            if _range_checksum(session, 0, base.watermark) != base.checksum:
+                logger.warning("Ledger rows at or below the watermark changed without a rewrite; reloading the snapshot.")
+                return LedgerSnapshot.load(session, version)
+            verified_at = time.time()
+        id_range = (base.watermark, watermark)
+        checksum = _add_checksums(base.checksum, _range_checksum(session, *id_range))
+        tail = load_ledger_columns(SNAPSHOT_COLUMNS, session=session, id_range=id_range)
+        return base.extended(tail, version, checksum, verified_at)
+    return LedgerSnapshot.load(session, version)
+
+
+def _load_snapshot(session, version, current):
+    """Bring the snapshot to version, going through the shared ledger file when it is enabled"""
+    if not Config.LEDGER_SNAPSHOT_DIR:
+        return _refresh(session, current, version)
+
+    if ledger_store.read_file_version() != version:
+        with ledger_store.export_lock():
+            # Another worker may have exported while this one waited for the lock
+            if ledger_store.read_file_version() != version:
+                dictionary = reload_dimension_dictionary()
+                base = _read_shared_snapshot() if ledger_store.read_file_version() else None
+                snapshot = _refresh(session, base, version)
+                dictionary.save()
+                ledger_store.write_ledger_file(snapshot.frame, snapshot.version, {
+                    "checksum": snapshot.checksum,
+                    "base_version": snapshot.base_version,
+                    "verified_at": snapshot.verified_at,
+                })
+    return _read_shared_snapshot(current)
+
+
+def _read_shared_snapshot(previous=None):
+    # The exporting worker may have assigned new dimension codes; pick them up with the file
+    reload_dimension_dictionary()
+    frame, version, metadata = ledger_store.read_ledger_file()
+    verified_at = float(metadata["verified_at"]) if metadata.get("verified_at") else None
+    snapshot = LedgerSnapshot(frame, version, metadata.get("checksum"), metadata.get("base_version"), verified_at)
+    snapshot.inherit_rollups(previous)
+    return snapshot
+
+
+def get_ledger_snapshot(session=None):
+    """Return the shared snapshot, refreshing it only when the data version has changed.
+
+    The version probe is skipped while the snapshot is younger than
+    Config.LEDGER_VERSION_TTL seconds so hot paths do not hit the database at all.
+    A cold worker adopts a recently written shared ledger file without a database round trip.
+    New postings are appended past the id watermark; a full reload only happens when
+    rows already held were rewritten.
+    """
+    global _snapshot, _checked_at
+
+    if _snapshot is not None and time.time() - _checked_at < Config.LEDGER_VERSION_TTL:
+        return _snapshot
+
+    with _lock:
+        if _snapshot is not None and time.time() - _checked_at < Config.LEDGER_VERSION_TTL:
+            return _snapshot
+
+        if _snapshot is None and Config.LEDGER_SNAPSHOT_DIR:
+            age = ledger_store.file_age()
+            if age is not None and age < Config.LEDGER_VERSION_TTL:
+                _snapshot = _read_shared_snapshot()
+                _checked_at = time.time() - age
+                return _snapshot
+
+        owns_session = session is None
+        session = session or SessionLocal()
+        try:
+            version = get_data_version(session)
+            if _snapshot is None or _snapshot.version != version:
+                _snapshot = _load_snapshot(session, version, _snapshot)
+            _checked_at = time.time()
+            return _snapshot
+        finally:
+            if owns_session:
+                session.close()
+
+
+def get_ledger_frame(columns=None, session=None, filters=None):
+    """Projection of the shared ledger snapshot.
+
+    Columns the snapshot does not hold (the wide free-text fields) are served by a
+    narrow query through load_ledger_columns instead. With a non-empty LedgerFilter
+    only matching rows are returned: masked out of the snapshot while it is warm, and
+    otherwise loaded with the filter pushed into the SQL WHERE clause, so a slice never
+    pulls the whole table.
+    """
+    filters = LedgerFilter.coerce(filters)
+    if filters:
+        wanted = list(columns) if columns is not None else SNAPSHOT_COLUMNS
+        snapshot = get_cached_ledger_snapshot()
+        if snapshot is not None and snapshot.covers(wanted + list(filters.columns) + ["month_year"]):
+            return snapshot.frame.loc[filters.mask(snapshot.frame).to_numpy(), wanted].reset_index(drop=True)
+        return load_ledger_columns(wanted, filters=filters, session=session)
+
+    snapshot = get_ledger_snapshot(session)
+    if columns is not None and not snapshot.covers(columns):
+        return load_ledger_columns(columns, session=session)
+    return snapshot.project(columns)
+
+
+def get_cached_ledger_snapshot():
+    """The in-process snapshot while it is within its version TTL, else None; never queries the database"""
+    snapshot = _snapshot
+    if snapshot is not None and time.time() - _checked_at < Config.LEDGER_VERSION_TTL:
+        return snapshot
+    return None
+
+
+def current_data_version(session=None):
+    """Version of the warm snapshot, or probed from the database when there is none"""
+    snapshot = get_cached_ledger_snapshot()
+    if snapshot is not None:
+        return snapshot.version
+    owns_session = session is None
+    session = session or SessionLocal()
+    try:
+        return get_data_version(session)
+    finally:
+        if owns_session:
+            session.close()
+
+
+def get_ledger_rollup(dimensions=(), session=None):
+    """Month x dimension totals of the shared snapshot, kept warm across incremental refreshes"""
+    return get_ledger_snapshot(session).rollup(dimensions)
+
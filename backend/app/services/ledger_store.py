@@ -0,0 +1,103 @@
+from app.config import Config
+from contextlib import contextmanager
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import os
+import time
+import logging
+
+try:
+    import fcntl
+except ImportError:  # Windows development machines run a single worker
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LEDGER_FILE = "finance_expense.arrow"
+VERSION_KEY = b"data_version"
+METADATA_PREFIX = "ledger."
+
+
+def ledger_file_path():
+    return os.path.join(Config.LEDGER_SNAPSHOT_DIR, LEDGER_FILE)
+
+
+def read_file_version(path=None):
+    """Data version stamped in the shared ledger file, or None if there is no usable file"""
+    path = path or ledger_file_path()
+    try:
+        with pa.memory_map(path, "r") as source:
+            metadata = ipc.open_file(source).schema.metadata or {}
+        version = metadata.get(VERSION_KEY)
+        return version.decode() if version else None
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+
+
+def file_age(path=None):
+    """Seconds since the shared ledger file was last written, or None if it does not exist"""
+    try:
+        return time.time() - os.path.getmtime(path or ledger_file_path())
+    except OSError:
+        return None
+
+
+def write_ledger_file(frame, version, metadata=None, path=None):
+    """Atomically replace the shared ledger file with an uncompressed Arrow IPC copy of frame.
+
+    Uncompressed IPC is what lets readers memory-map the buffers instead of decoding them.
+    `metadata` holds extra string values (e.g. the snapshot checksum) stored with the version.
+    """
+    path = path or ledger_file_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    extra = {f"{METADATA_PREFIX}{k}".encode(): str(v).encode() for k, v in (metadata or {}).items() if v is not None}
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}), **extra, VERSION_KEY: version.encode()
+    })
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote shared ledger file {path} ({len(frame)} rows, version {version}).")
+
+
+def read_ledger_file(path=None):
+    """Memory-map the shared ledger file and return (frame, version, metadata).
+
+    Numeric columns without nulls stay backed by the mapped pages, so every worker
+    reading the same file shares a single page-cache copy of them.
+    """
+    path = path or ledger_file_path()
+    source = pa.memory_map(path, "r")
+    reader = ipc.open_file(source)
+    table = reader.read_all()
+    schema_metadata = table.schema.metadata or {}
+    version = schema_metadata.get(VERSION_KEY, b"").decode() or None
+    metadata = {
+        k.decode()[len(METADATA_PREFIX):]: v.decode()
+        for k, v in schema_metadata.items() if k.decode().startswith(METADATA_PREFIX)
+    }
+    frame = table.to_pandas(split_blocks=True, self_destruct=True)
+    logger.info(f"Memory-mapped shared ledger file {path} ({len(frame)} rows, version {version}).")
+    return frame, version, metadata
+
+
+@contextmanager
+def export_lock(path=None):
+    """Serialize exports of path (the shared ledger file by default) across gunicorn workers
+    so only one of them does the work"""
+    if fcntl is None:
+        yield
+        return
+    path = path or ledger_file_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
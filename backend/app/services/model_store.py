@@ -0,0 +1,151 @@
+from app.config import Config
+from app.services.ledger_store import export_lock
+from contextlib import contextmanager
+import joblib
+import glob
+import os
+import shutil
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODEL_SUFFIX = ".joblib"
+
+
+def _model_path(name, version):
+    return os.path.join(Config.MODEL_STORE_DIR, f"{name}@{version.replace(':', '_')}{MODEL_SUFFIX}")
+
+
+def _stored_paths(name):
+    """Stored files of a model, newest first"""
+    paths = glob.glob(os.path.join(Config.MODEL_STORE_DIR, f"{glob.escape(name)}@*{MODEL_SUFFIX}"))
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def _read(path):
+    """(model, version) from a stored file, or None if it is missing or unreadable.
+
+    Uncompressed joblib files are memory-mapped, so the fitted arrays are shared through
+    the page cache by every worker that loads the same model.
+    """
+    try:
+        payload = joblib.load(path, mmap_mode="r")
+    except (FileNotFoundError, EOFError, ValueError) as e:
+        logger.warning(f"Could not read stored model {path}: {e}")
+        return None
+    return payload["model"], payload["version"]
+
+
+def _write(name, model, versions):
+    """Store model under the first of `versions`, with the others as links to the same file"""
+    paths = [_model_path(name, version) for version in versions]
+    os.makedirs(Config.MODEL_STORE_DIR, exist_ok=True)
+    tmp_path = f"{paths[0]}.{os.getpid()}.tmp"
+    joblib.dump({"model": model, "version": versions[0]}, tmp_path)
+    for alias in paths[1:]:
+        alias_tmp = f"{alias}.{os.getpid()}.tmp"
+        try:
+            os.link(tmp_path, alias_tmp)
+        except OSError:
+            shutil.copyfile(tmp_path, alias_tmp)
+        os.replace(alias_tmp, alias)
+    os.replace(tmp_path, paths[0])
+    # Only the newest version is ever asked for again
+    for stale in _stored_paths(name):
+        if stale not in paths:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    logger.info(f"Stored model {name} for data version {versions[0]}.")
+
+
+# name -> (model, version it was fitted at, data versions it is stored under)
+_models = {}
+_lock = threading.Lock()
+
+
+def load_model(name, version):
+    """(model, version) of `name` stored for exactly `version`, from process memory or disk, or None"""
+    with _lock:
+        cached = _models.get(name)
+    if cached is not None and version in cached[2]:
+        return cached[:2]
+    if not Config.MODEL_STORE_DIR:
+        return None
+    path = _model_path(name, version)
+    stored = _read(path) if os.path.exists(path) else None
+    if stored is not None:
+        with _lock:
+            _models[name] = (*stored, {stored[1], version})
+    return stored
+
+
+def save_model(name, model, version, aliases=()):
+    """Keep `model` as the current model of `name`, persisting it unless MODEL_STORE_DIR is empty.
+
+    Lookups of any of the `aliases` data versions find it as well.
+    """
+    versions = [version] + [alias for alias in aliases if alias != version]
+    if Config.MODEL_STORE_DIR:
+        _write(name, model, versions)
+    with _lock:
+        _models[name] = (model, version, set(versions))
+    return model, version
+
+
+_training_locks = {}
+
+
+@contextmanager
+def training_lock(name):
+    """Serialize training of `name` across threads and, with MODEL_STORE_DIR, across workers.
+
+    Each name has its own lock, so fitting one model never waits for another.
+    """
+    with _lock:
+        lock = _training_locks.setdefault(name, threading.Lock())
+    with lock:
+        if not Config.MODEL_STORE_DIR:
+            yield
+            return
+        with export_lock(os.path.join(Config.MODEL_STORE_DIR, name)):
+            yield
+
+
+def get_model(name, version, train):
+    """Model `name` fitted at data version `version`, training it at most once per version.
+
+    `train()` returns (model, version the training data was read at); that version is the
+    one the model reports, and it is stored under both, so asking for `version` again finds
+    it. Models are kept in process and, unless MODEL_STORE_DIR is empty, persisted with
+    joblib so other workers and restarts load instead of refitting.
+    """
+    stored = load_model(name, version)
+    if stored is not None:
+        return stored
+    with training_lock(name):
+        # Another worker may have trained it while this one waited for the lock
+        stored = load_model(name, version)
+        if stored is None:
+            model, trained_version = train()
+            stored = save_model(name, model, trained_version, aliases=[version])
+    return stored
+
+
+def get_latest_model(name):
+    """Most recently stored (model, version) of `name` whatever its data version, or None"""
+    with _lock:
+        cached = _models.get(name)
+    if cached is not None:
+        return cached[:2]
+    if Config.MODEL_STORE_DIR:
+        for path in _stored_paths(name):
+            stored = _read(path)
+            if stored is not None:
+                with _lock:
+                    _models.setdefault(name, (*stored, {stored[1]}))
+                return stored
+    return None
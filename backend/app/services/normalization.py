@@ -0,0 +1,61 @@
+import pandas as pd
+import numpy as np
+
+# Debit/credit indicator values: S (Soll) is a debit, H (Haben) a credit
+DEBIT = 'S'
+CREDIT = 'H'
+
+
+def _indicator_masks(debit_credit_ind):
+    """(credit, debit) boolean arrays; missing indicators are neither"""
+    indicator = pd.Series(debit_credit_ind, copy=False)
+    return (indicator == CREDIT).to_numpy(), (indicator == DEBIT).to_numpy()
+
+
+def signed_amounts(values, debit_credit_ind):
+    """Signed amount per posting: credits (H) negative, debits (S) positive.
+
+    The magnitude is taken from the currency value whatever its stored sign, postings with
+    any other indicator keep their value as-is, and missing or non-numeric values count as 0.
+    Operates on whole columns and returns a float64 array.
+    """
+    amount = pd.to_numeric(values, errors='coerce')
+    amount = np.nan_to_num(np.asarray(amount, dtype=float), nan=0.0)
+    credit, debit = _indicator_masks(debit_credit_ind)
+    return np.where(credit, -np.abs(amount), np.where(debit, np.abs(amount), amount))
+
+
+def signed_rollup_amounts(rollup):
+    """signed_amounts summed per rollup group, from its value_sum and abs_sum totals"""
+    credit, debit = _indicator_masks(rollup["debit_credit_ind"])
+    abs_sum = rollup["abs_sum"].to_numpy(dtype=float)
+    return np.where(credit, -abs_sum, np.where(debit, abs_sum, rollup["value_sum"].to_numpy(dtype=float)))
+
+
+def month_year_key(fiscal_year, posting_period):
+    """Vectorized 'YYYY-MM' key; None where fiscal year or period is missing"""
+    period = pd.to_numeric(posting_period, errors='coerce').astype('Int64')
+    year = fiscal_year.astype('string').str.strip()
+    valid = year.notna() & (year != '') & period.notna() & (period != 0)
+    key = year + '-' + period.astype('string').str.zfill(2)
+    return key.where(valid, None).astype(object)
+
+
+def fill_blanks(df, columns):
+    """Replace missing values with "" in the given text/dimension columns that df has, in place"""
+    df.fillna({column: "" for column in columns if column in df.columns}, inplace=True)
+    return df
+
+
+def normalize_ledger_frame(df, blank_columns=(), keep_raw=False):
+    """Shared normalization stage for ledger frames.
+
+    Adds the signed `amount` column from company_code_currency_value and debit_credit_ind
+    (the raw value is dropped, or kept as `raw_amount` with keep_raw) and fills blanks in
+    blank_columns. month_year is already derived by the ledger loaders.
+    """
+    raw = df.pop("company_code_currency_value")
+    if keep_raw:
+        df["raw_amount"] = raw.fillna(0)
+    df["amount"] = signed_amounts(raw, df["debit_credit_ind"])
+    return fill_blanks(df, blank_columns)
@@ -1,110 +1,484 @@
-from app.models.postgres import SessionLocal, FinanceExpense
+from app.models.postgres import SessionLocal
+from app.services.ledger_service import get_ledger_frame, current_data_version
+from app.services.dimension_dictionary import get_dimension_dictionary
+from app.services.rollup_service import get_rollup
+from app.services.cube_service import get_ledger_cube, CUBE_DIMENSIONS
+from app.services.normalization import normalize_ledger_frame, signed_rollup_amounts, fill_blanks
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError
+from app.services import model_store
 import pandas as pd
 import numpy as np
 from sklearn.ensemble import RandomForestRegressor
-from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import mean_absolute_error
+from joblib import Parallel, delayed, effective_n_jobs
+from app.config import Config
+from collections import OrderedDict
+import json
+import threading
 import warnings
 warnings.filterwarnings('ignore')
 
-def _normalize_amount(value, debit_credit_ind):
-    try:
-        amount = float(value or 0)
-        if debit_credit_ind == 'H':  # Kredit
-            return -abs(amount)
-        elif debit_credit_ind == 'S':  # Debit
-            return abs(amount)
-        return 0
-    except Exception:
-        return 0
+# Dimensions the RCA forest explains monthly amounts by
+RCA_FEATURES = [
+    'cost_center_id', 'functional_area', 'directorate',
+    'general_ledger_account', 'profit_center_id',
+    'level_1', 'level_7', 'account_type', 'supplier'
+]
+RCA_ENCODED_FEATURES = [f + '_encoded' for f in RCA_FEATURES]
+# Largest residuals reported per month pair
+RCA_TOP_RESIDUALS = 5
+
+# Dimensions contribution analysis decomposes a month-over-month change by, and the members
+# reported per dimension (largest absolute change first)
+CONTRIBUTION_DIMENSIONS = [
+    'directorate', 'cost_center_id', 'functional_area_name', 'general_ledger_account', 'supplier'
+]
+CONTRIBUTION_TOP_MEMBERS = 10
+
+# Ledger hierarchy the drill-down search descends, and the share of a node's change its
+# significant children must explain for them to replace it in the explanation set
+DRILL_DOWN_HIERARCHY = ['directorate', 'cost_center_id', 'general_ledger_account', 'supplier']
+DRILL_DOWN_CONCENTRATION = 0.8
+
+
+# model_store name of the forest fitted on the whole ledger, the only one persisted
+RCA_MODEL_NAME = "rca_forest"
+
+# Forests of filtered requests, kept in this process only:
+# {filter spec: (data version, forest)}, least recently used first
+_filtered_models = OrderedDict()
+_filtered_lock = threading.Lock()
+# filter spec -> lock held while that forest is being fitted
+_filtered_training = {}
+
+
+def _filter_spec(filters):
+    # One fit per filter set, whatever order its values came in
+    spec = {key: sorted(value) if isinstance(value, list) else value for key, value in filters.to_dict().items()}
+    return json.dumps(spec, sort_keys=True)
+
+
+def _cached_filtered_model(spec, version):
+    with _filtered_lock:
+        cached = _filtered_models.get(spec)
+        if cached is not None and cached[0] == version:
+            _filtered_models.move_to_end(spec)
+            return cached
+    return None
+
+
+def _filtered_model(spec, version, train):
+    """Forest for a filter set at `version`, fitted at most once per process and version and
+    kept among the RCA_FILTERED_MODELS most recently used ones"""
+    cached = _cached_filtered_model(spec, version)
+    if cached is not None:
+        return cached[1]
+    with _filtered_lock:
+        training = _filtered_training.setdefault(spec, threading.Lock())
+    with training:
+        cached = _cached_filtered_model(spec, version)
+        if cached is not None:
+            return cached[1]
+        try:
+            model = train()
+        finally:
+            with _filtered_lock:
+                _filtered_training.pop(spec, None)
+        with _filtered_lock:
+            _filtered_models[spec] = (version, model)
+            _filtered_models.move_to_end(spec)
+            while len(_filtered_models) > max(Config.RCA_FILTERED_MODELS, 0):
+                _filtered_models.popitem(last=False)
+    return model
+
+
+def _predict_in_order(model, X, n_jobs=None):
+    """model.predict(X), with the trees evaluated in parallel threads but summed in estimator
+    order, so the result is bit-identical to a serial predict whatever n_jobs is.
+
+    Trees run in groups of one per thread and each group is summed before the next starts,
+    so at most that many per-tree prediction arrays are alive at once.
+    """
+    X = np.asarray(X, dtype=np.float32)
+    trees = model.estimators_
+    group = max(effective_n_jobs(n_jobs), 1)
+    predicted = np.zeros(len(X), dtype=np.float64)
+    with Parallel(n_jobs=n_jobs, prefer="threads") as parallel:
+        for start in range(0, len(trees), group):
+            for prediction in parallel(
+                delayed(tree.predict)(X, check_input=False) for tree in trees[start:start + group]
+            ):
+                predicted += prediction
+    return predicted / len(trees)
+
+
+def _pair_rows(fitted, from_month, to_month):
+    """Aggregate rows of two months in aggregate order, the same rows a month_year mask selects.
+
+    Row positions per month are indexed once per fit, so a pair costs its own rows only.
+    """
+    agg_df = fitted["aggregate"]
+    month_rows = fitted.get("month_rows")
+    if month_rows is None:
+        return agg_df[agg_df['month_year'].isin([from_month, to_month])]
+    empty = np.empty(0, dtype=np.intp)
+    positions = [month_rows.get(month, empty) for month in dict.fromkeys([from_month, to_month])]
+    return agg_df.take(np.sort(np.concatenate(positions)))
+
+
+def _member_changes(rollup, dimensions, from_month, to_month):
+    """Each (dimension, member)'s amounts, posting counts and change effects between two months.
+
+    Every dimension is stacked into one long frame and totalled by a single groupby. A
+    member's amount is postings x average posting, so with N total postings, s the member's
+    share of them and p its average, the change splits exactly into
+      volume = (N_to - N_from) * s_from * p_from   (more or fewer postings overall)
+      mix    = N_to * (s_to - s_from) * p_from     (the member's share of postings moving)
+      rate   = n_to * (p_to - p_from)              (its average posting amount moving)
+    A member absent in one month takes the other month's average, so its change is all
+    volume and mix.
+    """
+    rollup = rollup[rollup['month_year'].isin([from_month, to_month])]
+    size = len(rollup)
+    long = pd.DataFrame({
+        'dimension': np.repeat(dimensions, size),
+        'member': np.concatenate([rollup[d].astype(object).to_numpy() for d in dimensions]),
+        'to': np.tile((rollup['month_year'] == to_month).to_numpy(), len(dimensions)),
+        'amount': np.tile(rollup['amount'].to_numpy(dtype=float), len(dimensions)),
+        'count': np.tile(rollup['row_count'].to_numpy(dtype=float), len(dimensions)),
+    })
+    totals = long.groupby(['dimension', 'member', 'to'], sort=False)[['amount', 'count']].sum()
+    totals = totals.unstack('to', fill_value=0).reindex(
+        columns=pd.MultiIndex.from_product([['amount', 'count'], [False, True]]), fill_value=0
+    )
+
+    amount_from, amount_to = totals[('amount', False)].to_numpy(), totals[('amount', True)].to_numpy()
+    count_from, count_to = totals[('count', False)].to_numpy(), totals[('count', True)].to_numpy()
+    postings_from = rollup.loc[rollup['month_year'] != to_month, 'row_count'].sum()
+    postings_to = rollup.loc[rollup['month_year'] == to_month, 'row_count'].sum()
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        average_from = np.where(count_from > 0, amount_from / count_from, amount_to / count_to)
+        average_to = np.where(count_to > 0, amount_to / count_to, average_from)
+        share_from = count_from / postings_from if postings_from else np.zeros(len(totals))
+        share_to = count_to / postings_to if postings_to else np.zeros(len(totals))
+
+    changes = pd.DataFrame({
+        'dimension': totals.index.get_level_values('dimension'),
+        'member': totals.index.get_level_values('member'),
+        'from_amount': amount_from,
+        'to_amount': amount_to,
+        'change': amount_to - amount_from,
+        'from_count': count_from.astype(int),
+        'to_count': count_to.astype(int),
+        'volume_effect': (postings_to - postings_from) * share_from * average_from,
+        'mix_effect': postings_to * (share_to - share_from) * average_from,
+        'rate_effect': count_to * (average_to - average_from),
+    })
+    # Largest absolute change first, ties by member, so the ranking is reproducible
+    changes['magnitude'] = changes['change'].abs()
+    changes = changes.sort_values(
+        ['dimension', 'magnitude', 'member'], ascending=[True, False, True], kind='mergesort'
+    ).drop(columns='magnitude')
+    return changes.reset_index(drop=True)
+
+
+def _change_records(changes, total_change):
+    """{dimension: [member records]} with amounts rounded to cents and each change's share of the total"""
+    records = changes.round({
+        'from_amount': 2, 'to_amount': 2, 'change': 2, 'volume_effect': 2, 'mix_effect': 2, 'rate_effect': 2
+    })
+    records['share_of_change'] = (changes['change'] / total_change).round(4) if total_change else None
+    grouped = {}
+    for record in records.to_dict('records'):
+        grouped.setdefault(record.pop('dimension'), []).append(record)
+    return grouped
+
+
+def _drill_down(cells, hierarchy, minimum, max_depth):
+    """Significant nodes of each hierarchy level, descending only below nodes that were kept.
+
+    cells holds from_amount/to_amount per leaf of the hierarchy. Each level is one groupby
+    over the cells still under a kept node, and a node is kept when its absolute change is at
+    least `minimum`; the cells under a pruned node are never grouped again.
+    """
+    levels, evaluated = [], 0
+    for depth in range(1, max_depth + 1):
+        grouped = cells.groupby(hierarchy[:depth], sort=False)
+        level = grouped[['from_amount', 'to_amount']].sum()
+        level['change'] = level['to_amount'] - level['from_amount']
+        significant = (level['change'].abs() >= minimum).to_numpy()
+        evaluated += len(level)
+        kept = level[significant]
+        if kept.empty:
+            break
+        levels.append(kept)
+        cells = cells[significant[grouped.ngroup().to_numpy()]]
+    return levels, evaluated
+
+
+def _explanations(levels, hierarchy, concentration):
+    """Kept nodes whose change their own kept children do not mostly explain.
+
+    A node whose significant children cover at least `concentration` of its change is
+    replaced by them, so each reported node is the most specific one that still explains
+    its part of the delta.
+    """
+    explanations = []
+    for depth, level in enumerate(levels, start=1):
+        level = level.copy()
+        if depth < len(levels):
+            children = levels[depth]['change'].groupby(level=list(range(depth)) if depth > 1 else 0).sum()
+            covered = children.reindex(level.index, fill_value=0.0).to_numpy()
+        else:
+            covered = np.zeros(len(level))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            level['children_explain'] = np.where(level['change'] != 0, covered / level['change'], 0.0)
+        level = level[level['children_explain'] < concentration].reset_index()
+        level['depth'] = depth
+        explanations.append(level)
+    if not explanations:
+        return pd.DataFrame()
+    return pd.concat(explanations, ignore_index=True)
+
 
 class AdvancedRCAService:
-    def __init__(self):
+    def __init__(self, filters=None):
         self.session = SessionLocal()
-        self.label_encoders = {}
+        self.dimensions = get_dimension_dictionary()
+        self.filters = LedgerFilter.coerce(filters)
 
     def get_available_months(self):
-        result = self.session.query(
-            FinanceExpense.general_ledger_fiscal_year,
-            FinanceExpense.posting_period
-        ).distinct().all()
-
-        return sorted(
-            f"{r[0]}-{r[1]:02d}" for r in result if r[0] and r[1]
-        )
+        months = get_ledger_frame(["month_year"], session=self.session, filters=self.filters)["month_year"]
+        return sorted(months.dropna().unique())
 
     def get_historical_data(self):
-        result = self.session.query(FinanceExpense).all()
-        records = []
-        for r in result:
-            month_year = f"{r.general_ledger_fiscal_year}-{r.posting_period:02d}" if r.general_ledger_fiscal_year and r.posting_period else ""
-            amount = _normalize_amount(r.company_code_currency_value, r.debit_credit_ind)
-            records.append({
-                "cost_center_id": r.cost_center_id,
-                "cost_center_name": r.cost_center_name,
-                "functional_area": r.functional_area,
-                "functional_area_name": r.functional_area_name,
-                "amount": amount,
-                "month_year": month_year,
-                "directorate": r.directorate or "",
-                "general_ledger_account": r.general_ledger_account,
-                "profit_center_id": r.profit_center_id,
-                "level_1": r.level_1 or "",
-                "level_7": r.level_7 or "",
-                "account_type": r.account_type or "",
-                "supplier": r.supplier or "",
-                "debit_credit_ind": r.debit_credit_ind,
-                "raw_amount": r.company_code_currency_value,
-            })
-        return pd.DataFrame(records)
-
-    def ml_root_cause_analysis(self, from_month, to_month):
+        df = get_ledger_frame([
+            "cost_center_id", "cost_center_name", "functional_area", "functional_area_name",
+            "company_code_currency_value", "month_year", "directorate", "general_ledger_account",
+            "profit_center_id", "level_1", "level_7", "account_type", "supplier", "debit_credit_ind"
+        ], session=self.session, filters=self.filters)
+        return normalize_ledger_frame(df, keep_raw=True, blank_columns=[
+            "month_year", "directorate", "level_1", "level_7", "account_type", "supplier"
+        ])
+
+    def get_rca_model(self):
+        """Fitted RCA forest for this service's filters, or None when there is too little data.
+
+        The ledger is loaded, encoded, aggregated and fitted once per data version and filter
+        set, and kept together with the aggregate and its in-sample residuals, so every month
+        pair of every request is evaluated against the same fit. The unfiltered forest is
+        persisted by model_store; forests of filtered requests stay in a bounded in-process LRU,
+        so arbitrary filter combinations never accumulate files.
+        """
+        version = current_data_version(self.session)
+        if self.filters:
+            return _filtered_model(_filter_spec(self.filters), version, self._fit_rca_model)
+
+        def train():
+            return self._fit_rca_model(), current_data_version(self.session)
+
+        return model_store.get_model(RCA_MODEL_NAME, version, train)[0]
+
+    def _fit_rca_model(self):
         df = self.get_historical_data()
         df = df[df['month_year'].notna() & (df['month_year'] != '')]
 
         if df.empty or len(df) < 30:
-            return {"error": "Insufficient data for ML analysis"}
-
-        categorical_features = [
-            'cost_center_id', 'functional_area', 'directorate',
-            'general_ledger_account', 'profit_center_id',
-            'level_1', 'level_7', 'account_type', 'supplier'
-        ]
-
-        for feature in categorical_features:
-            df[feature] = df[feature].fillna('Unknown').astype(str)
-            le = LabelEncoder()
-            df[feature + '_encoded'] = le.fit_transform(df[feature])
-            self.label_encoders[feature] = le
+            return None
 
-        encoded_features = [f + '_encoded' for f in categorical_features]
-        group_cols = ['month_year'] + encoded_features
+        # Snapshot dimensions are already dictionary-coded; their stable codes are the ML encoding
+        for feature in RCA_FEATURES:
+            df[feature + '_encoded'] = self.dimensions.codes(feature, df[feature])
 
-        agg_df = df.groupby(group_cols).agg({'amount': 'sum'}).reset_index()
-        X = agg_df[encoded_features]
+        agg_df = df.groupby(['month_year'] + RCA_ENCODED_FEATURES).agg({'amount': 'sum'}).reset_index()
+        X = agg_df[RCA_ENCODED_FEATURES]
         y = agg_df['amount']
 
-        model = RandomForestRegressor(n_estimators=100, random_state=42)
+        # Trees are seeded from random_state, so fitting them in parallel yields the same forest
+        model = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=Config.RCA_N_JOBS)
         model.fit(X, y)
 
         feature_importance = pd.DataFrame({
-            'feature': [f.replace('_encoded', '') for f in encoded_features],
+            'feature': RCA_FEATURES,
             'importance': model.feature_importances_
         }).sort_values('importance', ascending=False)
 
-        comp_data = df[df['month_year'].isin([from_month, to_month])]
-        comp_group = comp_data.groupby(['month_year'] + encoded_features).agg({'amount': 'sum'}).reset_index()
-        comp_group['predicted'] = model.predict(comp_group[encoded_features])
-        comp_group['residual'] = comp_group['amount'] - comp_group['predicted']
+        # Predictions are per row, so the in-sample ones are exactly those of any month pair
+        agg_df['predicted'] = _predict_in_order(model, X, Config.RCA_N_JOBS)
+        agg_df['residual'] = agg_df['amount'] - agg_df['predicted']
+        return {
+            "model": model,
+            "aggregate": agg_df,
+            "month_rows": agg_df.groupby('month_year', sort=False).indices,
+            "feature_importance": feature_importance,
+            "mae": mean_absolute_error(y, agg_df['predicted']),
+        }
+
+    def ml_root_cause_analysis(self, from_month, to_month, fitted=None):
+        fitted = fitted if fitted is not None else self.get_rca_model()
+        if fitted is None:
+            return {"error": "Insufficient data for ML analysis"}
+
+        comp_group = _pair_rows(fitted, from_month, to_month)
+        feature_importance = fitted["feature_importance"]
 
         return {
             "ml_method": "random_forest",
             "feature_importance": feature_importance.head(5).to_dict("records"),
-            "model_performance": {"mae": mean_absolute_error(y, model.predict(X))},
-            "top_residuals": comp_group.nlargest(5, 'residual').to_dict("records"),
+            "model_performance": {"mae": fitted["mae"]},
+            "top_residuals": comp_group.nlargest(RCA_TOP_RESIDUALS, 'residual').to_dict("records"),
             "key_insights": self._generate_ml_insights(feature_importance)
         }
 
+    def contribution_analysis(self, from_month, to_month, top=CONTRIBUTION_TOP_MEMBERS):
+        """Exact decomposition of the change in spend from from_month to to_month.
+
+        Computed from one month x dimension rollup of the two months, so it needs no model and
+        gives the same answer every time. Each member's change
+        is split into volume, mix and rate effects (see _member_changes). top_cost_centers
+        feeds the RCA waterfall chart.
+        """
+        if from_month == to_month:
+            raise InvalidParameterError("from_month and to_month must differ")
+
+        # Only the two months are totalled, read straight from the ledger snapshot or finance_expense
+        months = self.filters.with_period(min(from_month, to_month), max(from_month, to_month))
+        rollup = get_rollup(CONTRIBUTION_DIMENSIONS + ['cost_center_name'], session=self.session, filters=months)
+        rollup = rollup[rollup['month_year'].isin([from_month, to_month])].reset_index(drop=True)
+        if rollup.empty:
+            return {"error": f"No postings in {from_month} or {to_month}"}
+        rollup['amount'] = signed_rollup_amounts(rollup)
+        rollup = fill_blanks(rollup, [*CONTRIBUTION_DIMENSIONS, 'cost_center_name'])
+
+        from_total = float(rollup.loc[rollup['month_year'] == from_month, 'amount'].sum())
+        to_total = float(rollup.loc[rollup['month_year'] == to_month, 'amount'].sum())
+        total_change = to_total - from_total
+        changes = _member_changes(rollup, CONTRIBUTION_DIMENSIONS, from_month, to_month)
+
+        members = changes['dimension'].value_counts()
+        contributors = _change_records(changes.groupby('dimension', sort=False).head(top), total_change)
+        dimensions = {
+            dimension: {"members": int(members.get(dimension, 0)), "top_contributors": contributors.get(dimension, [])}
+            for dimension in CONTRIBUTION_DIMENSIONS
+        }
+
+        all_cost_centers = changes[changes['dimension'] == 'cost_center_id']
+        cost_centers = all_cost_centers.head(top)
+        names = rollup.drop_duplicates('cost_center_id').set_index('cost_center_id')['cost_center_name']
+        top_cost_centers = {}
+        for record in contributors.get('cost_center_id', []):
+            name = names.get(record['member'], '')
+            label = f"{record['member']} - {name}" if name else (record['member'] or "(blank)")
+            top_cost_centers[label] = record
+        remainder = total_change - float(cost_centers['change'].sum())
+        if len(cost_centers) < len(all_cost_centers) and round(remainder, 2):
+            top_cost_centers["Other cost centers"] = {"change": round(remainder, 2)}
+
+        increase = all_cost_centers.loc[all_cost_centers['change'].idxmax()]
+        decrease = all_cost_centers.loc[all_cost_centers['change'].idxmin()]
+        return {
+            "analysis_type": "contribution",
+            "from_month": from_month,
+            "to_month": to_month,
+            "totals": {
+                "from_amount": round(from_total, 2),
+                "to_amount": round(to_total, 2),
+                "change": round(total_change, 2),
+                "change_pct": round(total_change / abs(from_total) * 100, 2) if from_total else None,
+            },
+            "dimensions": dimensions,
+            "top_cost_centers": top_cost_centers,
+            "summary": {
+                "total_change": round(total_change, 2),
+                "largest_increase": {"cost_center_id": increase['member'], "change": round(float(increase['change']), 2)},
+                "largest_decrease": {"cost_center_id": decrease['member'], "change": round(float(decrease['change']), 2)},
+            },
+        }
+
+    def drill_down_analysis(self, from_month, to_month, threshold=0.05, max_depth=None, limit=20):
+        """Ranked combinations of directorate > cost center > GL account > supplier that explain
+        the change in spend from from_month to to_month.
+
+        The search runs on the aggregate ledger cube, or on a rollup of the two months when a
+        filter is not a cube dimension, never on postings. Branches whose absolute change is
+        below `threshold` times the absolute total change are pruned.
+        """
+        if from_month == to_month:
+            raise InvalidParameterError("from_month and to_month must differ")
+        if not 0 <= threshold < 1:
+            raise InvalidParameterError("threshold must be at least 0 and below 1")
+        max_depth = len(DRILL_DOWN_HIERARCHY) if max_depth is None else int(max_depth)
+        if not 1 <= max_depth <= len(DRILL_DOWN_HIERARCHY):
+            raise InvalidParameterError(f"max_depth must be between 1 and {len(DRILL_DOWN_HIERARCHY)}")
+        months = self.filters.with_period(min(from_month, to_month), max(from_month, to_month))
+
+        cells = self._drill_down_cells(months)
+        cells = cells[cells['month_year'].isin([from_month, to_month])].reset_index(drop=True)
+        if cells.empty:
+            return {"error": f"No postings in {from_month} or {to_month}"}
+        cells = fill_blanks(cells, DRILL_DOWN_HIERARCHY)
+        later = (cells['month_year'] == to_month).to_numpy()
+        cells = cells.assign(
+            from_amount=np.where(later, 0.0, cells['amount']), to_amount=np.where(later, cells['amount'], 0.0)
+        ).groupby(DRILL_DOWN_HIERARCHY, sort=False)[['from_amount', 'to_amount']].sum().reset_index()
+
+        total_change = float(cells['to_amount'].sum() - cells['from_amount'].sum())
+        # With no net change, measure against the gross movement of the top level instead
+        top = cells.groupby(DRILL_DOWN_HIERARCHY[0])[['from_amount', 'to_amount']].sum()
+        reference = abs(total_change) or float((top['to_amount'] - top['from_amount']).abs().sum())
+        levels, evaluated = _drill_down(cells, DRILL_DOWN_HIERARCHY, max(threshold * reference, 1e-9), max_depth)
+        explanations = _explanations(levels, DRILL_DOWN_HIERARCHY, DRILL_DOWN_CONCENTRATION)
+
+        records = []
+        if not explanations.empty:
+            explanations['magnitude'] = explanations['change'].abs()
+            explanations['path_key'] = explanations[
+                [d for d in DRILL_DOWN_HIERARCHY if d in explanations.columns]
+            ].fillna('').astype(str).agg('/'.join, axis=1)
+            explanations = explanations.sort_values(
+                ['magnitude', 'depth', 'path_key'], ascending=[False, False, True], kind='mergesort'
+            )
+            for row in explanations.head(int(limit)).itertuples(index=False):
+                row = row._asdict()
+                path = {d: row[d] for d in DRILL_DOWN_HIERARCHY[:row['depth']]}
+                records.append({
+                    "path": path,
+                    "description": " > ".join(f"{d}={v or '(blank)'}" for d, v in path.items()),
+                    "depth": row['depth'],
+                    "from_amount": round(float(row['from_amount']), 2),
+                    "to_amount": round(float(row['to_amount']), 2),
+                    "change": round(float(row['change']), 2),
+                    "share_of_change": round(float(row['change']) / total_change, 4) if total_change else None,
+                    "children_explain": round(float(row['children_explain']), 4) + 0.0,
+                })
+
+        return {
+            "analysis_type": "drill_down",
+            "from_month": from_month,
+            "to_month": to_month,
+            "hierarchy": DRILL_DOWN_HIERARCHY[:max_depth],
+            "threshold": threshold,
+            "total_change": round(total_change, 2),
+            "explanations": records,
+            "search": {
+                "cells": len(cells),
+                "nodes_evaluated": evaluated,
+                "nodes_kept": int(sum(len(level) for level in levels)),
+                "explanations_found": len(explanations),
+            },
+        }
+
+    def _drill_down_cells(self, months):
+        """Month x hierarchy cells with their signed amount, for the filtered two-month window"""
+        if set(self.filters.columns) <= set(CUBE_DIMENSIONS):
+            time_range = {"from": "%s-%02d" % months.period_from, "to": "%s-%02d" % months.period_to}
+            cube = get_ledger_cube(self.session)
+            return cube.cells(['month_year', *DRILL_DOWN_HIERARCHY], self.filters.columns, time_range)
+        rollup = get_rollup(DRILL_DOWN_HIERARCHY, session=self.session, filters=months)
+        rollup['amount'] = signed_rollup_amounts(rollup)
+        return rollup[['month_year', *DRILL_DOWN_HIERARCHY, 'amount']]
+
     def _generate_ml_insights(self, feature_importance):
         if feature_importance.empty:
             return []
@@ -125,27 +499,45 @@ class AdvancedRCAService:
         if self.session:
             self.session.close()
 
-def perform_comprehensive_rca(from_month, to_month):
-    rca = AdvancedRCAService()
+def perform_comprehensive_rca(from_month, to_month, filters=None):
+    rca = AdvancedRCAService(filters)
     try:
         return rca.ml_root_cause_analysis(from_month, to_month)
     finally:
         rca.close_session()
 
-def perform_dynamic_rca():
-    rca = AdvancedRCAService()
+def perform_contribution_rca(from_month, to_month, filters=None):
+    rca = AdvancedRCAService(filters)
+    try:
+        return rca.contribution_analysis(from_month, to_month)
+    finally:
+        rca.close_session()
+
+def perform_drill_down_rca(from_month, to_month, filters=None, threshold=0.05, max_depth=None, limit=20):
+    rca = AdvancedRCAService(filters)
+    try:
+        return rca.drill_down_analysis(from_month, to_month, threshold, max_depth, limit)
+    finally:
+        rca.close_session()
+
+def perform_dynamic_rca(filters=None, progress=None):
+    """ML RCA of every consecutive month pair; progress(fraction, period) is called after each"""
+    rca = AdvancedRCAService(filters)
     try:
         available_months = rca.get_available_months()
         if len(available_months) < 2:
             return {"error": "Not enough months"}
 
+        fitted = rca.get_rca_model()
         results = []
         for i in range(len(available_months) - 1):
             from_month = available_months[i]
             to_month = available_months[i + 1]
-            analysis = rca.ml_root_cause_analysis(from_month, to_month)
+            analysis = rca.ml_root_cause_analysis(from_month, to_month, fitted)
             analysis["period"] = f"{from_month} to {to_month}"
             results.append(analysis)
+            if progress is not None:
+                progress((i + 1) / (len(available_months) - 1), analysis["period"])
 
         return {
             "analysis_type": "dynamic_ml_rca",
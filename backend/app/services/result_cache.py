@@ -0,0 +1,200 @@
+from app.services.ledger_service import current_data_version
+from app.config import Config
+from flask import current_app, has_app_context
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+import hashlib
+import json
+import threading
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def analysis_params(filters, options=None):
+    """Normalized cache key parameters of a parsed LedgerFilter plus validated options.
+
+    It is built from what the computation is actually handed, so parameter order,
+    spelling a default out, repeating a filter value or side-effect-only arguments such
+    as room_id do not split the entry.
+    """
+    params = {}
+    for name, value in {**filters.to_dict(), **(options or {})}.items():
+        values = value if isinstance(value, (list, tuple)) else [value]
+        params[name] = sorted({str(v) for v in values})
+    return params
+
+
+def _cache_key(endpoint, params, version):
+    raw = json.dumps([endpoint, params, version], sort_keys=True, default=str)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def serialize_result(result):
+    """Serialize like jsonify does inside a request, so a cached hit renders identically"""
+    if has_app_context():
+        return current_app.json.dumps(result)
+    return json.dumps(result, default=_json_default)
+
+
+class LRUResultCache:
+    """Serialized results bounded by entry count and total size, least recently used out first.
+
+    Entries of other data versions can never be hit again, so they are dropped as soon as
+    a lookup sees a new version.
+    """
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version = None
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _use_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.size = 0
+            self.version = version
+
+    def get(self, key, version):
+        with self._lock:
+            self._use_version(version)
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+            return payload
+
+    def put(self, key, version, payload):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            self._use_version(version)
+            previous = self._entries.pop(key, None)
+            self.size -= len(previous) if previous is not None else 0
+            self._entries[key] = payload
+            self.size += len(payload)
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class MongoResultCache:
+    """Serialized results shared by every worker through the analysis_cache collection.
+
+    Documents expire RESULT_CACHE_TTL seconds after they are written (TTL index), and those
+    of older data versions are deleted once a write sees a new version.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = None
+        self._collection = None
+
+    @property
+    def collection(self):
+        if self._collection is None:
+            from app.models.mongo import analysis_cache_collection
+            analysis_cache_collection.create_index("created_at", expireAfterSeconds=self.ttl)
+            self._collection = analysis_cache_collection
+        return self._collection
+
+    def get(self, key, version):
+        document = self.collection.find_one({"_id": key, "version": version}, {"payload": 1})
+        return document["payload"] if document else None
+
+    def put(self, key, version, payload, endpoint=None):
+        if version != self.version:
+            self.collection.delete_many({"version": {"$ne": version}})
+            self.version = version
+        self.collection.replace_one(
+            {"_id": key},
+            {"version": version, "endpoint": endpoint, "payload": payload, "created_at": datetime.utcnow()},
+            upsert=True,
+        )
+
+
+_memory = LRUResultCache(Config.RESULT_CACHE_MAX_ENTRIES, Config.RESULT_CACHE_MAX_BYTES)
+_shared = None
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _shared_cache():
+    global _shared
+    if Config.RESULT_CACHE_BACKEND != "mongo":
+        return None
+    if _shared is None:
+        _shared = MongoResultCache(Config.RESULT_CACHE_TTL)
+    return _shared
+
+
+def _lookup(key, version):
+    payload = _memory.get(key, version)
+    if payload is None and _shared_cache() is not None:
+        try:
+            payload = _shared_cache().get(key, version)
+        except Exception as e:
+            logger.warning(f"Shared result cache read failed: {str(e)}")
+        if payload is not None:
+            _memory.put(key, version, payload)
+    return payload
+
+
+def _store(key, version, payload, endpoint):
+    _memory.put(key, version, payload)
+    if _shared_cache() is not None:
+        try:
+            _shared_cache().put(key, version, payload, endpoint)
+        except Exception as e:
+            logger.warning(f"Shared result cache write failed: {str(e)}")
+
+
+def get_cached_result(endpoint, params, compute, session=None):
+    """Result of compute() for (endpoint, params) at the current ledger data version.
+
+    Hits come from the in-process LRU, then from the shared backend (RESULT_CACHE_BACKEND
+    "mongo"). Concurrent misses on one key compute once; results carrying an "error" key
+    are returned but not kept. Each hit is a fresh copy, so callers may modify it.
+    """
+    if Config.RESULT_CACHE_BACKEND == "off":
+        return compute()
+
+    version = current_data_version(session)
+    key = _cache_key(endpoint, params, version)
+    payload = _lookup(key, version)
+    if payload is not None:
+        logger.info(f"Result cache hit for {endpoint} at version {version}.")
+        return json.loads(payload)
+
+    with _inflight_lock:
+        lock = _inflight.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            payload = _lookup(key, version)
+            if payload is not None:
+                return json.loads(payload)
+            result = compute()
+            if not (isinstance(result, dict) and "error" in result):
+                _store(key, version, serialize_result(result), endpoint)
+            return result
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
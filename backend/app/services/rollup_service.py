@@ -0,0 +1,218 @@
+from app.models.postgres import SessionLocal
+from app.services.ledger_service import (
+    get_data_version, get_cached_ledger_snapshot, get_ledger_rollup, get_ledger_frame,
+    build_rollup, ROLLUP_PERIOD_KEYS
+)
+from app.services.ledger_filters import LedgerFilter
+from app.services.eda_sql_service import MONTH_YEAR_SQL
+from app.config import Config
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+import pandas as pd
+import threading
+import time
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Materialized view -> dimension columns it is keyed by, besides fiscal period and debit/credit
+ROLLUP_VIEWS = {
+    "finance_expense_rollup_monthly": [],
+    "finance_expense_rollup_directorate": ["directorate"],
+    "finance_expense_rollup_cost_center": [
+        "cost_center_id", "cost_center_name", "directorate", "functional_area_name"
+    ],
+    "finance_expense_rollup_functional_area": ["functional_area", "functional_area_name"],
+    "finance_expense_rollup_gl_account": ["general_ledger_account", "general_ledger_account_name"],
+    "finance_expense_rollup_supplier": ["supplier"],
+}
+
+ROLLUP_STATE_TABLE = "finance_expense_rollup_state"
+
+
+def _quote(name):
+    return f'"{name}"'
+
+
+def _view_sql(name, dimensions):
+    keys = ", ".join(_quote(c) for c in ["general_ledger_fiscal_year", "posting_period", *dimensions, "debit_credit_ind"])
+    return f"""
+        CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS
+        SELECT {keys},
+               {MONTH_YEAR_SQL} AS month_year,
+               SUM(COALESCE(company_code_currency_value, 0)) AS value_sum,
+               SUM(ABS(COALESCE(company_code_currency_value, 0))) AS abs_sum,
+               MIN(company_code_currency_value) AS value_min,
+               MAX(company_code_currency_value) AS value_max,
+               COUNT(*) AS row_count
+        FROM finance_expense
+        GROUP BY {keys}
+        WITH NO DATA
+    """
+
+
+def create_rollup_views(connection):
+    """Create the rollup materialized views (unpopulated) and their state table if missing"""
+    connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (
+            id INTEGER PRIMARY KEY,
+            data_version VARCHAR(100) NOT NULL,
+            refreshed_at TIMESTAMP NOT NULL DEFAULT NOW()
+        )
+    """))
+    for name, dimensions in ROLLUP_VIEWS.items():
+        connection.execute(text(_view_sql(name, dimensions)))
+        # A unique index over the full key lets later refreshes run CONCURRENTLY
+        keys = ", ".join(_quote(c) for c in ["general_ledger_fiscal_year", "posting_period", *dimensions, "debit_credit_ind"])
+        connection.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {name}_key ON {name} ({keys})"))
+
+
+def refresh_rollup_views(connection):
+    """Recompute every rollup view and record the finance_expense data version they reflect.
+
+    The version is probed before the refresh, so a write racing the refresh leaves the
+    views marked stale rather than fresh.
+    """
+    version = get_data_version(connection)
+    populated = dict(connection.execute(text(
+        "SELECT matviewname, ispopulated FROM pg_matviews WHERE matviewname = ANY(:names)"
+    ), {"names": list(ROLLUP_VIEWS)}).all())
+    for name in ROLLUP_VIEWS:
+        # CONCURRENTLY keeps the view readable during the refresh but needs an initial population
+        concurrently = "CONCURRENTLY " if populated.get(name) else ""
+        connection.execute(text(f"REFRESH MATERIALIZED VIEW {concurrently}{name}"))
+    connection.execute(text(f"""
+        INSERT INTO {ROLLUP_STATE_TABLE} (id, data_version, refreshed_at) VALUES (1, :version, NOW())
+        ON CONFLICT (id) DO UPDATE SET data_version = EXCLUDED.data_version, refreshed_at = EXCLUDED.refreshed_at
+    """), {"version": version})
+    logger.info(f"Refreshed {len(ROLLUP_VIEWS)} rollup views at data version {version}.")
+    return version
+
+
+def covering_view(dimensions):
+    """Smallest rollup view keyed by every requested dimension, or None"""
+    candidates = [
+        (len(view_dimensions), name) for name, view_dimensions in ROLLUP_VIEWS.items()
+        if set(dimensions) <= set(view_dimensions)
+    ]
+    return min(candidates)[1] if candidates else None
+
+
+_views_fresh = False
+_checked_at = 0.0
+_refreshing = False
+_refreshed_at = 0.0
+_lock = threading.Lock()
+
+
+def _refresh_stale_views():
+    """Bring the views to the current data version in the background.
+
+    One worker refreshes at a time (an advisory lock), CONCURRENTLY so readers keep the
+    old rows meanwhile; readers re-check freshness as soon as it is done.
+    """
+    global _refreshing, _refreshed_at
+    session = SessionLocal()
+    try:
+        locked = session.execute(
+            text("SELECT pg_try_advisory_xact_lock(hashtext(:name))"), {"name": ROLLUP_STATE_TABLE}
+        ).scalar()
+        if locked:
+            refresh_rollup_views(session.connection())
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logger.warning(f"Rollup view refresh failed: {str(e)}")
+    finally:
+        session.close()
+        with _lock:
+            _refreshing = False
+            _refreshed_at = time.time()
+        invalidate_rollup_state()
+
+
+def _rollup_views_fresh(session):
+    """Whether the views reflect the current data version; re-probed at most every LEDGER_VERSION_TTL seconds.
+
+    Stale views are refreshed in the background, at most every ROLLUP_REFRESH_INTERVAL
+    seconds, while readers fall back to the snapshot.
+    """
+    global _views_fresh, _checked_at, _refreshing
+    with _lock:
+        if time.time() - _checked_at < Config.LEDGER_VERSION_TTL:
+            return _views_fresh
+        try:
+            refreshed = session.execute(text(f"SELECT data_version FROM {ROLLUP_STATE_TABLE} WHERE id = 1")).scalar()
+            _views_fresh = refreshed is not None and refreshed == get_data_version(session)
+        except DBAPIError:
+            # Views not migrated yet
+            session.rollback()
+            _checked_at = time.time()
+            _views_fresh = False
+            return False
+        _checked_at = time.time()
+        if not _views_fresh and not _refreshing and time.time() - _refreshed_at >= Config.ROLLUP_REFRESH_INTERVAL:
+            _refreshing = True
+            threading.Thread(target=_refresh_stale_views, name="rollup-refresh", daemon=True).start()
+        return _views_fresh
+
+
+def _load_view(view, dimensions, session, filters=None):
+    keys = ", ".join(_quote(c) for c in [*ROLLUP_PERIOD_KEYS, *dimensions, "debit_credit_ind"])
+    # The filter columns are view keys and the view keeps the raw period columns, so the
+    # same WHERE fragment that filters finance_expense applies to the view unchanged
+    where, params = LedgerFilter.coerce(filters).where_sql()
+    return pd.read_sql(text(f"""
+        SELECT {keys},
+               SUM(value_sum) AS value_sum, SUM(abs_sum) AS abs_sum,
+               MIN(value_min) AS value_min, MAX(value_max) AS value_max,
+               SUM(row_count) AS row_count
+        FROM {view}
+        WHERE {where}
+        GROUP BY {keys}
+    """), session.connection(), params=params)
+
+
+def get_rollup(dimensions=(), session=None, filters=None):
+    """Fiscal period x dimensions x debit_credit_ind totals of finance_expense.
+
+    Served from the warm in-process ledger snapshot when there is one, otherwise from
+    the rollup materialized views while they match the current data version, and
+    otherwise from a (re)loaded snapshot. Every source returns the ROLLUP_PERIOD_KEYS,
+    the dimensions, debit_credit_ind, value_sum, abs_sum and row_count.
+
+    With a non-empty LedgerFilter only matching rows are totalled: the snapshot rows are
+    masked, a view keyed by the filter columns is read with the filter as its WHERE
+    clause, and failing both just the matching rows are loaded from finance_expense.
+    """
+    dimensions = list(dimensions)
+    filters = LedgerFilter.coerce(filters)
+    if not filters and get_cached_ledger_snapshot() is not None:
+        return get_ledger_rollup(dimensions, session=session)
+
+    owns_session = session is None
+    session = session or SessionLocal()
+    try:
+        if filters:
+            if get_cached_ledger_snapshot() is None:
+                view = covering_view(dimensions + list(filters.columns))
+                if view is not None and _rollup_views_fresh(session):
+                    return _load_view(view, dimensions, session, filters)
+            columns = [*ROLLUP_PERIOD_KEYS, *dimensions, "debit_credit_ind", "company_code_currency_value"]
+            return build_rollup(get_ledger_frame(columns, session=session, filters=filters), dimensions).reset_index()
+
+        view = covering_view(dimensions)
+        if view is not None and _rollup_views_fresh(session):
+            return _load_view(view, dimensions, session)
+        return get_ledger_rollup(dimensions, session=session)
+    finally:
+        if owns_session:
+            session.close()
+
+
+def invalidate_rollup_state():
+    """Force the next reader to re-check whether the views are current, e.g. after a refresh"""
+    global _checked_at
+    with _lock:
+        _checked_at = 0.0
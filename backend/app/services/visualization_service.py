@@ -1,4 +1,7 @@
-from app.models.postgres import SessionLocal, FinanceExpense
+from app.models.postgres import SessionLocal
+from app.services.rollup_service import get_rollup
+from app.services.ledger_filters import LedgerFilter
+from app.services.normalization import signed_rollup_amounts, fill_blanks
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
@@ -13,8 +16,9 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class VisualizationService:
-    def __init__(self):
+    def __init__(self, filters=None):
         self.session = SessionLocal()
+        self.filters = LedgerFilter.coerce(filters)
     
     def __del__(self):
         if hasattr(self, 'session'):
@@ -23,70 +27,34 @@ class VisualizationService:
             except:
                 pass
     
-    def get_data_for_visualization(self, date_range=None):
-        """Get data formatted for visualization"""
+    def get_rollup_for_visualization(self, dimensions=()):
+        """Monthly signed amount and row count per dimension values, from the month x dimension rollups.
+
+        Same amounts as summing the signed ledger rows, without touching individual rows.
+        """
+        dimensions = list(dimensions)
         try:
-            query = self.session.query(FinanceExpense)
-            result = query.all()
-            
-            if not result:
+            rollup = get_rollup(dimensions, session=self.session, filters=self.filters)
+            if rollup.empty:
                 return pd.DataFrame()
-                
-            return pd.DataFrame([{
-                "cost_center_id": r.cost_center_id,
-                "cost_center_name": r.cost_center_name,
-                "functional_area": r.functional_area,
-                "functional_area_name": r.functional_area_name,
-                "amount": float(r.company_code_currency_value or 0) * (-1 if r.debit_credit_ind == 'H' else 1),
-                "month_year": f"{r.general_ledger_fiscal_year}-{r.posting_period:02d}" if r.general_ledger_fiscal_year and r.posting_period else "",
-                "directorate": r.directorate or "",
-                "remapping_directorate": r.remapping_directorate or "",
-                "general_ledger_account": r.general_ledger_account,
-                "general_ledger_account_name": r.general_ledger_account_name,
-                "profit_center_name": r.profit_center_name,
-                "supplier": r.supplier or "",
-                "transaction": r.transaction or "",
-                "level_1": r.level_1 or "",
-                "level_7": r.level_7 or "",
-                "entity": r.entity or "",
-                "debit_credit_ind": r.debit_credit_ind or ""
-            } for r in result])
+
+            rollup["amount"] = signed_rollup_amounts(rollup)
+            rollup = fill_blanks(rollup, ["month_year"])
+            rollup = rollup.dropna(subset=dimensions)
+            return rollup.groupby(["month_year", *dimensions])[["amount", "row_count"]].sum().reset_index()
         except Exception as e:
-            print(f"Error in get_data_for_visualization: {str(e)}")
+            logger.error(f"Error in get_rollup_for_visualization: {str(e)}")
             return pd.DataFrame()
-        
-        result = query.all()
-        df = pd.DataFrame([{
-            "cost_center_id": r.cost_center_id,
-            "cost_center_name": r.cost_center_name,
-            "functional_area": r.functional_area,
-            "functional_area_name": r.functional_area_name,
-            "amount": float(r.company_code_currency_value or 0) * (-1 if r.debit_credit_ind == 'H' else 1),
-            "month_year": f"{r.general_ledger_fiscal_year}-{r.posting_period:02d}" if r.general_ledger_fiscal_year and r.posting_period else "",
-            "directorate": r.directorate or "",
-            "remapping_directorate": r.remapping_directorate or "",
-            "general_ledger_account": r.general_ledger_account,
-            "general_ledger_account_name": r.general_ledger_account_name,
-            "profit_center_name": r.profit_center_name,
-            "supplier": r.supplier or "",
-            "transaction": r.transaction or "",
-            "level_1": r.level_1 or "",
-            "level_7": r.level_7 or "",
-            "entity": r.entity or "",
-            "debit_credit_ind": r.debit_credit_ind or ""
-        } for r in result])
-        
-        return df
     
     def generate_trend_chart_data(self):
         """Generate data for trend visualization"""
-        df = self.get_data_for_visualization()
+        df = self.get_rollup_for_visualization()
         
         if df.empty:
             return {"error": "No data available"}
         
         # Monthly trend
-        monthly_trend = df.groupby('month_year')['amount'].sum().reset_index()
+        monthly_trend = df[['month_year', 'amount']]
         monthly_trend = monthly_trend.sort_values('month_year')
         
         # Create Plotly chart data (JSON format for frontend)
@@ -122,7 +90,7 @@ class VisualizationService:
     
     def generate_category_breakdown_chart(self):
         """Generate functional area breakdown pie chart data"""
-        df = self.get_data_for_visualization()
+        df = self.get_rollup_for_visualization(['functional_area_name'])
         
         if df.empty:
             return {"error": "No data available"}
@@ -200,7 +168,7 @@ class VisualizationService:
     
     def generate_cost_center_heatmap(self):
         """Generate cost center vs month heatmap data"""
-        df = self.get_data_for_visualization()
+        df = self.get_rollup_for_visualization(['cost_center_id', 'cost_center_name'])
         
         if df.empty:
             return {"error": "No data available"}
@@ -285,10 +253,14 @@ class VisualizationService:
         fig = go.Figure()
         
         # Add aggregated normal points (sample a subset to reduce size)
-        df_all = self.get_data_for_visualization()
+        df_all = self.get_rollup_for_visualization()
         if not df_all.empty:
-            # Sample and aggregate by month to reduce data points dramatically
-            monthly_normal = df_all.groupby('month_year')['amount'].agg(['mean', 'count']).reset_index()
+            # Aggregate by month to reduce data points dramatically
+            monthly_normal = pd.DataFrame({
+                'month_year': df_all['month_year'],
+                'mean': df_all['amount'] / df_all['row_count'],
+                'count': df_all['row_count']
+            })
             monthly_normal = monthly_normal.head(20)  # Limit to 20 months max
             
             fig.add_trace(go.Scatter(
@@ -350,7 +322,7 @@ class VisualizationService:
                 "displayed_anomalies": len(df_anomalies),
                 "detection_method": anomaly_data.get('method', 'unknown'),
                 "avg_anomaly_amount": df_anomalies['amount'].mean() if not df_anomalies.empty else 0,
-                "data_optimization": f"Reduced from {len(df_all) if not df_all.empty else 0} to {len(monthly_normal) if not df_all.empty else 0} normal points, showing {len(df_anomalies)} anomalies"
+                "data_optimization": f"Reduced from {int(df_all['row_count'].sum()) if not df_all.empty else 0} to {len(monthly_normal) if not df_all.empty else 0} normal points, showing {len(df_anomalies)} anomalies"
             }
         }
     
@@ -408,11 +380,11 @@ class VisualizationService:
             }
         }
 
-def get_visualization_data(chart_type, **kwargs):
-    """Main function to get visualization data"""
+def get_visualization_data(chart_type, filters=None, **kwargs):
+    """Main function to get visualization data; filters is an optional LedgerFilter"""
     viz_service = None
     try:
-        viz_service = VisualizationService()
+        viz_service = VisualizationService(filters)
         
         if not chart_type:
             return {"error": "Chart type is required"}
@@ -3,6 +3,8 @@ from sqlalchemy import create_engine, Column, Integer, String, Float, Text, insp
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from app.config import Config
+from app.services.ledger_service import install_version_tracking
+from app.services.rollup_service import create_rollup_views, refresh_rollup_views
 import os
 
 # Database setup
@@ -44,6 +46,16 @@ class FinanceExpense(Base):
     remapping_directorate = Column(String(255))
     status = Column(String(50))
 
+def build_rollups(engine):
+    """Install the data version triggers, create the month x dimension rollup views if needed
+    and refresh them from finance_expense"""
+    print("Refreshing rollup views...")
+    with engine.begin() as conn:
+        install_version_tracking(conn)
+        create_rollup_views(conn)
+        version = refresh_rollup_views(conn)
+    print(f"✅ Rollup views refreshed (data version {version})")
+
 def migrate_data():
     csv_file = os.path.join(os.path.dirname(__file__), "data-ori.csv")
     
@@ -97,6 +109,7 @@ def migrate_data():
             count = result.scalar()
             if count > 0:
                 print(f"✅ Table already contains {count} rows. Skipping migration.")
+                build_rollups(engine)
                 return
             else:
                 print("Table exists but is empty. Proceeding with data import...")
@@ -161,5 +174,7 @@ def migrate_data():
         count = result.scalar()
         print(f"✅ Verification: {count} rows in database")
 
+    build_rollups(engine)
+
 if __name__ == "__main__":
     migrate_data()
\ No newline at end of file
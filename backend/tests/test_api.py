@@ -38,11 +38,24 @@ class FlaskAppTestCase(unittest.TestCase):
 
     def test_anomaly_endpoints_require_auth(self):
         """Test that anomaly endpoints return 401 without authentication"""
-        endpoints = ['/anomaly/detect', '/anomaly/statistical', '/anomaly/ml', '/anomaly/trends']
+        endpoints = ['/anomaly/detect', '/anomaly/statistical', '/anomaly/ml', '/anomaly/trends', '/anomaly/ml/score', '/anomaly/export',
+                     '/anomaly/stream/status']
         for endpoint in endpoints:
             response = self.client.get(endpoint)
             self.assertEqual(response.status_code, 401, f"Endpoint {endpoint} should require auth")
 
+    def test_ml_shard_refresh_requires_auth(self):
+        """Test that refreshing shard models returns 401 without authentication"""
+        response = self.client.post('/anomaly/ml/shards/refresh', json={"shard_by": "directorate"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_stream_scoring_requires_auth(self):
+        """Test that streamed posting batches return 401 without authentication"""
+        response = self.client.post('/anomaly/stream', json={"postings": []})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post('/anomaly/stream/poll')
+        self.assertEqual(response.status_code, 401)
+
     def test_visualization_endpoints_require_auth(self):
         """Test that visualization endpoints return 401 without authentication"""
         endpoints = ['/charts/trend', '/charts/category-breakdown', '/charts/heatmap', '/dashboard']
@@ -50,6 +63,22 @@ class FlaskAppTestCase(unittest.TestCase):
             response = self.client.get(endpoint)
             self.assertEqual(response.status_code, 401, f"Endpoint {endpoint} should require auth")
 
+    def test_cube_endpoints_require_auth(self):
+        """Test that OLAP cube endpoints return 401 without authentication"""
+        response = self.client.post('/cube/query', json={"group_by": ["month_year"]})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/cube/metadata')
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post('/cube/drilldown', json={"from_month": "2023-09", "to_month": "2023-10"})
+        self.assertEqual(response.status_code, 401)
+
+    def test_job_endpoints_require_auth(self):
+        """Test that analysis job endpoints return 401 without authentication"""
+        response = self.client.post('/jobs', json={"kind": "eda"})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.get('/jobs/0123456789abcdef01234567')
+        self.assertEqual(response.status_code, 401)
+
     def test_charts_available_endpoint(self):
         """Test the charts available endpoint with authentication"""
         response = self.client.get('/charts/available', headers={
@@ -176,6 +205,14 @@ class FlaskAppTestCase(unittest.TestCase):
             parts = token.split('.')
             self.assertEqual(len(parts), 3)
 
+    def test_invalid_filter_period_rejected(self):
+        """Test that a malformed period filter is rejected before any query runs"""
+        headers = {'Authorization': f'Bearer {self.auth_token}'}
+        response = self.client.get('/eda/timeseries?period_from=2023-3', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/anomaly/trends?period_to=June', headers=headers)
+        self.assertEqual(response.status_code, 400)
+
     def test_rca_waterfall_endpoint_structure(self):
         """Test RCA waterfall endpoint accepts POST requests"""
         response = self.client.post('/charts/rca-waterfall', 
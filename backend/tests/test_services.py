@@ -0,0 +1,415 @@
+import unittest
+import os
+import numpy as np
+import pandas as pd
+from unittest.mock import patch
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+# Set test environment variables before importing anything
+os.environ.setdefault('POSTGRES_USER', 'test')
+os.environ.setdefault('POSTGRES_PASSWORD', 'test')
+os.environ.setdefault('POSTGRES_HOST', 'localhost')
+os.environ.setdefault('POSTGRES_PORT', '5432')
+os.environ.setdefault('POSTGRES_DB', 'test')
+os.environ.setdefault('MONGO_URI', 'mongodb://localhost:27017/test')
+os.environ.setdefault('JWT_SECRET', 'test')
+os.environ.setdefault('OPENROUTER_API_KEY', 'test')
+
+from app.models import postgres
+from app.services import result_cache
+from app.services.anomaly_service import detector_params
+from app.services.ledger_filters import LedgerFilter, InvalidParameterError
+from app.services.rca_service import _member_changes, _drill_down
+from app.services.cube_service import LedgerCube, CUBE_DIMENSIONS
+from app.services.dimension_dictionary import DimensionDictionary
+from app.services.normalization import month_year_key, signed_amounts, signed_rollup_amounts
+from app.utils.sketches import HyperLogLog, QuantileSketch
+
+
+class LedgerFilterTestCase(unittest.TestCase):
+    """LedgerFilter must select the same rows in PostgreSQL (where_sql) and in memory (mask)"""
+
+    ROWS = pd.DataFrame([
+        (1, 'D1', 'CC1', '1000', 'FA1', 'Ops', '2023', 11),
+        (2, 'D1', 'CC2', '1000', 'FA2', 'HR', '2023', 12),
+        (3, 'D2', 'CC1', '2000', 'FA1', 'Ops', '2024', 1),
+        (4, 'D2', 'CC3', '2000', 'FA3', 'Fin', '2024', 2),
+        (5, 'D3', 'CC1', '1000', 'FA1', 'Ops', '2024', 3),
+        (6, 'D1', 'CC2', '2000', 'FA2', 'HR', '', 4),
+        (7, 'D3', 'CC3', '1000', 'FA3', 'Fin', '2024', 0),
+        (8, None, 'CC1', '1000', 'FA1', 'Ops', '2024', 2),
+        (9, '', 'CC2', '2000', 'FA2', 'HR', '2022', 12),
+    ], columns=[
+        'id', 'directorate', 'cost_center_id', 'company_code', 'functional_area', 'functional_area_name',
+        'general_ledger_fiscal_year', 'posting_period'
+    ])
+
+    FILTERS = [
+        LedgerFilter(),
+        LedgerFilter(columns={'directorate': ['D1', 'D2']}),
+        LedgerFilter('2023-12', '2024-02'),
+        LedgerFilter(period_from='2024-01', columns={'cost_center_id': ['CC1']}),
+        LedgerFilter(period_to='2023-12'),
+        LedgerFilter.from_args({'directorate': 'D1,D3', 'category': 'Ops', 'period_from': '2023-11'}),
+        LedgerFilter.from_args({'company_code': ['2000'], 'period_to': '2024-02'}),
+    ]
+
+    def setUp(self):
+        try:
+            self.connection = postgres.engine.connect()
+        except OperationalError as e:
+            self.skipTest(f"PostgreSQL is not available: {e}")
+        self.connection.execute(text("""
+            CREATE TEMPORARY TABLE finance_expense (
+                id integer, directorate varchar(255), cost_center_id varchar(50), company_code varchar(20),
+                functional_area varchar(50), functional_area_name varchar(255),
+                general_ledger_fiscal_year varchar(10), posting_period integer
+            )
+        """))
+        self.connection.execute(
+            text("""
+                INSERT INTO finance_expense VALUES (:id, :directorate, :cost_center_id, :company_code,
+                    :functional_area, :functional_area_name, :general_ledger_fiscal_year, :posting_period)
+            """),
+            self.ROWS.astype(object).where(self.ROWS.notna(), None).to_dict('records')
+        )
+
+    def tearDown(self):
+        self.connection.rollback()
+        self.connection.close()
+
+    def test_mask_matches_where_sql(self):
+        """Test that the pandas mask and the SQL WHERE fragment keep the same rows"""
+        frame = self.ROWS.copy()
+        frame['month_year'] = month_year_key(frame['general_ledger_fiscal_year'], frame['posting_period'])
+        for filters in self.FILTERS:
+            where, params = filters.where_sql()
+            selected = self.connection.execute(
+                text(f"SELECT id FROM finance_expense WHERE {where} ORDER BY id"), params
+            ).scalars().all()
+            masked = frame.loc[filters.mask(frame), 'id'].tolist()
+            self.assertEqual(masked, selected, f"Filter {filters.to_dict()} selects different rows")
+
+    def test_period_bounds_exclude_rows_without_a_period(self):
+        """Test that a period bound drops rows with a blank fiscal year or period 0"""
+        frame = self.ROWS.copy()
+        frame['month_year'] = month_year_key(frame['general_ledger_fiscal_year'], frame['posting_period'])
+        masked = frame.loc[LedgerFilter(period_from='2000-01').mask(frame), 'id'].tolist()
+        self.assertEqual(masked, [1, 2, 3, 4, 5, 8, 9])
+
+
+class SketchTestCase(unittest.TestCase):
+    """Approximate distinct counts and quantiles stay within their documented error"""
+
+    def test_hyperloglog_error_bound(self):
+        """Test that HyperLogLog counts within 4 standard errors (~3.2%) at the default precision"""
+        for cardinality in (1000, 100000, 1000000):
+            sketch = HyperLogLog()
+            sketch.add(np.arange(cardinality))
+            sketch.add(np.arange(cardinality // 2))  # repeats never count twice
+            self.assertLess(abs(sketch.count() / cardinality - 1), 0.032, f"{cardinality} distinct values")
+
+    def test_hyperloglog_merge_equals_union(self):
+        """Test that merging two overlapping sketches gives the sketch of the union"""
+        left, right, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        left.add(np.arange(0, 60000))
+        right.add(np.arange(40000, 100000))
+        union.add(np.arange(100000))
+        np.testing.assert_array_equal(left.merge(right).registers, union.registers)
+
+    def test_quantile_sketch_relative_error(self):
+        """Test that merged quantile sketches stay within their relative accuracy of the exact quantile"""
+        rng = np.random.default_rng(1)
+        values = np.concatenate([rng.lognormal(8, 2, 50000), -rng.lognormal(5, 1, 10000), np.zeros(500)])
+        rng.shuffle(values)
+        sketch, other = QuantileSketch(0.01), QuantileSketch(0.01)
+        sketch.add(values[:30000])
+        other.add(values[30000:])
+        sketch.merge(other)
+        self.assertEqual(sketch.count, len(values))
+        for q in (0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1):
+            exact = np.quantile(values, q, method='lower')
+            self.assertLessEqual(abs(sketch.quantile(q) - exact), 0.01 * abs(exact) + 1e-9, f"quantile {q}")
+
+    def test_quantile_sketch_empty(self):
+        """Test that an empty sketch has no quantiles"""
+        self.assertIsNone(QuantileSketch().quantile(0.5))
+
+
+class LedgerCubeTestCase(unittest.TestCase):
+    """Cube queries roll up, drill down, slice and bound months over the stored cells"""
+
+    # (month, directorate, cost center, functional area, GL account, supplier, indicator, value_sum, abs_sum, rows)
+    ROLLUP = pd.DataFrame([
+        ('2024-01', 'D1', 'CC1', 'FA1', '551', 'SupA', 'S', 100.0, 100.0, 2),
+        ('2024-01', 'D1', 'CC1', 'FA1', '551', 'SupA', 'H', -30.0, 30.0, 1),
+        ('2024-01', 'D1', 'CC2', 'FA2', '552', 'SupB', 'S', 50.0, 50.0, 1),
+        ('2024-01', 'D2', 'CC3', 'FA1', '551', None, 'S', 200.0, 200.0, 4),
+        ('2024-02', 'D1', 'CC1', 'FA1', '551', 'SupA', 'S', 120.0, 120.0, 3),
+        ('2024-02', 'D2', 'CC3', 'FA1', '553', 'SupC', 'H', 40.0, 40.0, 1),
+        ('2024-03', 'D2', 'CC4', 'FA3', '552', 'SupB', 'S', 70.0, 70.0, 2),
+        (None, 'D1', 'CC2', 'FA2', '552', 'SupB', 'S', 10.0, 10.0, 1),
+    ], columns=CUBE_DIMENSIONS + ['debit_credit_ind', 'value_sum', 'abs_sum', 'row_count'])
+
+    def setUp(self):
+        with patch('app.services.cube_service.get_dimension_dictionary', return_value=DimensionDictionary()):
+            self.cube = LedgerCube.from_rollup(self.ROLLUP, '1:8:1')
+
+    @staticmethod
+    def _amounts(result, dimension):
+        return {row[dimension]: row['amount'] for row in result['rows']}
+
+    def test_grand_total(self):
+        """Test that a query without group_by totals every cell with signed amounts"""
+        result = self.cube.query(measures=['amount', 'count', 'debit_amount', 'credit_amount'])
+        self.assertEqual(result['rows'], [{
+            'amount': 100.0 - 30.0 + 50.0 + 200.0 + 120.0 - 40.0 + 70.0 + 10.0,
+            'count': 15, 'debit_amount': 550.0, 'credit_amount': 70.0,
+        }])
+        self.assertEqual(result['totals']['count'], 15)
+
+    def test_roll_up_matches_drill_down(self):
+        """Test that regrouping by fewer dimensions gives the sums of the finer groups"""
+        coarse = self._amounts(self.cube.query(group_by=['directorate']), 'directorate')
+        fine = self.cube.query(group_by=['directorate', 'cost_center_id'])
+        self.assertEqual(fine['groups'], 4)
+        rolled = {}
+        for row in fine['rows']:
+            rolled[row['directorate']] = rolled.get(row['directorate'], 0.0) + row['amount']
+        self.assertEqual(coarse, rolled)
+        self.assertEqual(coarse, {'D1': 250.0, 'D2': 230.0})
+
+    def test_filters_slice_and_dice(self):
+        """Test that filters take one value or a list, and unknown values match nothing"""
+        one = self.cube.query(group_by=['cost_center_id'], filters={'directorate': 'D1'})
+        self.assertEqual(self._amounts(one, 'cost_center_id'), {'CC1': 190.0, 'CC2': 60.0})
+        diced = self.cube.query(filters={'directorate': ['D1', 'D2'], 'general_ledger_account': ['551']})
+        self.assertEqual(diced['totals']['amount'], 390.0)
+        self.assertEqual(self.cube.query(filters={'directorate': 'D9'})['totals']['count'], 0)
+
+    def test_time_range_is_inclusive_and_skips_missing_months(self):
+        """Test that time_range bounds are inclusive and cells without a month never match"""
+        result = self.cube.query(group_by=['month_year'], time_range={'from': '2024-02', 'to': '2024-03'})
+        self.assertEqual(self._amounts(result, 'month_year'), {'2024-02': 80.0, '2024-03': 70.0})
+        result = self.cube.query(time_range={'to': '2024-01'})
+        self.assertEqual(result['totals']['amount'], 320.0)
+
+    def test_invalid_query_raises_invalid_parameter_error(self):
+        """Test that malformed queries raise InvalidParameterError instead of failing inside pandas"""
+        for query in [
+            {'filters': ['x']},
+            {'time_range': '2023'},
+            {'time_range': {'from': 202401}},
+            {'group_by': 'directorate'},
+            {'group_by': ['region']},
+            {'measures': ['total']},
+            {'order_by': 'median'},
+            {'filters': {'region': 'West'}},
+        ]:
+            with self.assertRaises(InvalidParameterError, msg=str(query)):
+                self.cube.query(**query)
+
+class SignedAmountsTestCase(unittest.TestCase):
+    """Debit/credit indicators decide the sign of a posting, not the stored sign of its value"""
+
+    def test_credit_negative_debit_positive(self):
+        """Test that H postings are negative and S postings positive whatever their stored sign"""
+        amounts = signed_amounts([100.0, -100.0, 250.0, -250.0], ['H', 'H', 'S', 'S'])
+        np.testing.assert_array_equal(amounts, [-100.0, -100.0, 250.0, 250.0])
+
+    def test_other_indicators_and_missing_values(self):
+        """Test that other indicators keep the value as stored and missing or non-numeric values count as 0"""
+        amounts = signed_amounts(
+            pd.Series([-40.0, 40.0, None, 'abc', 12.5, np.nan]),
+            pd.Series(['X', None, 'S', 'H', '', 'H'])
+        )
+        np.testing.assert_array_equal(amounts, [-40.0, 40.0, 0.0, 0.0, 12.5, 0.0])
+        self.assertEqual(amounts.dtype, np.float64)
+
+    def test_rollup_sums_match_posting_sums(self):
+        """Test that signing rollup totals gives the same sums as signing each posting"""
+        postings = pd.DataFrame({
+            'group': ['a', 'a', 'a', 'b', 'b', 'c'],
+            'debit_credit_ind': ['H', 'H', 'S', 'S', 'X', 'X'],
+            'value': [10.0, -5.0, -7.0, 3.0, -2.0, 4.0],
+        })
+        postings['amount'] = signed_amounts(postings['value'], postings['debit_credit_ind'])
+        rollup = postings.groupby(['group', 'debit_credit_ind']).agg(
+            value_sum=('value', 'sum'), abs_sum=('value', lambda v: v.abs().sum()), amount=('amount', 'sum')
+        ).reset_index()
+        np.testing.assert_allclose(signed_rollup_amounts(rollup), rollup['amount'])
+
+
+class ResultCacheTestCase(unittest.TestCase):
+    """The result cache is bounded, least recently used out first, and never serves another data version"""
+
+    def test_lru_evicts_least_recently_used(self):
+        """Test that the entry bound drops the entry used longest ago, not the oldest inserted"""
+        cache = result_cache.LRUResultCache(max_entries=2, max_bytes=1000)
+        cache.put('a', 'v1', 'x' * 10)
+        cache.put('b', 'v1', 'y' * 10)
+        self.assertEqual(cache.get('a', 'v1'), 'x' * 10)
+        cache.put('c', 'v1', 'z' * 10)
+        self.assertIsNone(cache.get('b', 'v1'))
+        self.assertEqual(cache.get('a', 'v1'), 'x' * 10)
+        self.assertEqual(len(cache), 2)
+
+    def test_lru_byte_bound(self):
+        """Test that the size bound evicts until the payloads fit and skips payloads that never fit"""
+        cache = result_cache.LRUResultCache(max_entries=10, max_bytes=100)
+        cache.put('a', 'v1', 'x' * 40)
+        cache.put('b', 'v1', 'y' * 40)
+        cache.put('c', 'v1', 'z' * 40)
+        self.assertIsNone(cache.get('a', 'v1'))
+        self.assertEqual(cache.size, 80)
+        cache.put('d', 'v1', 'w' * 101)
+        self.assertIsNone(cache.get('d', 'v1'))
+        self.assertEqual(len(cache), 2)
+
+    def test_new_version_drops_entries(self):
+        """Test that a lookup at a new data version empties the cache"""
+        cache = result_cache.LRUResultCache(max_entries=10, max_bytes=1000)
+        cache.put('a', 'v1', 'x')
+        self.assertIsNone(cache.get('a', 'v2'))
+        self.assertEqual((len(cache), cache.size), (0, 0))
+        self.assertIsNone(cache.get('a', 'v1'))
+
+    def test_cached_result_recomputed_after_version_change(self):
+        """Test that get_cached_result computes once per data version"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"rows": len(calls)}
+
+        memory = result_cache.LRUResultCache(max_entries=10, max_bytes=10000)
+        with patch.object(result_cache, '_memory', memory), \
+                patch.object(result_cache.Config, 'RESULT_CACHE_BACKEND', 'memory'), \
+                patch.object(result_cache, 'current_data_version') as version:
+            version.return_value = '1:10:1'
+            self.assertEqual(result_cache.get_cached_result('eda', {}, compute), {"rows": 1})
+            self.assertEqual(result_cache.get_cached_result('eda', {}, compute), {"rows": 1})
+            version.return_value = '2:12:1'
+            self.assertEqual(result_cache.get_cached_result('eda', {}, compute), {"rows": 2})
+        self.assertEqual(len(calls), 2)
+
+    def test_errors_are_not_cached(self):
+        """Test that results carrying an error key are computed again"""
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return {"error": "boom"}
+
+        memory = result_cache.LRUResultCache(max_entries=10, max_bytes=10000)
+        with patch.object(result_cache, '_memory', memory), \
+                patch.object(result_cache.Config, 'RESULT_CACHE_BACKEND', 'memory'), \
+                patch.object(result_cache, 'current_data_version', return_value='1:10:1'):
+            result_cache.get_cached_result('eda', {}, compute)
+            result_cache.get_cached_result('eda', {}, compute)
+        self.assertEqual(len(calls), 2)
+
+    def test_analysis_params_normalize_equivalent_requests(self):
+        """Test that reordered filter values and spelled-out defaults give the same key parameters"""
+        first = LedgerFilter.from_args({'directorate': 'D2,D1'})
+        second = LedgerFilter.from_args({'directorate': ['D1', 'D2', 'D1']})
+        self.assertEqual(
+            result_cache.analysis_params(first, detector_params('statistical', {})),
+            result_cache.analysis_params(second, detector_params('statistical', {'threshold': '2.5'}))
+        )
+        self.assertNotEqual(
+            result_cache.analysis_params(first, detector_params('statistical', {})),
+            result_cache.analysis_params(first, detector_params('statistical', {'threshold': '3'}))
+        )
+
+    def test_malformed_parameters_raise_invalid_parameter_error(self):
+        """Test that malformed request parameters raise InvalidParameterError"""
+        for method, args in [
+            ('statistical', {'threshold': 'abc'}),
+            ('statistical', {'group_by': 'supplier'}),
+            ('ml', {'contamination': '0.9'}),
+            ('trend', {'limit': '1.5'}),
+            ('comprehensive', {'executor': 'process'}),
+            ('unknown', {}),
+        ]:
+            with self.assertRaises(InvalidParameterError, msg=f"{method} {args}"):
+                detector_params(method, args)
+        with self.assertRaises(InvalidParameterError):
+            LedgerFilter.from_args({'period_from': '2024-1'})
+
+
+class ContributionAnalysisTestCase(unittest.TestCase):
+    """Volume, mix and rate effects decompose each member's change exactly"""
+
+    ROLLUP = pd.DataFrame([
+        ('2024-01', 'D1', 'CC1', 1000.0, 10),
+        ('2024-01', 'D1', 'CC2', -300.0, 3),
+        ('2024-01', 'D2', 'CC3', 450.0, 9),
+        ('2024-01', 'D3', 'CC4', 80.0, 2),   # gone in February
+        ('2024-02', 'D1', 'CC1', 1500.0, 12),
+        ('2024-02', 'D1', 'CC2', -100.0, 5),
+        ('2024-02', 'D2', 'CC3', 450.0, 6),
+        ('2024-02', 'D2', 'CC5', 700.0, 7),  # new in February
+        ('2023-12', 'D1', 'CC1', 9999.0, 99),  # outside the month pair
+    ], columns=['month_year', 'directorate', 'cost_center_id', 'amount', 'row_count'])
+
+    def test_effects_sum_to_each_change(self):
+        """Test that volume + mix + rate equals every member's change, including members new or gone"""
+        changes = _member_changes(self.ROLLUP, ['directorate', 'cost_center_id'], '2024-01', '2024-02')
+        np.testing.assert_allclose(
+            changes['volume_effect'] + changes['mix_effect'] + changes['rate_effect'], changes['change'], atol=1e-9
+        )
+        gone = changes[changes['member'] == 'CC4'].iloc[0]
+        self.assertEqual((gone['from_amount'], gone['to_amount'], gone['rate_effect']), (80.0, 0.0, 0.0))
+
+    def test_member_changes_sum_to_total_change(self):
+        """Test that each dimension's member changes add up to the total change between the months"""
+        changes = _member_changes(self.ROLLUP, ['directorate', 'cost_center_id'], '2024-01', '2024-02')
+        total_change = 2550.0 - 1230.0
+        for dimension, members in changes.groupby('dimension'):
+            self.assertAlmostEqual(members['change'].sum(), total_change, places=9, msg=dimension)
+            effects = members[['volume_effect', 'mix_effect', 'rate_effect']].to_numpy().sum()
+            self.assertAlmostEqual(effects, total_change, places=9, msg=dimension)
+
+
+class DrillDownTestCase(unittest.TestCase):
+    """The drill-down search keeps nodes at the threshold and never descends below pruned ones"""
+
+    HIERARCHY = ['directorate', 'cost_center_id', 'general_ledger_account']
+    CELLS = pd.DataFrame([
+        ('D1', 'CC1', 'A1', 0.0, 60.0),
+        ('D1', 'CC1', 'A2', 0.0, 40.0),    # CC1 changes by exactly the threshold
+        ('D1', 'CC2', 'A3', 0.0, 99.99),   # just below it
+        ('D2', 'CC3', 'A4', 0.0, 200.0),   # large children under a small net change
+        ('D2', 'CC4', 'A5', 150.0, 0.0),
+        ('D3', 'CC5', 'A6', 100.0, 0.0),   # a decrease of exactly the threshold
+    ], columns=HIERARCHY + ['from_amount', 'to_amount'])
+
+    def test_prunes_below_threshold(self):
+        """Test that nodes whose absolute change reaches the minimum are kept and the others pruned"""
+        levels, _ = _drill_down(self.CELLS, self.HIERARCHY, 100.0, 3)
+        kept = [sorted(level.index.tolist()) for level in levels]
+        self.assertEqual(kept, [
+            ['D1', 'D3'],
+            [('D1', 'CC1'), ('D3', 'CC5')],
+            [('D3', 'CC5', 'A6')],
+        ])
+        self.assertEqual(levels[2].loc[('D3', 'CC5', 'A6'), 'change'], -100.0)
+
+    def test_never_groups_below_pruned_nodes(self):
+        """Test that the children of pruned nodes are never evaluated"""
+        _, evaluated = _drill_down(self.CELLS, self.HIERARCHY, 100.0, 3)
+        # D1, D2, D3; then CC1, CC2, CC5 (not CC3 or CC4 under D2); then A1, A2, A6
+        self.assertEqual(evaluated, 9)
+
+    def test_max_depth_and_empty_levels(self):
+        """Test that the search stops at max_depth, or at the first level with nothing kept"""
+        levels, evaluated = _drill_down(self.CELLS, self.HIERARCHY, 100.0, 1)
+        self.assertEqual((len(levels), evaluated), (1, 3))
+        levels, evaluated = _drill_down(self.CELLS, self.HIERARCHY, 1000.0, 3)
+        self.assertEqual((levels, evaluated), ([], 3))
+
+
+if __name__ == '__main__':
+    unittest.main()